@@ -1,6 +1,7 @@
 import os
 from datetime import timedelta
 from pathlib import Path
+from corsheaders.defaults import default_headers
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -119,5 +120,56 @@ CORS_ALLOWED_ORIGINS = [
     "http://localhost:8000",
     "http://127.0.0.1:8000",
 ]
+# Clients send Idempotency-Key on record-creating POSTs and may read
+# Idempotent-Replayed on the answer
+CORS_ALLOW_HEADERS = (*default_headers, "idempotency-key")
+CORS_EXPOSE_HEADERS = ["Idempotent-Replayed"]
 
 DAILY_LOG_LATE_ENTRY_THRESHOLD_MINUTES = 60
+
+# Resident timeline
+# "merge" merges the three sources in Python, "union" does it in one UNION ALL query,
+# "materialized" reads the TimelineEvent table (populate with `manage.py rebuild_timeline`)
+TIMELINE_ENGINE = "merge"
+# Render events from .values() rows instead of the DRF timeline serializers
+# (same JSON, see `manage.py benchmark_timeline`)
+TIMELINE_FAST_SERIALIZATION = True
+# Paging (?limit=&cursor=)
+TIMELINE_PAGE_SIZE = 50
+TIMELINE_MAX_PAGE_SIZE = 200
+# Rows fetched per round trip by the NDJSON timeline export
+TIMELINE_STREAM_CHUNK_SIZE = 500
+# ?since= polls rescan this many seconds of history before the token, so
+# writes from transactions that committed late are not missed
+TIMELINE_SINCE_OVERLAP = 60
+# Async timeline view: read the three sources on separate threads, each
+# opening and closing its own database connection per request. Only worth it
+# behind a connection pooler such as PgBouncer
+TIMELINE_ASYNC_CONCURRENT_QUERIES = False
+
+# Incident/MAR history endpoints read diffs from the HistoryChange store
+# (run `manage.py backfill_history_changes` once after migrating)
+HISTORY_CHANGE_STORE = True
+# Paging (?limit=&cursor=)
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+# Records per /bulk-history-summary/?ids= request
+HISTORY_BULK_MAX_IDS = 100
+# Store large history text fields as deltas against the previous revision, with
+# a full copy every HISTORY_SNAPSHOT_INTERVAL revisions. `manage.py compact_history`
+# converts existing rows (and --expand converts back; do that before turning this off)
+HISTORY_COMPACT_TEXT = False
+HISTORY_SNAPSHOT_INTERVAL = 10
+# `manage.py archive_history` moves a discharged resident's record history to
+# ArchivedHistory once the record has been unchanged this long
+HISTORY_ARCHIVE_AFTER_DAYS = 365
+
+# Records per POST /api/mar/bulk/ (one medication round)
+MAR_BULK_MAX_RECORDS = 100
+# Logs per POST /api/daily-logs/batch/ (end of shift handover)
+DAILY_LOG_BATCH_MAX_RECORDS = 100
+# How long a stored Idempotency-Key response is replayed for
+# (`manage.py purge_idempotency_keys` clears expired ones)
+IDEMPOTENCY_KEY_TTL_HOURS = 24
+# Mutations per POST /api/sync/ (offline queue)
+SYNC_MAX_MUTATIONS = 500
@@ -5,7 +5,13 @@ from datetime import timedelta
 from django import forms
 from django.core.exceptions import PermissionDenied
 from simple_history.admin import SimpleHistoryAdmin
-from simple_history.utils import update_change_reason
+from .history import (
+    COMPACT_TEXT_FIELDS,
+    HISTORY_RECORD_TYPES,
+    change_reason,
+    compact_text_enabled,
+    inflate_history,
+)
 from .models import (
     EditReasonCode,
     Resident,
@@ -76,6 +82,31 @@ class CareGradeAdminMixin:
         )
 
 
+class CompactHistoryAdminMixin:
+    """
+    With HISTORY_COMPACT_TEXT on, historical rows hold deltas instead of
+    text. SimpleHistoryAdmin builds the history (revert) form straight from
+    the row, so expand the text first; otherwise the form shows blanks and
+    reverting saves them over the live record.
+    """
+
+    def history_form_view(self, request, object_id, version_id, extra_context=None):
+        request.history_version_id = version_id
+        return super().history_form_view(
+            request, object_id, version_id, extra_context=extra_context
+        )
+
+    def get_form(self, request, obj=None, change=False, **kwargs):
+        version_id = getattr(request, "history_version_id", None)
+        if obj is not None and version_id is not None and compact_text_enabled():
+            history_model = type(obj).history.model
+            row = history_model.objects.get(history_id=version_id)
+            inflate_history([row])
+            for name in COMPACT_TEXT_FIELDS.get(HISTORY_RECORD_TYPES[type(obj)], ()):
+                setattr(obj, name, getattr(row, name))
+        return super().get_form(request, obj, change=change, **kwargs)
+
+
 class RequireEditReasonOnChangeForm(forms.ModelForm):
     edit_reason_field = "edit_reason_detail"
 
@@ -206,7 +237,7 @@ class ShiftAdmin(admin.ModelAdmin):
 
 
 @admin.register(DailyLog)
-class DailyLogAdmin(CareGradeAdminMixin, SimpleHistoryAdmin):
+class DailyLogAdmin(CareGradeAdminMixin, CompactHistoryAdminMixin, SimpleHistoryAdmin):
     form = DailyLogAdminForm
     owner_field = "author"
 
@@ -216,16 +247,18 @@ class DailyLogAdmin(CareGradeAdminMixin, SimpleHistoryAdmin):
 
     def save_model(self, request, obj, form, change):
         obj._history_user = request.user
-        super().save_model(request, obj, form, change)
 
         # Mirror DRF bahaviour. Write change reason on meaningful changes or late-entry create
-        reason = (form.cleaned_data.get("edit_reason_detail") or "").strip()
+        reason = change_reason(
+            DailyLog, form.cleaned_data.get("edit_reason_detail")
+        )
         if reason:
-            update_change_reason(obj, reason)
+            obj._change_reason = reason
+        super().save_model(request, obj, form, change)
 
 
 @admin.register(Incident)
-class IncidentAdmin(CareGradeAdminMixin, SimpleHistoryAdmin):
+class IncidentAdmin(CareGradeAdminMixin, CompactHistoryAdminMixin, SimpleHistoryAdmin):
     form = AuditIntentAdminForm
     owner_field = "reported_by"
     list_display = (
@@ -246,13 +279,15 @@ class IncidentAdmin(CareGradeAdminMixin, SimpleHistoryAdmin):
     def save_model(self, request, obj, form, change):
         # Middleware will do this, but set it anyway
         obj._history_user = request.user
-        super().save_model(request, obj, form, change)
 
         # Mirror DRF beaviour
         if change:
-            reason = (form.cleaned_data.get("edit_reason_detail") or "").strip()
+            reason = change_reason(
+                Incident, form.cleaned_data.get("edit_reason_detail")
+            )
             if reason:
-                update_change_reason(obj, reason)
+                obj._change_reason = reason
+        super().save_model(request, obj, form, change)
 
 
 @admin.register(CarePlan)
@@ -281,7 +316,9 @@ class MedicationAdmin(admin.ModelAdmin):
 
 
 @admin.register(MedicationAdministrationRecord)
-class MedicationAdministrationRecordAdmin(CareGradeAdminMixin, SimpleHistoryAdmin):
+class MedicationAdministrationRecordAdmin(
+    CareGradeAdminMixin, CompactHistoryAdminMixin, SimpleHistoryAdmin
+):
     form = AuditIntentAdminForm
     owner_field = "administered_by"
     list_display = (
@@ -296,9 +333,12 @@ class MedicationAdministrationRecordAdmin(CareGradeAdminMixin, SimpleHistoryAdmi
 
     def save_model(self, request, obj, form, change):
         obj._history_user = request.user
-        super().save_model(request, obj, form, change)
 
         if change:
-            reason = (form.cleaned_data.get("edit_reason_detail") or "").strip()
+            reason = change_reason(
+                MedicationAdministrationRecord,
+                form.cleaned_data.get("edit_reason_detail"),
+            )
             if reason:
-                update_change_reason(obj, reason)
+                obj._change_reason = reason
+        super().save_model(request, obj, form, change)
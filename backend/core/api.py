@@ -1,27 +1,81 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.views import View
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework_simplejwt.authentication import JWTAuthentication
-from .models import (
-    Resident,
-    DailyLog,
-    Incident,
-    MedicationAdministrationRecord,
-)
-from .serializers import (
-    DailyLogTimelineSerializer,
-    IncidentTimelineSerializer,
-    MARTimelineSerializer,
+from rest_framework_simplejwt.exceptions import InvalidToken
+from .audit import AuditFilters, audit_page, decode_audit_cursor, iter_audit
+from .cursors import parse_limit
+from .history import parse_as_of, parse_history_limit
+from .idempotency import idempotent
+from .models import Resident
+from .permissions import IsManager, IsStaff
+from .sync import apply_mutations, parse_mutations
+from .timeline import (
+    TimelineFilters,
+    amerge_timeline,
+    decode_since_token,
+    decode_timeline_cursor,
+    encode_since_token,
+    get_timeline_engine,
+    iter_timeline,
+    merge_timeline,
+    timeline_changes,
+    timeline_etag,
+    timeline_watermark,
 )
 
 
+def _parse_limit(raw):
+    return parse_limit(raw, "TIMELINE_PAGE_SIZE", "TIMELINE_MAX_PAGE_SIZE")
+
+
+def _parse_as_of_param(params, since=None):
+    raw = params.get("as_of")
+    if not raw:
+        return None
+    if since is not None:
+        raise ValueError("as_of can't be combined with since.")
+    return parse_as_of(raw)
+
+
 class ResidentTimelineAPIView(APIView):
     """
     Returns a combined, read-only timeline for a resident:
     - Daily logs
     - Incidents
     - Medication administrations
+
+    Pass ?limit= (and ?cursor= from the previous response) to page through
+    the timeline newest first. Without either, the whole timeline is returned.
+
+    ?engine=merge|union|materialized picks how the timeline is assembled
+    (defaults to the TIMELINE_ENGINE setting) so they can be compared on the
+    same resident.
+
+    Responses carry an ETag built from the source tables' history watermark.
+    A matching If-None-Match gets a 304 without the timeline being rebuilt.
+
+    Filters (applied in the database, per source):
+    - ?event_type=INCIDENT,DAILY_LOG
+    - ?from= / ?to= ISO dates or datetimes (a plain "to" date includes that day)
+    - ?severity=HIGH (incidents only; other event types are left out)
+
+    Every response includes a "since" token. Sending it back as ?since= returns
+    only events created or amended after it (and the ids of any that were
+    removed), with a fresh token for the next poll.
+
+    ?as_of=<ISO datetime or date> shows the timeline as it read at that moment,
+    rebuilt from history (always with the merge engine).
     """
 
     authentication_classes = [JWTAuthentication]
@@ -35,47 +89,273 @@ class ResidentTimelineAPIView(APIView):
                 status=status.HTTP_404_NOT_FOUND,
             )
 
-        logs = DailyLog.objects.filter(resident=resident).select_related("author")
-        incidents = Incident.objects.filter(resident=resident).select_related(
-            "reported_by"
+        cursor = request.query_params.get("cursor")
+        limit = request.query_params.get("limit")
+        since = request.query_params.get("since")
+
+        # No paging params keeps the original "whole timeline" response
+        paginate = cursor is not None or limit is not None
+
+        try:
+            limit = _parse_limit(limit) if paginate else None
+            cursor = decode_timeline_cursor(cursor) if cursor else None
+            engine = get_timeline_engine(request.query_params.get("engine"))
+            since = decode_since_token(since) if since else None
+            filters = TimelineFilters.from_query_params(request.query_params)
+            as_of = _parse_as_of_param(request.query_params, since)
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Read the watermark first so nothing written during this request is
+        # skipped by the next ?since= poll
+        watermark = timeline_watermark(resident)
+        etag = timeline_etag(
+            resident.id, watermark, variant=request.query_params.urlencode()
         )
-        mar = MedicationAdministrationRecord.objects.filter(
-            medication__resident=resident
-        ).select_related("administered_by", "medication")
-
-        combined = []
-
-        for item in DailyLogTimelineSerializer(logs, many=True).data:
-            combined.append(
-                {
-                    **item,
-                    "timestamp": item["created_at"],
-                }
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+
+        payload = {
+            "resident_id": resident.id,
+            "resident_name": resident.legal_name,
+        }
+        if since is not None:
+            events, removed = timeline_changes(resident.id, since, filters=filters)
+            payload.update(events=events, removed=removed)
+        elif as_of is not None:
+            events, next_cursor = merge_timeline(
+                resident.id, cursor=cursor, limit=limit, filters=filters, as_of=as_of
+            )
+            payload.update(events=events, next_cursor=next_cursor)
+        else:
+            events, next_cursor = engine(
+                resident.id, cursor=cursor, limit=limit, filters=filters
             )
+            payload.update(events=events, next_cursor=next_cursor)
+        payload["since"] = encode_since_token(watermark)
+
+        response = Response(payload, status=status.HTTP_200_OK)
+        response["ETag"] = etag
+        # Let the browser keep the body but always revalidate with us
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
 
-        for item in IncidentTimelineSerializer(incidents, many=True).data:
-            combined.append(
-                {
-                    **item,
-                    "timestamp": item["occurred_at"],
-                }
+
+class ResidentTimelineStreamAPIView(APIView):
+    """
+    Whole-record export of a resident's timeline as newline-delimited JSON,
+    one event per line, newest first. Rows are streamed as they are read so
+    large records start arriving immediately and are never held in memory.
+    Accepts the same event_type / from / to / severity filters as the timeline.
+    """
+
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, resident_id):
+        resident = Resident.objects.filter(id=resident_id).first()
+        if not resident:
+            return Response(
+                {"detail": "Resident not found."},
+                status=status.HTTP_404_NOT_FOUND,
             )
 
-        for item in MARTimelineSerializer(mar, many=True).data:
-            combined.append(
-                {
-                    **item,
-                    "timestamp": item["administered_at"],
-                }
+        try:
+            filters = TimelineFilters.from_query_params(request.query_params)
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        chunk_size = int(getattr(settings, "TIMELINE_STREAM_CHUNK_SIZE", 500))
+        lines = (
+            json.dumps(event, cls=JSONEncoder) + "\n"
+            for event in iter_timeline(
+                resident.id, chunk_size=chunk_size, filters=filters
             )
+        )
+
+        response = StreamingHttpResponse(lines, content_type="application/x-ndjson")
+        response["Content-Disposition"] = (
+            f'attachment; filename="resident-{resident.id}-timeline.ndjson"'
+        )
+        return response
+
+
+class HomeTimelineAPIView(APIView):
+    """
+    Home-wide activity feed: the same merged timeline, across every active
+    resident, always cursor paginated (?limit=&cursor=).
 
-        combined.sort(key=lambda e: e["timestamp"], reverse=True)
+    Takes the timeline filters plus:
+    - ?resident=1,2 to narrow to some residents
+    - ?shift=<id> for one shift (daily logs tagged with it, other events
+      inside its time window)
+    - ?as_of=<ISO datetime or date> the feed as it read at that moment
+    """
+
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsStaff]
+
+    def get(self, request):
+        try:
+            limit = _parse_limit(request.query_params.get("limit"))
+            cursor = request.query_params.get("cursor")
+            cursor = decode_timeline_cursor(cursor) if cursor else None
+            engine = get_timeline_engine(request.query_params.get("engine"))
+            filters = TimelineFilters.from_query_params(request.query_params)
+            as_of = _parse_as_of_param(request.query_params)
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if as_of is not None:
+            events, next_cursor = merge_timeline(
+                cursor=cursor, limit=limit, filters=filters, as_of=as_of
+            )
+        else:
+            events, next_cursor = engine(cursor=cursor, limit=limit, filters=filters)
 
         return Response(
+            {"events": events, "next_cursor": next_cursor},
+            status=status.HTTP_200_OK,
+        )
+
+
+class ResidentTimelineAsyncView(View):
+    """
+    Async twin of ResidentTimelineAPIView for the ASGI entry point
+    (config.asgi). With TIMELINE_ASYNC_CONCURRENT_QUERIES on, the three
+    source queries run at the same time, so under database latency a page
+    costs about the slowest query, not the sum.
+
+    DRF views are sync-only, so JWT auth is done here by hand. Accepts
+    ?limit=, ?cursor= and the timeline filters.
+    """
+
+    async def get(self, request, resident_id):
+        try:
+            auth = await sync_to_async(JWTAuthentication().authenticate)(request)
+        except (AuthenticationFailed, InvalidToken) as exc:
+            return JsonResponse({"detail": str(exc.detail)}, status=401)
+        if auth is None:
+            return JsonResponse(
+                {"detail": "Authentication credentials were not provided."},
+                status=401,
+            )
+
+        resident = await Resident.objects.filter(id=resident_id).afirst()
+        if not resident:
+            return JsonResponse({"detail": "Resident not found."}, status=404)
+
+        params = request.GET
+        cursor = params.get("cursor")
+        limit = params.get("limit")
+        paginate = cursor is not None or limit is not None
+
+        try:
+            limit = _parse_limit(limit) if paginate else None
+            cursor = decode_timeline_cursor(cursor) if cursor else None
+            filters = await sync_to_async(TimelineFilters.from_query_params)(params)
+        except ValueError as exc:
+            return JsonResponse({"detail": str(exc)}, status=400)
+
+        events, next_cursor = await amerge_timeline(
+            resident.id, cursor=cursor, limit=limit, filters=filters
+        )
+
+        return JsonResponse(
             {
                 "resident_id": resident.id,
                 "resident_name": resident.legal_name,
-                "events": combined,
+                "events": events,
+                "next_cursor": next_cursor,
             },
-            status=status.HTTP_200_OK,
+            encoder=JSONEncoder,
         )
+
+
+class AuditChangesAPIView(APIView):
+    """
+    Home-wide audit feed for managers/inspectors: every revision of daily
+    logs, incidents and MAR, newest first, with its field changes. Always
+    cursor paginated (?limit=&cursor=).
+
+    Filters:
+    - ?from= / ?to= ISO date or datetime (a plain ?to= date covers that day)
+    - ?user=1,2 revisions written by these users
+    - ?reason=TYPO,LATE_ENTRY edit reason codes
+    - ?record_type=INCIDENT,MEDICATION,DAILY_LOG
+    """
+
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsManager]
+
+    def get(self, request):
+        try:
+            limit = parse_history_limit(request.query_params.get("limit"))
+            cursor = request.query_params.get("cursor")
+            cursor = decode_audit_cursor(cursor) if cursor else None
+            filters = AuditFilters.from_query_params(request.query_params)
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        events, next_cursor = audit_page(cursor=cursor, limit=limit, filters=filters)
+        return Response({"events": events, "next_cursor": next_cursor})
+
+
+class AuditChangesStreamAPIView(APIView):
+    """
+    The whole (filtered) audit feed as newline-delimited JSON, one revision
+    per line, newest first. Takes the same filters as the audit feed.
+    """
+
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsManager]
+
+    def get(self, request):
+        try:
+            filters = AuditFilters.from_query_params(request.query_params)
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        chunk_size = int(getattr(settings, "TIMELINE_STREAM_CHUNK_SIZE", 500))
+        lines = (
+            json.dumps(event, cls=JSONEncoder) + "\n"
+            for event in iter_audit(chunk_size=chunk_size, filters=filters)
+        )
+
+        response = StreamingHttpResponse(lines, content_type="application/x-ndjson")
+        response["Content-Disposition"] = 'attachment; filename="audit-changes.ndjson"'
+        return response
+
+
+class SyncAPIView(APIView):
+    """
+    Offline sync: POST {"mutations": [...]} to apply a queue of edits made
+    without signal, in order and in one transaction.
+
+    Each mutation:
+    - id: client reference, echoed back in its result
+    - op: "create" or "update"
+    - type: DAILY_LOG, INCIDENT or MEDICATION
+    - data: the fields, as for POST/PATCH on the record endpoint
+    - record_id and base_history_date (updates only): the record, and the
+      history_date of the revision the edit was made against
+
+    Every mutation gets a result with a status: created, updated, invalid,
+    forbidden, not_found, or conflict (the record changed after
+    base_history_date; the current record is returned). Successful results
+    carry the new history_date to use as the next base_history_date.
+    Accepts an Idempotency-Key header.
+    """
+
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsStaff]
+
+    @idempotent
+    def post(self, request):
+        try:
+            mutations = parse_mutations(request.data)
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({"results": apply_mutations(request, mutations)})
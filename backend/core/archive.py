@@ -0,0 +1,301 @@
+"""
+Cold storage for the history of discharged residents.
+
+Once a resident is inactive and one of their records has not changed for
+HISTORY_ARCHIVE_AFTER_DAYS, the record's historical rows are moved out of
+the hot simple_history table into a compressed ArchivedHistory row. The
+history endpoints rehydrate them on demand; the home-wide audit feed only
+covers the hot tables.
+"""
+
+import json
+import zlib
+from collections import defaultdict
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .history import (
+    HISTORY_ORDERING,
+    HISTORY_RECORD_TYPES,
+    inflate_history,
+    value_to_text,
+)
+from .models import ArchivedHistory, HistoryTextDelta
+from .timeline import source_for_model
+
+
+def _pack(rows):
+    fields = type(rows[0])._meta.concrete_fields
+    data = [
+        {f.attname: value_to_text(getattr(row, f.attname)) for f in fields}
+        for row in rows
+    ]
+    return zlib.compress(json.dumps(data, separators=(",", ":")).encode())
+
+
+def _unpack(history_model, payload):
+    fields = {f.attname: f for f in history_model._meta.concrete_fields}
+    rows = []
+    for data in json.loads(zlib.decompress(bytes(payload))):
+        rows.append(
+            history_model(
+                **{
+                    name: None if value is None else fields[name].to_python(value)
+                    for name, value in data.items()
+                }
+            )
+        )
+    return rows
+
+
+def archived_history(history_model, record_ids):
+    """
+    Rehydrated historical rows for ``record_ids``, newest first, with
+    history_user loaded. Records that were never archived contribute
+    nothing.
+    """
+    record_type = HISTORY_RECORD_TYPES.get(history_model.instance_type)
+    archives = ArchivedHistory.objects.filter(
+        record_type=record_type, record_id__in=record_ids
+    )
+
+    rows = []
+    for archive in archives:
+        rows.extend(_unpack(history_model, archive.payload))
+    if not rows:
+        return rows
+
+    users = get_user_model()._default_manager.in_bulk(
+        {row.history_user_id for row in rows if row.history_user_id}
+    )
+    for row in rows:
+        row.history_user = users.get(row.history_user_id)
+
+    rows.sort(key=lambda h: (h.history_date, h.history_id), reverse=True)
+    return rows
+
+
+def archived_record_groups(history_model, chunk_size=1000):
+    """
+    Full history, oldest first, of every record with archived history: its
+    archived rows followed by any hot revisions written since, with
+    compacted text expanded. Reads the archives and hot rows per chunk.
+    """
+    record_type = HISTORY_RECORD_TYPES.get(history_model.instance_type)
+    archives = (
+        ArchivedHistory.objects.filter(record_type=record_type)
+        .order_by("record_id")
+        .iterator(chunk_size=chunk_size)
+    )
+    while chunk := list(islice(archives, chunk_size)):
+        hot = defaultdict(list)
+        rows = history_model.objects.filter(
+            id__in=[archive.record_id for archive in chunk]
+        ).order_by("id", "history_date", "history_id")
+        for row in inflate_history(list(rows)):
+            hot[row.id].append(row)
+
+        for archive in chunk:
+            rows = _unpack(history_model, archive.payload)
+            rows.sort(key=lambda h: (h.history_date, h.history_id))
+            yield rows + hot[archive.record_id]
+
+
+def archived_revision_before(history_instance):
+    """
+    The newest archived revision of the same record older than
+    ``history_instance``, or None.
+    """
+    key = (history_instance.history_date, history_instance.history_id)
+    for row in archived_history(type(history_instance), [history_instance.id]):
+        if (row.history_date, row.history_id) < key:
+            return row
+    return None
+
+
+def archived_as_of(queryset, when):
+    """
+    Rehydrated revisions, as they stood at ``when``, for the records in
+    ``queryset`` that have archived history and no hot revision by then.
+    Complements core.history.revisions_as_of.
+    """
+    history_model = queryset.model.history.model
+    record_type = HISTORY_RECORD_TYPES.get(queryset.model)
+    if record_type is None:
+        return []
+
+    archived_ids = ArchivedHistory.objects.filter(
+        record_type=record_type,
+        record_id__in=queryset.order_by().values("pk"),
+        first_history_date__lte=when,
+    ).values_list("record_id", flat=True)
+    record_ids = set(archived_ids)
+    if not record_ids:
+        return []
+    hot_ids = set(
+        history_model.objects.filter(
+            id__in=record_ids, history_date__lte=when
+        ).values_list("id", flat=True)
+    )
+
+    rows = {}
+    for row in archived_history(history_model, record_ids - hot_ids):
+        if row.history_date <= when and row.id not in rows:
+            rows[row.id] = row
+    return [row for row in rows.values() if row.history_type != "-"]
+
+
+# Rewritten when a record's archive is refreshed
+ARCHIVE_FIELDS = (
+    "resident",
+    "row_count",
+    "first_history_date",
+    "last_history_date",
+    "payload",
+    "archived_at",
+)
+
+
+def _archive_after():
+    days = int(getattr(settings, "HISTORY_ARCHIVE_AFTER_DAYS", 365))
+    return timezone.now() - timedelta(days=days)
+
+
+def _archivable(model, cutoff):
+    """
+    Ids, ascending, of records of discharged residents whose newest hot
+    revision is older than ``cutoff``. The discharged records are matched
+    in a subquery rather than read into Python.
+    """
+    source = source_for_model(model)
+    discharged = model.objects.filter(
+        **{f"{source.resident_path}__is_active": False}
+    ).values("id")
+    return list(
+        model.history.model.objects.filter(id__in=discharged)
+        .values("id")
+        .annotate(last=Max("history_date"))
+        .filter(last__lt=cutoff)
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
+
+
+def archive_history(cutoff=None, dry_run=False, chunk_size=200):
+    """
+    Move archivable history out of the hot tables. Returns
+    {record_type: (records, rows)} archived (or that would be, on a dry run).
+
+    Each chunk of records costs a fixed number of queries: its hot rows,
+    residents and existing archives are read in one query each and written
+    back in bulk.
+    """
+    cutoff = cutoff or _archive_after()
+    moved = {}
+
+    for model, record_type in HISTORY_RECORD_TYPES.items():
+        history_model = model.history.model
+        resident_lookup = source_for_model(model).resident_lookup
+        record_ids = _archivable(model, cutoff)
+        records = rows_moved = 0
+
+        for start in range(0, len(record_ids), chunk_size):
+            chunk = record_ids[start : start + chunk_size]
+            rows = inflate_history(
+                list(
+                    history_model.objects.filter(id__in=chunk).order_by(
+                        "id", *HISTORY_ORDERING
+                    )
+                )
+            )
+            by_record = {}
+            for row in rows:
+                by_record.setdefault(row.id, []).append(row)
+
+            records += len(by_record)
+            rows_moved += len(rows)
+            if dry_run:
+                continue
+
+            residents = dict(
+                model.objects.filter(id__in=chunk).values_list("id", resident_lookup)
+            )
+            archives = {
+                archive.record_id: archive
+                for archive in ArchivedHistory.objects.filter(
+                    record_type=record_type, record_id__in=chunk
+                )
+            }
+
+            created, updated = [], []
+            for record_id, record_rows in by_record.items():
+                # Revisions archived by an earlier run (the record was edited
+                # since) are merged back in
+                archive = archives.get(record_id)
+                if archive is not None:
+                    record_rows += _unpack(history_model, archive.payload)
+                record_rows.sort(
+                    key=lambda h: (h.history_date, h.history_id), reverse=True
+                )
+                if archive is None:
+                    archive = ArchivedHistory(
+                        record_type=record_type, record_id=record_id
+                    )
+                    created.append(archive)
+                else:
+                    updated.append(archive)
+                archive.resident_id = residents[record_id]
+                archive.row_count = len(record_rows)
+                archive.first_history_date = record_rows[-1].history_date
+                archive.last_history_date = record_rows[0].history_date
+                archive.payload = _pack(record_rows)
+                archive.archived_at = timezone.now()
+
+            # Text is archived in full, so the deltas go with the rows
+            history_ids = [row.history_id for row in rows]
+            with transaction.atomic():
+                ArchivedHistory.objects.bulk_create(created)
+                ArchivedHistory.objects.bulk_update(updated, ARCHIVE_FIELDS)
+                HistoryTextDelta.objects.filter(
+                    record_type=record_type, history_id__in=history_ids
+                ).delete()
+                history_model.objects.filter(history_id__in=history_ids).delete()
+
+        moved[record_type] = (records, rows_moved)
+    return moved
+
+
+def hot_table_sizes():
+    """
+    {table name: (rows, bytes)} for the tracked historical tables. bytes is
+    None where the database can't tell us.
+    """
+    sizes = {}
+    for model in HISTORY_RECORD_TYPES:
+        history_model = model.history.model
+        table = history_model._meta.db_table
+        sizes[table] = (history_model.objects.count(), _table_bytes(table))
+    return sizes
+
+
+def _table_bytes(table):
+    if connection.vendor == "postgresql":
+        sql = "SELECT pg_total_relation_size(%s)"
+    elif connection.vendor == "sqlite":
+        # Needs SQLite built with the dbstat virtual table
+        sql = "SELECT SUM(pgsize) FROM dbstat WHERE name = %s"
+    else:
+        return None
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    return row[0] if row else None
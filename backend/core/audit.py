@@ -0,0 +1,224 @@
+"""
+Home-wide audit feed: every historical revision of daily logs, incidents and
+MAR, merged newest first on (history_date, record_type, history_id).
+"""
+
+import heapq
+from dataclasses import dataclass
+from datetime import datetime
+from itertools import islice
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .cursors import InvalidCursor, decode_cursor, encode_cursor
+from .history import HISTORY_ORDERING, HISTORY_RECORD_TYPES, revision_diffs
+from .models import EditReasonCode
+from .timeline import format_datetime, parse_bound, split_param
+
+# record_type -> historical model
+AUDIT_SOURCES = {
+    record_type: model.history.model
+    for model, record_type in HISTORY_RECORD_TYPES.items()
+}
+
+HISTORY_EVENTS = {"+": "CREATED", "~": "UPDATED", "-": "DELETED"}
+
+
+def decode_audit_cursor(token: str):
+    """
+    Audit cursors are (history_date, record_type, history_id) of the last
+    revision on the previous page.
+    """
+    parts = decode_cursor(token)
+    if len(parts) != 3:
+        raise InvalidCursor("Invalid cursor.")
+
+    history_date = parse_datetime(parts[0]) if isinstance(parts[0], str) else None
+    if (
+        history_date is None
+        or parts[1] not in AUDIT_SOURCES
+        or not isinstance(parts[2], int)
+    ):
+        raise InvalidCursor("Invalid cursor.")
+    return history_date, parts[1], parts[2]
+
+
+# FILTERS ----------------------------------------------
+
+
+@dataclass(frozen=True)
+class AuditFilters:
+    """
+    - record_types: only these record types
+    - date_from / date_to: history_date >= date_from and < date_to
+    - user_ids: only revisions written by these users
+    - reason_types: only revisions with one of these edit reason codes
+    """
+
+    record_types: frozenset = frozenset()
+    date_from: datetime = None
+    date_to: datetime = None
+    user_ids: frozenset = frozenset()
+    reason_types: frozenset = frozenset()
+
+    @classmethod
+    def from_query_params(cls, params):
+        record_types = split_param(params, "record_type")
+        if record_types - set(AUDIT_SOURCES):
+            raise ValueError(
+                f"record_type must be one of: {', '.join(sorted(AUDIT_SOURCES))}."
+            )
+
+        reason_types = split_param(params, "reason")
+        if reason_types - set(EditReasonCode.values):
+            raise ValueError(
+                f"reason must be one of: {', '.join(EditReasonCode.values)}."
+            )
+
+        user_ids = set()
+        for raw in split_param(params, "user"):
+            if not raw.isdigit():
+                raise ValueError("user must be a list of user ids.")
+            user_ids.add(int(raw))
+
+        date_from = params.get("from")
+        date_to = params.get("to")
+
+        return cls(
+            record_types=frozenset(record_types),
+            date_from=parse_bound(date_from, "from") if date_from else None,
+            date_to=parse_bound(date_to, "to", end_of_day=True) if date_to else None,
+            user_ids=frozenset(user_ids),
+            reason_types=frozenset(reason_types),
+        )
+
+    def apply(self, qs):
+        if self.date_from is not None:
+            qs = qs.filter(history_date__gte=self.date_from)
+        if self.date_to is not None:
+            qs = qs.filter(history_date__lt=self.date_to)
+        if self.user_ids:
+            qs = qs.filter(history_user_id__in=self.user_ids)
+        if self.reason_types:
+            qs = qs.filter(edit_reason_type__in=self.reason_types)
+        return qs
+
+
+def _active_sources(filters):
+    return [
+        (record_type, history_model)
+        for record_type, history_model in AUDIT_SOURCES.items()
+        if not filters.record_types or record_type in filters.record_types
+    ]
+
+
+# FEED -------------------------------------------------
+
+
+def _queryset(record_type, history_model, cursor, filters):
+    qs = filters.apply(history_model.objects.select_related("history_user"))
+    if cursor is not None:
+        history_date, cursor_type, history_id = cursor
+        after = Q(history_date__lt=history_date)
+        if record_type < cursor_type:
+            after |= Q(history_date=history_date)
+        elif record_type == cursor_type:
+            after |= Q(history_date=history_date, history_id__lt=history_id)
+        qs = qs.filter(after)
+    # Walks the history_date index newest first
+    return qs.order_by(*HISTORY_ORDERING)
+
+
+def _stream(record_type, rows):
+    for row in rows:
+        yield (row.history_date, record_type, row.history_id), row
+
+
+def _render(entries):
+    """
+    Render merged (key, row) entries, reading their diffs from the
+    HistoryChange store with one query per record type, or diffing against
+    each revision's predecessor when the store is off.
+    """
+    by_type = {}
+    for (_, record_type, _), row in entries:
+        by_type.setdefault(record_type, []).append(row)
+    diffs = {
+        record_type: revision_diffs(rows) for record_type, rows in by_type.items()
+    }
+
+    events = []
+    for (history_date, record_type, history_id), row in entries:
+        user = row.history_user
+        events.append(
+            {
+                "record_type": record_type,
+                "record_id": row.id,
+                "history_id": history_id,
+                "at": format_datetime(history_date),
+                "event": HISTORY_EVENTS.get(row.history_type, "UNKNOWN"),
+                "actor": (
+                    {"id": user.id, "username": user.username} if user else None
+                ),
+                "reason": {
+                    "type": row.edit_reason_type or None,
+                    "detail": row.history_change_reason or None,
+                },
+                "changes": [
+                    {"field": field_name, "from": old_value, "to": new_value}
+                    for field_name, old_value, new_value in diffs[record_type][
+                        history_id
+                    ]
+                ],
+            }
+        )
+    return events
+
+
+def audit_page(cursor=None, limit=50, filters=None):
+    """
+    One page of the audit feed. Each source reads at most limit + 1 rows;
+    the extra row tells us whether there is another page.
+
+    Returns (events, next_cursor). next_cursor is None on the last page.
+    """
+    filters = filters or AuditFilters()
+    streams = [
+        _stream(
+            record_type,
+            _queryset(record_type, history_model, cursor, filters)[: limit + 1],
+        )
+        for record_type, history_model in _active_sources(filters)
+    ]
+    merged = heapq.merge(*streams, key=lambda entry: entry[0], reverse=True)
+    entries = list(islice(merged, limit + 1))
+
+    next_cursor = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        next_cursor = encode_cursor(*entries[-1][0])
+    return _render(entries), next_cursor
+
+
+def iter_audit(chunk_size=500, filters=None):
+    """
+    Lazily yield every audit event, newest first, reading each historical
+    table with a server-side iterator.
+    """
+    filters = filters or AuditFilters()
+    streams = [
+        _stream(
+            record_type,
+            _queryset(record_type, history_model, None, filters).iterator(
+                chunk_size=chunk_size
+            ),
+        )
+        for record_type, history_model in _active_sources(filters)
+    ]
+    merged = heapq.merge(*streams, key=lambda entry: entry[0], reverse=True)
+    while True:
+        entries = list(islice(merged, chunk_size))
+        if not entries:
+            return
+        yield from _render(entries)
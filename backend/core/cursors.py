@@ -0,0 +1,53 @@
+"""
+Opaque keyset-pagination cursors and page sizes shared by the timeline and
+history endpoints.
+"""
+
+import base64
+import json
+from datetime import datetime
+
+from django.conf import settings
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(*parts) -> str:
+    """
+    Opaque, URL-safe cursor. Datetimes are stored as ISO strings,
+    everything else must already be JSON serialisable.
+    """
+    raw = [p.isoformat() if isinstance(p, datetime) else p for p in parts]
+    payload = json.dumps(raw, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> list:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        parts = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor.")
+    if not isinstance(parts, list):
+        raise InvalidCursor("Invalid cursor.")
+    return parts
+
+
+def parse_limit(raw, default_setting, maximum_setting):
+    """
+    Page size from a ?limit= value: the default_setting when missing, capped
+    at maximum_setting. Raises ValueError.
+    """
+    default = int(getattr(settings, default_setting, 50))
+    maximum = int(getattr(settings, maximum_setting, 200))
+    if raw in (None, ""):
+        return default
+    try:
+        limit = int(raw)
+    except (TypeError, ValueError):
+        raise ValueError("limit must be a positive integer.")
+    if limit < 1:
+        raise ValueError("limit must be a positive integer.")
+    return min(limit, maximum)
@@ -0,0 +1,768 @@
+"""
+Helpers for reading simple_history records.
+
+History lists are always newest first, i.e. ordered by
+("-history_date", "-history_id"), and each row is diffed against the one
+after it.
+"""
+
+import json
+from collections import defaultdict
+from datetime import date, datetime, time
+from difflib import SequenceMatcher
+from itertools import chain, groupby
+
+from django.conf import settings
+from django.db import models
+from django.db.models import OuterRef, Q, Subquery
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .cursors import InvalidCursor, decode_cursor, encode_cursor, parse_limit
+from .models import (
+    ArchivedHistory,
+    DailyLog,
+    HistoryChange,
+    HistoryTextDelta,
+    Incident,
+    MedicationAdministrationRecord,
+)
+
+DIFF_EXCLUDED_FIELDS = {
+    "id",
+    "history_id",
+    "history_date",
+    "history_type",
+    "history_user",
+    "history_change_reason",
+    "edit_reason_type",
+    "edit_reason_detail",
+}
+
+HISTORY_ORDERING = ("-history_date", "-history_id")
+
+# Tracked models -> HistoryChange.record_type
+HISTORY_RECORD_TYPES = {
+    DailyLog: "DAILY_LOG",
+    Incident: "INCIDENT",
+    MedicationAdministrationRecord: "MEDICATION",
+}
+
+
+def diffable_fields(history_model, excluded=DIFF_EXCLUDED_FIELDS):
+    """
+    (name, attname) of every field worth diffing. attname is compared so
+    foreign keys are diffed by id without loading the related rows.
+    """
+    return [
+        (field.name, field.attname)
+        for field in history_model._meta.fields
+        if field.name not in excluded
+    ]
+
+
+def diff_pair(newer, older, fields):
+    """
+    [(field_name, old, new), ...] for the fields that differ between two
+    adjacent revisions.
+    """
+    changes = []
+    for name, attname in fields:
+        old_value = getattr(older, attname, None)
+        new_value = getattr(newer, attname, None)
+        if old_value != new_value:
+            changes.append((name, old_value, new_value))
+    return changes
+
+
+def diff_history(history_list, excluded=DIFF_EXCLUDED_FIELDS):
+    """
+    Diff every revision against the previous one in a single pass.
+
+    history_list may hold several records as long as each record's
+    revisions are contiguous and newest first.
+
+    Returns {history_id: [(field_name, old, new), ...]}. The oldest revision
+    of each record has nothing to diff against and maps to [].
+    """
+    if not history_list:
+        return {}
+
+    fields = diffable_fields(type(history_list[0]), excluded)
+    diffs = {}
+    for newer, older in zip(history_list, history_list[1:] + [None]):
+        if older is None or older.id != newer.id:
+            diffs[newer.history_id] = []
+        else:
+            diffs[newer.history_id] = diff_pair(newer, older, fields)
+    return diffs
+
+
+def related_objects(history_list, diffs):
+    """
+    Resolve every foreign key id that appears in ``diffs`` with one in_bulk
+    per related model.
+
+    Returns {related_model: {pk: obj}}.
+    """
+    if not history_list:
+        return {}
+
+    opts = history_list[0].instance_type._meta
+    ids = defaultdict(set)
+    for changes in diffs.values():
+        for field_name, old_value, new_value in changes:
+            field = opts.get_field(field_name)
+            if not isinstance(field, models.ForeignKey):
+                continue
+            rel_model = field.remote_field.model
+            for value in (old_value, new_value):
+                if value is not None:
+                    ids[rel_model].add(value)
+
+    # select_related() so labels such as Medication.__str__, which reads the
+    # resident, don't fall back to a query per object
+    return {
+        rel_model: rel_model._default_manager.select_related().in_bulk(pks)
+        for rel_model, pks in ids.items()
+    }
+
+
+def history_diffs(history_list):
+    """
+    {history_id: [(field_name, old, new), ...]} for ``history_list``, read
+    from the HistoryChange store when it is enabled (HISTORY_CHANGE_STORE)
+    and the model is tracked there, otherwise computed with diff_history.
+    """
+    if (
+        history_list
+        and getattr(settings, "HISTORY_CHANGE_STORE", True)
+        and history_list[0].instance_type in HISTORY_RECORD_TYPES
+    ):
+        return stored_diffs(history_list)
+    return diff_history(history_list)
+
+
+def previous_revisions(history_list):
+    """
+    {history_id: the same record's revision just before it} for revisions
+    of one model in any order, read with two queries. Revisions with
+    nothing older are left out.
+    """
+    history_model = type(history_list[0])
+    older = (
+        history_model.objects.filter(id=OuterRef("id"))
+        .filter(
+            Q(history_date__lt=OuterRef("history_date"))
+            | Q(
+                history_date=OuterRef("history_date"),
+                history_id__lt=OuterRef("history_id"),
+            )
+        )
+        .order_by(*HISTORY_ORDERING)
+        .values("history_id")[:1]
+    )
+    pairs = dict(
+        history_model.objects.filter(
+            history_id__in=[h.history_id for h in history_list]
+        )
+        .annotate(previous_id=Subquery(older))
+        .exclude(previous_id=None)
+        .values_list("history_id", "previous_id")
+    )
+    previous = history_model.objects.in_bulk(pairs.values())
+    return {history_id: previous[pk] for history_id, pk in pairs.items()}
+
+
+def revision_diffs(history_list):
+    """
+    history_diffs for revisions that need not be contiguous per record,
+    such as a page of the audit feed. Without the HistoryChange store each
+    revision is diffed against its previous_revisions entry.
+    """
+    if not history_list:
+        return {}
+    if (
+        getattr(settings, "HISTORY_CHANGE_STORE", True)
+        and history_list[0].instance_type in HISTORY_RECORD_TYPES
+    ):
+        return stored_diffs(history_list)
+
+    previous = previous_revisions(history_list)
+    inflate_history(list(history_list) + list(previous.values()))
+    fields = diffable_fields(type(history_list[0]))
+    return {
+        h.history_id: (
+            diff_pair(h, previous[h.history_id], fields)
+            if h.history_id in previous
+            else []
+        )
+        for h in history_list
+    }
+
+
+# CHANGE REASONS --------------------------------------
+
+
+def change_reason(model, *reasons):
+    """
+    The first non-blank reason, cut to fit history_change_reason. Set it as
+    instance._change_reason before saving so simple_history writes it with
+    the history row, instead of updating that row afterwards.
+    """
+    max_length = model.history.model._meta.get_field("history_change_reason").max_length
+    for reason in reasons:
+        reason = (reason or "").strip()
+        if reason:
+            return reason[:max_length]
+    return ""
+
+
+# CHANGE STORE ----------------------------------------
+
+
+def value_to_text(value):
+    """
+    Text form of a field value, read back with the field's to_python().
+    """
+    if value is None:
+        return None
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    return str(value)
+
+
+def change_rows(newer, older, fields, record_type):
+    """
+    Unsaved HistoryChange rows for the fields that differ between two
+    adjacent revisions.
+    """
+    return [
+        HistoryChange(
+            record_type=record_type,
+            record_id=newer.id,
+            history_id=newer.history_id,
+            history_date=newer.history_date,
+            field_name=field_name,
+            old_value=value_to_text(old_value),
+            new_value=value_to_text(new_value),
+        )
+        for field_name, old_value, new_value in diff_pair(newer, older, fields)
+    ]
+
+
+def _older_than(history_row):
+    return Q(history_date__lt=history_row.history_date) | Q(
+        history_date=history_row.history_date, history_id__lt=history_row.history_id
+    )
+
+
+def previous_revision(history_instance):
+    """
+    The revision of the same record just before ``history_instance``, with
+    any compacted text expanded.
+    """
+    previous = (
+        type(history_instance)
+        .objects.filter(id=history_instance.id)
+        .filter(_older_than(history_instance))
+        .order_by(*HISTORY_ORDERING)
+        .first()
+    )
+    if previous is not None:
+        inflate_history([previous])
+    return previous
+
+
+def record_history_changes(history_instance):
+    """
+    Store the field changes for a freshly written historical row. Called
+    from the post_create_historical_record signal.
+    """
+    history_model = type(history_instance)
+    record_type = HISTORY_RECORD_TYPES.get(history_model.instance_type)
+    if record_type is None:
+        return []
+
+    previous = previous_revision(history_instance)
+    if previous is None and history_instance.history_type != "+":
+        # Edited after its history was archived; core.archive imports this
+        # module, hence the late import
+        from .archive import archived_revision_before
+
+        previous = archived_revision_before(history_instance)
+    if previous is None:
+        # First revision, nothing changed
+        return []
+
+    rows = change_rows(
+        history_instance, previous, diffable_fields(history_model), record_type
+    )
+    return HistoryChange.objects.bulk_create(rows)
+
+
+def stored_diffs(history_list):
+    """
+    Same shape as diff_history, read from HistoryChange in one query.
+    """
+    history_model = type(history_list[0])
+    opts = history_model._meta
+    diffs = {h.history_id: [] for h in history_list}
+
+    changes = HistoryChange.objects.filter(
+        record_type=HISTORY_RECORD_TYPES[history_model.instance_type],
+        history_id__in=list(diffs),
+    ).order_by("history_id", "id")
+    for change in changes:
+        field = opts.get_field(change.field_name)
+        diffs[change.history_id].append(
+            (
+                change.field_name,
+                None if change.old_value is None else field.to_python(change.old_value),
+                None if change.new_value is None else field.to_python(change.new_value),
+            )
+        )
+    return diffs
+
+
+def _record_groups(history_model, chunk_size, inflate=None, exclude_ids=None):
+    """
+    Every record's full history, oldest first, one record at a time, with
+    compacted text expanded (by inflate_history unless ``inflate`` is given).
+    Records in ``exclude_ids`` are skipped.
+    """
+    inflate = inflate or inflate_history
+    qs = history_model.objects.order_by("id", "history_date", "history_id")
+    if exclude_ids is not None:
+        qs = qs.exclude(id__in=exclude_ids)
+    for _, rows in groupby(qs.iterator(chunk_size=chunk_size), key=lambda h: h.id):
+        rows = list(rows)
+        inflate(rows)
+        yield rows
+
+
+def rebuild_history_changes(chunk_size=1000):
+    """
+    Recreate HistoryChange rows from the historical tables and the archived
+    history. Returns the number of changes written.
+    """
+    # core.archive imports this module, hence the late import
+    from .archive import archived_record_groups
+
+    HistoryChange.objects.all().delete()
+
+    written = 0
+    for model, record_type in HISTORY_RECORD_TYPES.items():
+        history_model = model.history.model
+        fields = diffable_fields(history_model)
+        archived_ids = ArchivedHistory.objects.filter(
+            record_type=record_type
+        ).values("record_id")
+        groups = chain(
+            _record_groups(history_model, chunk_size, exclude_ids=archived_ids),
+            archived_record_groups(history_model, chunk_size),
+        )
+
+        batch = []
+        for rows in groups:
+            # Oldest first, so each row diffs against the one before
+            for older, newer in zip(rows, rows[1:]):
+                batch.extend(change_rows(newer, older, fields, record_type))
+            if len(batch) >= chunk_size:
+                HistoryChange.objects.bulk_create(batch)
+                written += len(batch)
+                batch = []
+        if batch:
+            HistoryChange.objects.bulk_create(batch)
+            written += len(batch)
+
+    return written
+
+
+# COMPACT TEXT ----------------------------------------
+
+# Large free-text fields that HISTORY_COMPACT_TEXT stores as deltas
+COMPACT_TEXT_FIELDS = {
+    "DAILY_LOG": ("summary", "interventions"),
+    "INCIDENT": ("description", "action_taken"),
+    "MEDICATION": ("notes",),
+}
+
+
+def compact_text_enabled():
+    return bool(getattr(settings, "HISTORY_COMPACT_TEXT", False))
+
+
+def _snapshot_interval():
+    return max(int(getattr(settings, "HISTORY_SNAPSHOT_INTERVAL", 10)), 1)
+
+
+def make_delta(old: str, new: str) -> list:
+    ops = []
+    matcher = SequenceMatcher(None, old, new, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append(new[j1:j2])
+    return ops
+
+
+def apply_delta(old: str, delta: list) -> str:
+    return "".join(old[op[0] : op[1]] if isinstance(op, list) else op for op in delta)
+
+
+def delta_size(delta: list) -> int:
+    return len(json.dumps(delta, separators=(",", ":")))
+
+
+def _encode_text(old, new, chain_length, interval):
+    """
+    Delta turning ``old`` into ``new``, or None when ``new`` should be kept
+    in full: a snapshot is due, or the delta would not be smaller.
+    """
+    if chain_length >= interval:
+        return None
+    delta = make_delta(old, new)
+    if delta_size(delta) >= len(new):
+        return None
+    return delta
+
+
+def _text_deltas(record_type, history_ids):
+    return {
+        (d.history_id, d.field_name): d
+        for d in HistoryTextDelta.objects.filter(
+            record_type=record_type, history_id__in=history_ids
+        )
+    }
+
+
+def _inflate(history_list):
+    history_model = type(history_list[0])
+    record_type = HISTORY_RECORD_TYPES.get(history_model.instance_type)
+    fields = COMPACT_TEXT_FIELDS.get(record_type)
+    if not fields:
+        return
+
+    deltas = _text_deltas(record_type, [h.history_id for h in history_list])
+    if not deltas:
+        return
+
+    by_record = defaultdict(list)
+    for row in history_list:
+        by_record[row.id].append(row)
+
+    # Each delta applies to the revision just before it, so load any
+    # revisions the list skips (e.g. audit rows filtered out by ?user=)
+    between = Q()
+    for record_id, rows in by_record.items():
+        if len(rows) > 1:
+            first = min(rows, key=lambda h: (h.history_date, h.history_id))
+            last = max(rows, key=lambda h: (h.history_date, h.history_id))
+            between |= Q(id=record_id) & _older_than(last) & ~_older_than(first)
+    if between:
+        skipped = list(
+            history_model.objects.filter(between).exclude(
+                history_id__in=[h.history_id for h in history_list]
+            )
+        )
+        if skipped:
+            deltas.update(_text_deltas(record_type, [h.history_id for h in skipped]))
+            for row in skipped:
+                by_record[row.id].append(row)
+
+    for record_id, rows in by_record.items():
+        rows.sort(key=lambda h: (h.history_date, h.history_id))
+
+        # The oldest row here may be part of a delta chain; fetch the
+        # revisions back to its last full snapshot
+        chain = max(
+            (
+                deltas[(rows[0].history_id, name)].chain_length
+                for name in fields
+                if (rows[0].history_id, name) in deltas
+            ),
+            default=0,
+        )
+        if chain:
+            older = list(
+                history_model.objects.filter(id=record_id)
+                .filter(_older_than(rows[0]))
+                .order_by(*HISTORY_ORDERING)[:chain]
+            )[::-1]
+            deltas.update(_text_deltas(record_type, [h.history_id for h in older]))
+            rows = older + rows
+
+        previous = None
+        for row in rows:
+            for name in fields:
+                delta = deltas.get((row.history_id, name))
+                if delta is not None and previous is not None:
+                    text = apply_delta(getattr(previous, name), delta.delta)
+                    setattr(row, name, text)
+            previous = row
+
+
+def inflate_history(history_list):
+    """
+    Expand delta-encoded text on historical rows in place, so callers (and
+    HistoryRecordSerializer) always see full text. The rows need not be
+    contiguous revisions. Costs one query when HISTORY_COMPACT_TEXT is on,
+    one more for revisions skipped between rows of the same record (two if
+    there are any), plus one per record whose oldest row here sits in the
+    middle of a delta chain.
+    """
+    if history_list and compact_text_enabled():
+        _inflate(history_list)
+    return history_list
+
+
+def compact_history_text(history_instance):
+    """
+    Delta-encode the large text fields of a freshly written historical row
+    against the previous revision. Called from the
+    post_create_historical_record signal when HISTORY_COMPACT_TEXT is on.
+    """
+    history_model = type(history_instance)
+    record_type = HISTORY_RECORD_TYPES.get(history_model.instance_type)
+    fields = COMPACT_TEXT_FIELDS.get(record_type)
+    if not fields or not compact_text_enabled():
+        return []
+
+    previous = previous_revision(history_instance)
+    if previous is None:
+        return []
+
+    chains = {
+        name: delta.chain_length
+        for (_, name), delta in _text_deltas(
+            record_type, [previous.history_id]
+        ).items()
+    }
+    interval = _snapshot_interval()
+
+    rows = []
+    for name in fields:
+        text = getattr(history_instance, name) or ""
+        chain_length = chains.get(name, 0) + 1
+        old_text = getattr(previous, name) or ""
+        delta = _encode_text(old_text, text, chain_length, interval)
+        if delta is not None:
+            rows.append(
+                HistoryTextDelta(
+                    record_type=record_type,
+                    record_id=history_instance.id,
+                    history_id=history_instance.history_id,
+                    field_name=name,
+                    delta=delta,
+                    chain_length=chain_length,
+                    text_length=len(text),
+                )
+            )
+
+    if rows:
+        HistoryTextDelta.objects.bulk_create(rows)
+        # The in-memory instance keeps its full text for later receivers
+        history_model.objects.filter(history_id=history_instance.history_id).update(
+            **{row.field_name: "" for row in rows}
+        )
+    return rows
+
+
+def compact_history(dry_run=False, expand=False, chunk_size=1000):
+    """
+    (Re)encode every tracked historical table; expand=True writes full text
+    back instead. dry_run only measures.
+
+    Returns {(record_type, field_name): (full_chars, stored_chars)} for the
+    resulting layout, so a dry run reports what compaction would save.
+    """
+    interval = _snapshot_interval()
+    stats = defaultdict(lambda: [0, 0])
+
+    for model, record_type in HISTORY_RECORD_TYPES.items():
+        fields = COMPACT_TEXT_FIELDS[record_type]
+        history_model = model.history.model
+
+        # Expand whatever is stored, even with HISTORY_COMPACT_TEXT now off
+        for rows in _record_groups(history_model, chunk_size, inflate=_inflate):
+            deltas, chains, previous = [], dict.fromkeys(fields, 0), None
+            stored = {}
+            for row in rows:
+                stored[row.history_id] = {}
+                for name in fields:
+                    text = getattr(row, name) or ""
+                    delta = None
+                    if previous is not None and not expand:
+                        delta = _encode_text(
+                            getattr(previous, name) or "",
+                            text,
+                            chains[name] + 1,
+                            interval,
+                        )
+
+                    stats[(record_type, name)][0] += len(text)
+                    if delta is None:
+                        chains[name] = 0
+                        stored[row.history_id][name] = text
+                        stats[(record_type, name)][1] += len(text)
+                    else:
+                        chains[name] += 1
+                        stored[row.history_id][name] = ""
+                        stats[(record_type, name)][1] += delta_size(delta)
+                        deltas.append(
+                            HistoryTextDelta(
+                                record_type=record_type,
+                                record_id=row.id,
+                                history_id=row.history_id,
+                                field_name=name,
+                                delta=delta,
+                                chain_length=chains[name],
+                                text_length=len(text),
+                            )
+                        )
+                previous = row
+
+            if dry_run:
+                continue
+            HistoryTextDelta.objects.filter(
+                record_type=record_type, record_id=rows[0].id
+            ).delete()
+            HistoryTextDelta.objects.bulk_create(deltas)
+            for row in rows:
+                history_model.objects.filter(history_id=row.history_id).update(
+                    **stored[row.history_id]
+                )
+
+    return {key: tuple(value) for key, value in stats.items()}
+
+
+# AS OF -----------------------------------------------
+
+
+def parse_as_of(raw):
+    """
+    ?as_of= accepts an ISO datetime, or a plain date meaning the end of
+    that day. Raises ValueError.
+    """
+    value = parse_datetime(raw)
+    if value is None:
+        day = parse_date(raw)
+        if day is None:
+            raise ValueError("as_of must be an ISO date or datetime.")
+        value = datetime.combine(day, time.max)
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value
+
+
+def revisions_as_of(queryset, when):
+    """
+    Historical rows for the records in ``queryset`` as they stood at
+    ``when``: per record, the newest revision at or before it, found with
+    one seek on the (id, history_date) index. Records created later, or
+    deleted by then, are left out.
+    """
+    history_model = queryset.model.history.model
+    latest = (
+        history_model.objects.filter(id=OuterRef("pk"), history_date__lte=when)
+        .order_by(*HISTORY_ORDERING)
+        .values("history_id")[:1]
+    )
+    current = (
+        queryset.order_by()
+        .annotate(as_of_history_id=Subquery(latest))
+        .values("as_of_history_id")
+    )
+    return history_model.objects.filter(history_id__in=current).exclude(
+        history_type="-"
+    )
+
+
+# PAGINATION ------------------------------------------
+
+
+def parse_id_list(raw, maximum):
+    """
+    "1,2,3" -> [1, 2, 3], de-duplicated in order. Raises ValueError.
+    """
+    ids = []
+    for part in (raw or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if not part.isdigit():
+            raise ValueError("ids must be a comma separated list of ids.")
+        if int(part) not in ids:
+            ids.append(int(part))
+    if not ids:
+        raise ValueError("ids is required.")
+    if len(ids) > maximum:
+        raise ValueError(f"At most {maximum} ids can be requested at once.")
+    return ids
+
+
+def parse_history_limit(raw):
+    return parse_limit(raw, "HISTORY_PAGE_SIZE", "HISTORY_MAX_PAGE_SIZE")
+
+
+def decode_history_cursor(token: str):
+    """
+    History cursors are (history_date, history_id) of the last revision on
+    the previous page.
+    """
+    parts = decode_cursor(token)
+    if len(parts) != 2:
+        raise InvalidCursor("Invalid cursor.")
+
+    history_date = parse_datetime(parts[0]) if isinstance(parts[0], str) else None
+    if history_date is None or not isinstance(parts[1], int):
+        raise InvalidCursor("Invalid cursor.")
+    return history_date, parts[1]
+
+
+def history_page(queryset, cursor=None, limit=None, archived=()):
+    """
+    One newest-first page of ``queryset`` using keyset pagination on
+    (history_date, history_id). ``archived`` rows (rehydrated from
+    ArchivedHistory, newest first) are merged in as if they were still in
+    the table.
+
+    Returns (history_list, page_size, next_cursor). history_list holds the
+    page plus, when there is one, the next older revision: the last row on
+    the page needs it to diff against, and its presence means there is a
+    next page. Render only history_list[:page_size].
+    """
+    queryset = queryset.order_by(*HISTORY_ORDERING)
+    if cursor is not None:
+        history_date, history_id = cursor
+        queryset = queryset.filter(
+            Q(history_date__lt=history_date)
+            | Q(history_date=history_date, history_id__lt=history_id)
+        )
+        archived = [
+            row
+            for row in archived
+            if (row.history_date, row.history_id) < (history_date, history_id)
+        ]
+
+    history_list = inflate_history(
+        list(queryset if limit is None else queryset[: limit + 1])
+    )
+    if archived:
+        history_list = sorted(
+            history_list + list(archived),
+            key=lambda h: (h.history_date, h.history_id),
+            reverse=True,
+        )
+    if limit is None:
+        return history_list, len(history_list), None
+
+    history_list = history_list[: limit + 1]
+    page_size = min(len(history_list), limit)
+    next_cursor = None
+    if len(history_list) > limit:
+        last = history_list[page_size - 1]
+        next_cursor = encode_cursor(last.history_date, last.history_id)
+    return history_list, page_size, next_cursor
@@ -0,0 +1,141 @@
+"""
+Idempotency-Key support for POSTs that create clinical records. A retry of a
+request with the same key, from the same user, gets the stored response back
+without validation or writes running again.
+"""
+
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+# Set on responses served from the store
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+KEY_MAX_LENGTH = IdempotencyKey._meta.get_field("key").max_length
+
+
+def _ttl():
+    return timedelta(hours=int(getattr(settings, "IDEMPOTENCY_KEY_TTL_HOURS", 24)))
+
+
+def request_fingerprint(request):
+    """
+    sha256 of the method, path and parsed body. Parsing is not validation,
+    and the parsed body hashes the same however the client formatted it.
+    """
+    body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder, default=str)
+    raw = f"{request.method} {request.path}\n{body}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _stored(user, key, now):
+    """
+    The live stored response for key, if any. An expired one is dropped so
+    the key can be used again.
+    """
+    stored = IdempotencyKey.objects.filter(user=user, key=key).first()
+    if stored is not None and stored.expires_at <= now:
+        stored.delete()
+        return None
+    return stored
+
+
+def _replay(stored, fingerprint):
+    if stored.fingerprint != fingerprint:
+        return Response(
+            {
+                "detail": (
+                    f"This {IDEMPOTENCY_HEADER} was already used for a "
+                    "different request."
+                )
+            },
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    return Response(
+        stored.response,
+        status=stored.status_code,
+        headers={REPLAYED_HEADER: "true"},
+    )
+
+
+def idempotent_response(request, handler):
+    """
+    Run handler() once per Idempotency-Key. A successful response is stored
+    in the same transaction as the writes it made; failures are not stored,
+    so a corrected request may reuse the key. Requests without the header
+    go straight to handler().
+    """
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if key is None:
+        return handler()
+    key = key.strip()
+    if not key or len(key) > KEY_MAX_LENGTH:
+        return Response(
+            {
+                "detail": (
+                    f"{IDEMPOTENCY_HEADER} must be 1 to {KEY_MAX_LENGTH} characters."
+                )
+            },
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    now = timezone.now()
+    fingerprint = request_fingerprint(request)
+    stored = _stored(request.user, key, now)
+    if stored is not None:
+        return _replay(stored, fingerprint)
+
+    try:
+        with transaction.atomic():
+            response = handler()
+            if status.is_success(response.status_code):
+                IdempotencyKey.objects.create(
+                    user=request.user,
+                    key=key,
+                    fingerprint=fingerprint,
+                    status_code=response.status_code,
+                    response=response.data,
+                    expires_at=now + _ttl(),
+                )
+    except IntegrityError:
+        # A concurrent retry with the same key committed first. Our writes
+        # were rolled back with the key, so answer with what it stored
+        stored = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+        if stored is None:
+            raise
+        return _replay(stored, fingerprint)
+    return response
+
+
+def idempotent(view_method):
+    """
+    Decorator for viewset methods and actions that create records.
+    """
+
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        return idempotent_response(
+            request, lambda: view_method(self, request, *args, **kwargs)
+        )
+
+    return wrapper
+
+
+def purge_expired_keys(now=None):
+    """
+    Delete expired stored responses. Returns the number removed.
+    """
+    expired = IdempotencyKey.objects.filter(expires_at__lte=now or timezone.now())
+    deleted, _ = expired.delete()
+    return deleted
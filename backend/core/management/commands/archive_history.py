@@ -0,0 +1,64 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core.archive import archive_history, hot_table_sizes
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the history of discharged residents' records that have not "
+        "changed for a while out of the hot history tables."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than-days",
+            type=int,
+            help=(
+                "Archive records unchanged for this many days "
+                "(defaults to HISTORY_ARCHIVE_AFTER_DAYS)."
+            ),
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report what would be archived.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=200,
+            help="Records archived per batch.",
+        )
+
+    def _write_sizes(self, label, sizes):
+        self.stdout.write(f"{label}:")
+        for table, (rows, size) in sizes.items():
+            size = "size unknown" if size is None else f"{size / 1024:.1f} KB"
+            self.stdout.write(f"  {table}: {rows} rows, {size}")
+
+    def handle(self, *args, **options):
+        cutoff = None
+        if options["older_than_days"] is not None:
+            cutoff = timezone.now() - timedelta(days=options["older_than_days"])
+
+        self._write_sizes("Hot history tables before", hot_table_sizes())
+
+        with transaction.atomic():
+            moved = archive_history(
+                cutoff=cutoff,
+                dry_run=options["dry_run"],
+                chunk_size=options["chunk_size"],
+            )
+
+        verb = "Would archive" if options["dry_run"] else "Archived"
+        for record_type, (records, rows) in moved.items():
+            self.stdout.write(
+                f"{verb} {rows} revisions of {records} {record_type} records."
+            )
+
+        self._write_sizes("Hot history tables after", hot_table_sizes())
+        self.stdout.write(self.style.SUCCESS("Done."))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.history import rebuild_history_changes
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the HistoryChange store from the daily log, incident and "
+        "MAR history tables and their archived history."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Rows read and written per batch.",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            written = rebuild_history_changes(chunk_size=options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} history changes."))
@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from rest_framework.renderers import JSONRenderer
+
+from core.models import Resident
+from core.timeline import merge_timeline
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare DRF serializer and fast-path timeline rendering for one "
+        "resident. Checks the JSON is byte-identical and reports timings."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("resident_id", type=int)
+        parser.add_argument(
+            "--repeat", type=int, default=5, help="Runs per path (best is reported)."
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=None,
+            help="Benchmark one page of this size instead of the whole timeline.",
+        )
+
+    def handle(self, *args, **options):
+        resident_id = options["resident_id"]
+        if not Resident.objects.filter(id=resident_id).exists():
+            raise CommandError(f"Resident {resident_id} not found.")
+
+        renderer = JSONRenderer()
+        results = {}
+
+        for label, fast in (("serializer", False), ("fast", True)):
+            timings = []
+            body = b""
+            with override_settings(TIMELINE_FAST_SERIALIZATION=fast):
+                for _ in range(options["repeat"]):
+                    started = time.perf_counter()
+                    events, _ = merge_timeline(resident_id, limit=options["limit"])
+                    body = renderer.render(events)
+                    timings.append(time.perf_counter() - started)
+            results[label] = (min(timings), body, len(events))
+
+        slow_time, slow_body, count = results["serializer"]
+        fast_time, fast_body, _ = results["fast"]
+
+        if slow_body != fast_body:
+            raise CommandError("Fast path JSON differs from the serializer output.")
+
+        self.stdout.write(f"Events:      {count}")
+        self.stdout.write(f"Serializer:  {slow_time * 1000:.1f} ms")
+        self.stdout.write(f"Fast path:   {fast_time * 1000:.1f} ms")
+        if fast_time:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Identical JSON, {slow_time / fast_time:.1f}x faster."
+                )
+            )
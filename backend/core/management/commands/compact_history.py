@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.history import compact_history
+
+
+def _size(chars):
+    if chars < 1024:
+        return f"{chars} B"
+    return f"{chars / 1024:.1f} KB"
+
+
+class Command(BaseCommand):
+    help = (
+        "Delta-encode the large text fields of the daily log, incident and "
+        "MAR history tables, and report the storage it saves."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report what compaction would save.",
+        )
+        parser.add_argument(
+            "--expand",
+            action="store_true",
+            help="Write full text back to every historical row instead.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Rows read per batch.",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            stats = compact_history(
+                dry_run=options["dry_run"],
+                expand=options["expand"],
+                chunk_size=options["chunk_size"],
+            )
+
+        total_full = total_stored = 0
+        for (record_type, field_name), (full, stored) in sorted(stats.items()):
+            total_full += full
+            total_stored += stored
+            self.stdout.write(
+                f"{record_type}.{field_name}: {_size(full)} -> {_size(stored)}"
+            )
+
+        saved = 100 * (1 - total_stored / total_full) if total_full else 0
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Text in history: {_size(total_full)} full, "
+                f"{_size(total_stored)} stored ({saved:.0f}% saved)."
+            )
+        )
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.timeline import rebuild_timeline_events
+
+
+class Command(BaseCommand):
+    help = "Rebuild the materialised TimelineEvent table from daily logs, incidents and MAR."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--resident",
+            type=int,
+            help="Only rebuild the timeline for this resident id.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Rows read and written per batch.",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            written = rebuild_timeline_events(
+                resident_id=options["resident"],
+                chunk_size=options["chunk_size"],
+            )
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} timeline events."))
@@ -0,0 +1,31 @@
+# Generated by Django 6.0.1 on 2026-10-16 09:12
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField()),
+                ('event_type', models.CharField(choices=[('DAILY_LOG', 'Daily log'), ('INCIDENT', 'Incident'), ('MEDICATION', 'Medication')], max_length=20)),
+                ('source_id', models.BigIntegerField(help_text='Primary key of the source row.')),
+                ('payload', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('resident', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_events', to='core.resident')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['resident', '-timestamp', '-event_type', '-source_id'], name='timeline_resident_ts_idx')],
+                'constraints': [models.UniqueConstraint(fields=('event_type', 'source_id'), name='unique_timeline_event_source')],
+            },
+        ),
+    ]
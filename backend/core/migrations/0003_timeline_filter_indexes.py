@@ -0,0 +1,31 @@
+# Generated by Django 6.0.1 on 2026-10-16 10:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_timelineevent'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dailylog',
+            index=models.Index(fields=['resident', '-event_at'], name='dailylog_resident_event_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incident',
+            index=models.Index(fields=['resident', '-occurred_at'], name='incident_resident_occ_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incident',
+            index=models.Index(fields=['resident', 'severity', '-occurred_at'], name='incident_resident_sev_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medicationadministrationrecord',
+            index=models.Index(fields=['medication', '-administered_at'], name='mar_medication_admin_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 6.0.1 on 2026-10-16 10:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_timeline_filter_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dailylog',
+            index=models.Index(fields=['-event_at'], name='dailylog_event_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incident',
+            index=models.Index(fields=['-occurred_at'], name='incident_occurred_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medicationadministrationrecord',
+            index=models.Index(fields=['-administered_at'], name='mar_administered_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timelineevent',
+            index=models.Index(fields=['-timestamp', '-event_type', '-source_id'], name='timeline_ts_idx'),
+        ),
+    ]
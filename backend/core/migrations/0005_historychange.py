@@ -0,0 +1,29 @@
+# Generated by Django 6.0.1 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_home_timeline_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoryChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('record_type', models.CharField(choices=[('DAILY_LOG', 'Daily log'), ('INCIDENT', 'Incident'), ('MEDICATION', 'Medication')], max_length=20)),
+                ('record_id', models.BigIntegerField(help_text='Primary key of the tracked row.')),
+                ('history_id', models.BigIntegerField(help_text='Primary key of the historical row this change belongs to.')),
+                ('history_date', models.DateTimeField()),
+                ('field_name', models.CharField(max_length=100)),
+                ('old_value', models.TextField(blank=True, null=True)),
+                ('new_value', models.TextField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['record_type', 'history_id'], name='historychange_rev_idx'), models.Index(fields=['record_type', 'record_id', '-history_date'], name='historychange_record_idx'), models.Index(fields=['record_type', 'field_name', '-history_date'], name='historychange_field_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 6.0.1 on 2026-10-17 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_historychange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoryTextDelta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('record_type', models.CharField(choices=[('DAILY_LOG', 'Daily log'), ('INCIDENT', 'Incident'), ('MEDICATION', 'Medication')], max_length=20)),
+                ('record_id', models.BigIntegerField(help_text='Primary key of the tracked row.')),
+                ('history_id', models.BigIntegerField(help_text='Primary key of the historical row this text belongs to.')),
+                ('field_name', models.CharField(max_length=100)),
+                ('delta', models.JSONField()),
+                ('chain_length', models.PositiveIntegerField(help_text='Deltas since the last full snapshot, including this one.')),
+                ('text_length', models.PositiveIntegerField(help_text='Length of the reconstructed text.')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['record_type', 'record_id'], name='historydelta_record_idx')],
+                'constraints': [models.UniqueConstraint(fields=('record_type', 'history_id', 'field_name'), name='unique_history_text_delta')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 6.0.1 on 2026-10-17 11:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_historytextdelta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('record_type', models.CharField(choices=[('DAILY_LOG', 'Daily log'), ('INCIDENT', 'Incident'), ('MEDICATION', 'Medication')], max_length=20)),
+                ('record_id', models.BigIntegerField(help_text='Primary key of the tracked row.')),
+                ('row_count', models.PositiveIntegerField()),
+                ('first_history_date', models.DateTimeField()),
+                ('last_history_date', models.DateTimeField()),
+                ('payload', models.BinaryField()),
+                ('archived_at', models.DateTimeField(auto_now=True)),
+                ('resident', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_history', to='core.resident')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('record_type', 'record_id'), name='unique_archived_history_record')],
+            },
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 6.0.1 on 2026-10-17 13:02
+
+import django.db.models.deletion
+import simple_history.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_archivedhistory'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoricalCarePlan',
+            fields=[
+                ('id', models.BigIntegerField(auto_created=True, blank=True, db_index=True, verbose_name='ID')),
+                ('overview', models.TextField(blank=True)),
+                ('triggers', models.TextField(blank=True)),
+                ('deescalation_strategies', models.TextField(blank=True)),
+                ('goals', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(blank=True, editable=False)),
+                ('updated_at', models.DateTimeField(blank=True, editable=False)),
+                ('history_id', models.AutoField(primary_key=True, serialize=False)),
+                ('history_date', models.DateTimeField(db_index=True)),
+                ('history_change_reason', models.CharField(max_length=100, null=True)),
+                ('history_type', models.CharField(choices=[('+', 'Created'), ('~', 'Changed'), ('-', 'Deleted')], max_length=1)),
+            ],
+            options={
+                'verbose_name': 'historical care plan',
+                'verbose_name_plural': 'historical care plans',
+                'ordering': ('-history_date', '-history_id'),
+                'get_latest_by': ('history_date', 'history_id'),
+            },
+            bases=(simple_history.models.HistoricalChanges, models.Model),
+        ),
+        migrations.AddIndex(
+            model_name='historicaldailylog',
+            index=models.Index(fields=['id', '-history_date', '-history_id'], name='hist_dailylog_asof_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='historicalincident',
+            index=models.Index(fields=['id', '-history_date', '-history_id'], name='hist_incident_asof_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='historicalmedicationadministrationrecord',
+            index=models.Index(fields=['id', '-history_date', '-history_id'], name='hist_medicationadmi_asof_idx'),
+        ),
+        migrations.AddField(
+            model_name='historicalcareplan',
+            name='history_user',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='historicalcareplan',
+            name='resident',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='core.resident'),
+        ),
+        migrations.AddIndex(
+            model_name='historicalcareplan',
+            index=models.Index(fields=['id', '-history_date', '-history_id'], name='hist_careplan_asof_idx'),
+        ),
+    ]
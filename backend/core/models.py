@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from datetime import timedelta
 from django.utils import timezone
 from simple_history.models import HistoricalRecords
@@ -13,6 +14,24 @@ class EditReasonCode(models.TextChoices):
     CLARIFICATION = "CLARIFICATION", "Clarification"
 
 
+class IndexedHistoricalRecords(HistoricalRecords):
+    """
+    HistoricalRecords plus an (id, history_date) index, so "record X as it
+    stood at time T" is one index seek rather than a scan of its history.
+    """
+
+    def get_meta_options(self, model):
+        meta_fields = super().get_meta_options(model)
+        meta_fields["indexes"] = (
+            *meta_fields.get("indexes", ()),
+            models.Index(
+                fields=["id", "-history_date", "-history_id"],
+                name=f"hist_{model._meta.model_name[:14]}_asof_idx",
+            ),
+        )
+        return meta_fields
+
+
 # ----------------------------------------------
 
 
@@ -89,7 +108,17 @@ class DailyLog(models.Model):
     )
 
     # history brings daily log into the "spine"
-    history = HistoricalRecords()
+    history = IndexedHistoricalRecords()
+
+    class Meta:
+        indexes = [
+            # Resident timeline (newest first, optionally date bounded)
+            models.Index(
+                fields=["resident", "-event_at"], name="dailylog_resident_event_idx"
+            ),
+            # Home-wide feed
+            models.Index(fields=["-event_at"], name="dailylog_event_idx"),
+        ]
 
     def __str__(self):
         # Kept human readable since event_at is what matters clinically
@@ -156,7 +185,21 @@ class Incident(models.Model):
         help_text="Reason for last edit (e.g. typo correction, late entry.)",
     )
 
-    history = HistoricalRecords()
+    history = IndexedHistoricalRecords()
+
+    class Meta:
+        indexes = [
+            # Resident timeline, plain and filtered by severity
+            models.Index(
+                fields=["resident", "-occurred_at"], name="incident_resident_occ_idx"
+            ),
+            models.Index(
+                fields=["resident", "severity", "-occurred_at"],
+                name="incident_resident_sev_idx",
+            ),
+            # Home-wide feed
+            models.Index(fields=["-occurred_at"], name="incident_occurred_idx"),
+        ]
 
     def __str__(self):
         return f"{self.resident} - {self.category} ({self.occurred_at:%Y-%m-%d})"
@@ -175,6 +218,9 @@ class CarePlan(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Lets care plan reads answer ?as_of=
+    history = IndexedHistoricalRecords()
+
     def __str__(self):
         return f"Care Plan - {self.resident}"
 
@@ -233,7 +279,226 @@ class MedicationAdministrationRecord(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
-    history = HistoricalRecords()
+    history = IndexedHistoricalRecords()
+
+    class Meta:
+        indexes = [
+            # Resident timeline goes through medication -> resident
+            models.Index(
+                fields=["medication", "-administered_at"],
+                name="mar_medication_admin_idx",
+            ),
+            # Home-wide feed
+            models.Index(fields=["-administered_at"], name="mar_administered_idx"),
+        ]
 
     def __str__(self):
         return f"{self.medication.medication_name} - {self.get_outcome_display()} @ {self.administered_at:%Y-%m-%d %H:%M}"
+
+
+class TimelineEvent(models.Model):
+    """
+    Denormalised copy of one timeline entry, so a resident's timeline can be
+    read from a single indexed table. Kept in step with DailyLog, Incident and
+    MAR saves (see core/signals.py). Rebuild with `manage.py rebuild_timeline`.
+    """
+
+    EVENT_TYPES = [
+        ("DAILY_LOG", "Daily log"),
+        ("INCIDENT", "Incident"),
+        ("MEDICATION", "Medication"),
+    ]
+
+    resident = models.ForeignKey(
+        Resident, on_delete=models.CASCADE, related_name="timeline_events"
+    )
+    timestamp = models.DateTimeField()
+    event_type = models.CharField(max_length=20, choices=EVENT_TYPES)
+    source_id = models.BigIntegerField(help_text="Primary key of the source row.")
+
+    # Pre-rendered timeline JSON for the source row
+    payload = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["event_type", "source_id"],
+                name="unique_timeline_event_source",
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["resident", "-timestamp", "-event_type", "-source_id"],
+                name="timeline_resident_ts_idx",
+            ),
+            # Home-wide feed
+            models.Index(
+                fields=["-timestamp", "-event_type", "-source_id"],
+                name="timeline_ts_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} #{self.source_id} ({self.timestamp:%Y-%m-%d %H:%M})"
+
+
+class HistoryChange(models.Model):
+    """
+    One changed field on one historical revision of a DailyLog, Incident or
+    MAR, written alongside the simple_history row (see core/signals.py).
+    Values are stored as text and converted back with the field's
+    to_python() on read. Backfill with `manage.py backfill_history_changes`.
+    """
+
+    RECORD_TYPES = TimelineEvent.EVENT_TYPES
+
+    record_type = models.CharField(max_length=20, choices=RECORD_TYPES)
+    record_id = models.BigIntegerField(help_text="Primary key of the tracked row.")
+    history_id = models.BigIntegerField(
+        help_text="Primary key of the historical row this change belongs to."
+    )
+    history_date = models.DateTimeField()
+
+    field_name = models.CharField(max_length=100)
+    old_value = models.TextField(null=True, blank=True)
+    new_value = models.TextField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Diffs for a page of history
+            models.Index(
+                fields=["record_type", "history_id"], name="historychange_rev_idx"
+            ),
+            # Everything that happened to one record, newest first
+            models.Index(
+                fields=["record_type", "record_id", "-history_date"],
+                name="historychange_record_idx",
+            ),
+            # "All changes to field X"
+            models.Index(
+                fields=["record_type", "field_name", "-history_date"],
+                name="historychange_field_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.record_type} #{self.record_id} {self.field_name} ({self.history_date:%Y-%m-%d %H:%M})"
+
+
+class HistoryTextDelta(models.Model):
+    """
+    A large text field on one historical revision stored as a delta against
+    the previous revision; the column on the historical row is left blank.
+    Only written when HISTORY_COMPACT_TEXT is on, and expanded transparently
+    when history is read (see core.history.inflate_history).
+    """
+
+    RECORD_TYPES = TimelineEvent.EVENT_TYPES
+
+    record_type = models.CharField(max_length=20, choices=RECORD_TYPES)
+    record_id = models.BigIntegerField(help_text="Primary key of the tracked row.")
+    history_id = models.BigIntegerField(
+        help_text="Primary key of the historical row this text belongs to."
+    )
+    field_name = models.CharField(max_length=100)
+
+    # [start, end] copies that slice of the previous revision's text,
+    # a string is inserted as is
+    delta = models.JSONField()
+    chain_length = models.PositiveIntegerField(
+        help_text="Deltas since the last full snapshot, including this one."
+    )
+    text_length = models.PositiveIntegerField(
+        help_text="Length of the reconstructed text."
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["record_type", "history_id", "field_name"],
+                name="unique_history_text_delta",
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["record_type", "record_id"], name="historydelta_record_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.record_type} #{self.record_id} {self.field_name} (history {self.history_id})"
+
+
+class ArchivedHistory(models.Model):
+    """
+    The history of one DailyLog, Incident or MAR moved out of its hot
+    historical table (see `manage.py archive_history`). Rows are kept as
+    compressed JSON and rehydrated by the history endpoints on demand.
+    """
+
+    RECORD_TYPES = TimelineEvent.EVENT_TYPES
+
+    record_type = models.CharField(max_length=20, choices=RECORD_TYPES)
+    record_id = models.BigIntegerField(help_text="Primary key of the tracked row.")
+    resident = models.ForeignKey(
+        Resident, on_delete=models.CASCADE, related_name="archived_history"
+    )
+
+    row_count = models.PositiveIntegerField()
+    first_history_date = models.DateTimeField()
+    last_history_date = models.DateTimeField()
+    # zlib-compressed JSON list of historical rows ({attname: text})
+    payload = models.BinaryField()
+
+    archived_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["record_type", "record_id"],
+                name="unique_archived_history_record",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.record_type} #{self.record_id} ({self.row_count} revisions)"
+
+
+class IdempotencyKey(models.Model):
+    """
+    The stored response to a POST sent with an Idempotency-Key header, so a
+    retry of the same request gets the same answer instead of a duplicate
+    record. Rows expire after IDEMPOTENCY_KEY_TTL_HOURS
+    (see `manage.py purge_idempotency_keys`).
+    """
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="idempotency_keys",
+    )
+    key = models.CharField(max_length=255)
+    # sha256 of the method, path and body, to spot a key reused for another request
+    fingerprint = models.CharField(max_length=64)
+
+    status_code = models.PositiveSmallIntegerField()
+    response = models.JSONField(encoder=DjangoJSONEncoder)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "key"], name="unique_idempotency_key_per_user"
+            )
+        ]
+        indexes = [
+            # Purging expired keys
+            models.Index(fields=["expires_at"], name="idempotency_expires_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.user_id})"
@@ -4,6 +4,7 @@ from django.utils import timezone
 from datetime import timedelta
 from rest_framework import serializers
 from django.db import models
+from .history import DIFF_EXCLUDED_FIELDS, history_diffs, related_objects
 from .models import (
     CarePlan,
     DailyLog,
@@ -123,7 +124,8 @@ class DailyLogSerializer(RequireEditReasonOnUpdateMixin, serializers.ModelSerial
                 settings, "DAILY_LOG_LATE_ENTRY_THRESHOLD_MINUTES", 60
             )
             threshold = timedelta(minutes=int(threshold_min))
-            now = timezone.now()
+            # A batch submit checks every row against the same moment
+            now = self.context.get("now") or timezone.now()
 
             is_late = event_at < (now - threshold)
 
@@ -229,7 +231,7 @@ class DailyLogTimelineSerializer(serializers.ModelSerializer):
         fields = (
             "id",
             "event_type",
-            "created_at",
+            "event_at",
             "summary",
             "mood",
             "interventions",
@@ -241,16 +243,30 @@ class DailyLogTimelineSerializer(serializers.ModelSerializer):
         return "DAILY_LOG"
 
 
-DIFF_EXCLUDED_FIELDS = {
-    "id",
-    "history_id",
-    "history_date",
-    "history_type",
-    "history_user",
-    "history_change_reason",
-    "edit_reason_type",
-    "edit_reason_detail",
-}
+def _history_diffs(context):
+    """
+    Adjacent-revision diffs for the history_list in context, computed once
+    per response and shared by every row (see core.history.history_diffs).
+    """
+    diffs = context.get("history_diffs")
+    if diffs is None:
+        diffs = history_diffs(context.get("history_list") or [])
+        context["history_diffs"] = diffs
+    return diffs
+
+
+def _history_related(context):
+    """
+    Related objects for every foreign key value in the history diffs,
+    resolved once per response (see core.history.related_objects).
+    """
+    related = context.get("history_related")
+    if related is None:
+        related = related_objects(
+            context.get("history_list") or [], _history_diffs(context)
+        )
+        context["history_related"] = related
+    return related
 
 
 class HistoryRecordSerializer(serializers.Serializer):
@@ -276,30 +292,12 @@ class HistoryRecordSerializer(serializers.Serializer):
         return HistoryUserSerializer(user).data
 
     def get_changes(self, obj):
-        history_list = self.context.get("history_list")
-        if not history_list:
-            return {}
-
-        index = history_list.index(obj)
-        if index == len(history_list) - 1:
-            # Oldest record has nothing to diff against
-            return {}
-
-        previous = history_list[index + 1]
-        changes = {}
-
-        for field in obj._meta.fields:
-            field_name = field.name
-            if field_name in DIFF_EXCLUDED_FIELDS:
-                continue
-
-            old_value = getattr(previous, field_name, None)
-            new_value = getattr(obj, field_name, None)
-
-            if old_value != new_value:
-                changes[field_name] = {"from": old_value, "to": new_value}
-
-        return changes
+        # Oldest record (or one outside history_list) has nothing to diff against
+        changes = _history_diffs(self.context).get(obj.history_id, [])
+        return {
+            field_name: {"from": old_value, "to": new_value}
+            for field_name, old_value, new_value in changes
+        }
 
 
 HISTORY_SUMMARY_EXCLUDED_FIELDS = DIFF_EXCLUDED_FIELDS
@@ -317,7 +315,11 @@ def _humanize_field_label(history_obj, field_name: str) -> str:
         return field_name.replace("_", " ").strip().title()
 
 
-def _format_value_for_display(history_obj, field_name: str, value):
+def _format_value_for_display(history_obj, field_name: str, value, related=None):
+    """
+    ``related`` is a {model: {pk: obj}} map of preloaded foreign keys; without
+    it each foreign key value is looked up individually.
+    """
     if value is None:
         return None
 
@@ -335,7 +337,10 @@ def _format_value_for_display(history_obj, field_name: str, value):
     if isinstance(field, models.ForeignKey):
         try:
             rel_model = field.remote_field.model
-            obj = rel_model.objects.filter(pk=value).first()
+            if related is not None:
+                obj = related.get(rel_model, {}).get(value)
+            else:
+                obj = rel_model.objects.filter(pk=value).first()
             return str(obj) if obj else value
         except Exception:
             return value
@@ -357,7 +362,21 @@ class HistorySummaryEventSerializer(serializers.Serializer):
         t = getattr(obj, "history_type", "")
         return {"+": "CREATED", "~": "UPDATED", "-": "DELETED"}.get(t, "UNKNOWN")
 
+    def _memoized(self, obj, key, compute):
+        """
+        Compute a per-revision value once; get_summary reuses what the actor
+        and changes fields already built for the same row.
+        """
+        rows = self.context.setdefault("history_summary_rows", {})
+        row = rows.setdefault(obj.history_id, {})
+        if key not in row:
+            row[key] = compute(obj)
+        return row[key]
+
     def get_actor(self, obj):
+        return self._memoized(obj, "actor", self._build_actor)
+
+    def _build_actor(self, obj):
         user = getattr(obj, "history_user", None)
         if not user:
             return None
@@ -370,34 +389,26 @@ class HistorySummaryEventSerializer(serializers.Serializer):
         }
 
     def get_changes(self, obj):
-        history_list = self.context.get("history_list")
-        if not history_list:
-            return []
-
-        index = history_list.index(obj)
-        if index == len(history_list) - 1:
-            return []
+        return self._memoized(obj, "changes", self._build_changes)
 
-        previous = history_list[index + 1]
+    def _build_changes(self, obj):
+        related = _history_related(self.context)
         out = []
-
-        for field in obj._meta.fields:
-            field_name = field.name
-            if field_name in HISTORY_SUMMARY_EXCLUDED_FIELDS:
-                continue
-
-            old_value = getattr(previous, field_name, None)
-            new_value = getattr(obj, field_name, None)
-
-            if old_value != new_value:
-                label = _humanize_field_label(obj, field_name)
-                out.append(
-                    {
-                        "field": label,
-                        "from": _format_value_for_display(obj, field_name, old_value),
-                        "to": _format_value_for_display(obj, field_name, new_value),
-                    }
-                )
+        for field_name, old_value, new_value in _history_diffs(self.context).get(
+            obj.history_id, []
+        ):
+            label = _humanize_field_label(obj, field_name)
+            out.append(
+                {
+                    "field": label,
+                    "from": _format_value_for_display(
+                        obj, field_name, old_value, related
+                    ),
+                    "to": _format_value_for_display(
+                        obj, field_name, new_value, related
+                    ),
+                }
+            )
         return out
 
     def get_summary(self, obj):
@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from simple_history.signals import post_create_historical_record
+
+from .history import compact_history_text, record_history_changes
+from .models import DailyLog, Incident, Medication, MedicationAdministrationRecord
+from .timeline import (
+    remove_timeline_event,
+    resync_medication_timeline_events,
+    resync_user_timeline_events,
+    source_for_model,
+    sync_timeline_event,
+)
+
+
+@receiver(post_save, sender=DailyLog)
+@receiver(post_save, sender=Incident)
+@receiver(post_save, sender=MedicationAdministrationRecord)
+def keep_timeline_event_in_sync(sender, instance, raw=False, **kwargs):
+    # Fixture loading (raw) skips this; run rebuild_timeline afterwards
+    if raw:
+        return
+    sync_timeline_event(source_for_model(sender), instance)
+
+
+@receiver(post_delete, sender=DailyLog)
+@receiver(post_delete, sender=Incident)
+@receiver(post_delete, sender=MedicationAdministrationRecord)
+def drop_timeline_event(sender, instance, **kwargs):
+    remove_timeline_event(source_for_model(sender), instance.pk)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def refresh_timeline_usernames(
+    sender, instance, created=False, raw=False, update_fields=None, **kwargs
+):
+    # New users have no events yet; logins only touch last_login
+    if raw or created:
+        return
+    if update_fields is not None and "username" not in update_fields:
+        return
+    resync_user_timeline_events(instance)
+
+
+@receiver(post_save, sender=Medication)
+def refresh_medication_timeline_events(
+    sender, instance, created=False, raw=False, **kwargs
+):
+    if raw or created:
+        return
+    resync_medication_timeline_events(instance)
+
+
+@receiver(post_create_historical_record)
+def store_history_changes(sender, history_instance, **kwargs):
+    # Untracked historical models are ignored by record_history_changes
+    record_history_changes(history_instance)
+
+
+@receiver(post_create_historical_record)
+def compact_history_row(sender, history_instance, **kwargs):
+    # No-op unless HISTORY_COMPACT_TEXT is on. Registered after
+    # store_history_changes, which diffs the full text first
+    compact_history_text(history_instance)
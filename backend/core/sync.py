@@ -0,0 +1,180 @@
+"""
+Offline sync: apply a queue of creates and updates recorded while a tablet
+had no signal, in one request.
+
+Each mutation goes through the same viewset the REST endpoint uses (its
+serializer validation, object permissions and perform_create/perform_update),
+so the edit-reason, late-entry and history rules are exactly those of a
+normal POST or PATCH.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import PermissionDenied, ValidationError
+
+from .history import HISTORY_ORDERING, HISTORY_RECORD_TYPES
+from .models import ArchivedHistory
+from .timeline import format_datetime
+from .views import (
+    DailyLogViewSet,
+    IncidentViewSet,
+    MedicationAdministrationRecordViewSet,
+)
+
+SYNC_VIEWSETS = {
+    "DAILY_LOG": DailyLogViewSet,
+    "INCIDENT": IncidentViewSet,
+    "MEDICATION": MedicationAdministrationRecordViewSet,
+}
+
+SYNC_OPS = ("create", "update")
+
+
+class SyncConflict(Exception):
+    """
+    The record changed on the server after the revision the client edited.
+    """
+
+    def __init__(self, obj, history_date):
+        super().__init__("The record was changed after base_history_date.")
+        self.obj = obj
+        self.history_date = history_date
+
+
+def parse_mutations(data):
+    """
+    The mutation list from a sync request body. Raises ValueError.
+    """
+    mutations = data.get("mutations") if isinstance(data, dict) else None
+    if not isinstance(mutations, list) or not mutations:
+        raise ValueError("mutations must be a non-empty list.")
+    maximum = int(getattr(settings, "SYNC_MAX_MUTATIONS", 500))
+    if len(mutations) > maximum:
+        raise ValueError(f"At most {maximum} mutations can be synced at once.")
+    return mutations
+
+
+def _viewset(viewset_class, request, action):
+    view = viewset_class(request=request, format_kwarg=None, action=action)
+    view.args, view.kwargs = (), {}
+    return view
+
+
+def latest_history_date(obj):
+    """
+    history_date of the record's newest revision, archived history included.
+    """
+    latest = (
+        obj.history.order_by(*HISTORY_ORDERING)
+        .values_list("history_date", flat=True)
+        .first()
+    )
+    if latest is None:
+        archived = ArchivedHistory.objects.filter(
+            record_type=HISTORY_RECORD_TYPES[type(obj)], record_id=obj.pk
+        ).first()
+        latest = archived.last_history_date if archived else None
+    return latest
+
+
+def _parse_base_history_date(raw):
+    value = parse_datetime(raw) if isinstance(raw, str) else None
+    if value is None:
+        raise ValidationError(
+            {"base_history_date": "An ISO datetime is required for updates."}
+        )
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value
+
+
+def _apply(request, mutation, now):
+    op = mutation.get("op")
+    record_type = mutation.get("type")
+    data = mutation.get("data")
+    if op not in SYNC_OPS:
+        raise ValidationError({"op": f"op must be one of: {', '.join(SYNC_OPS)}."})
+    if record_type not in SYNC_VIEWSETS:
+        raise ValidationError(
+            {"type": f"type must be one of: {', '.join(SYNC_VIEWSETS)}."}
+        )
+    if not isinstance(data, dict):
+        raise ValidationError({"data": "data must be an object."})
+
+    view = _viewset(SYNC_VIEWSETS[record_type], request, op)
+    # Late-entry rules judge every create in the batch against one moment
+    context = {**view.get_serializer_context(), "now": now}
+
+    if op == "create":
+        serializer = view.get_serializer(data=data, context=context)
+        serializer.is_valid(raise_exception=True)
+        view.perform_create(serializer)
+        return "created", serializer
+
+    record_id = mutation.get("record_id")
+    if not isinstance(record_id, int):
+        raise ValidationError({"record_id": "record_id is required for updates."})
+    base = _parse_base_history_date(mutation.get("base_history_date"))
+
+    # Locked so nothing lands between the conflict check and the write
+    obj = (
+        view.get_queryset().select_for_update(of=("self",)).filter(pk=record_id).first()
+    )
+    if obj is None:
+        return "not_found", None
+    view.check_object_permissions(request, obj)
+
+    current = latest_history_date(obj)
+    if current is not None and current > base:
+        raise SyncConflict(obj, current)
+
+    serializer = view.get_serializer(obj, data=data, partial=True, context=context)
+    serializer.is_valid(raise_exception=True)
+    view.perform_update(serializer)
+    return "updated", serializer
+
+
+def apply_mutations(request, mutations):
+    """
+    Apply the mutations in order, in one transaction. Each one runs in its
+    own savepoint, so a mutation that is invalid, forbidden or in conflict
+    is rolled back alone and the rest still apply. Returns one result per
+    mutation, in request order.
+    """
+    now = timezone.now()
+    results = []
+    with transaction.atomic():
+        for mutation in mutations:
+            client_id = mutation.get("id") if isinstance(mutation, dict) else None
+            result = {"id": client_id}
+            try:
+                if not isinstance(mutation, dict):
+                    raise ValidationError("Each mutation must be an object.")
+                with transaction.atomic():
+                    outcome, serializer = _apply(request, mutation, now)
+            except ValidationError as exc:
+                result.update(status="invalid", errors=exc.detail)
+            except PermissionDenied as exc:
+                result.update(status="forbidden", errors={"detail": str(exc.detail)})
+            except SyncConflict as conflict:
+                view = _viewset(SYNC_VIEWSETS[mutation["type"]], request, "retrieve")
+                result.update(
+                    status="conflict",
+                    record_id=conflict.obj.pk,
+                    history_date=format_datetime(conflict.history_date),
+                    record=view.get_serializer(conflict.obj).data,
+                )
+            else:
+                result["status"] = outcome
+                if serializer is not None:
+                    result.update(
+                        record_id=serializer.instance.pk,
+                        history_date=format_datetime(
+                            latest_history_date(serializer.instance)
+                        ),
+                        record=serializer.data,
+                    )
+            results.append(result)
+    return results
@@ -1,22 +1,41 @@
 from django.contrib.auth.models import Group, User
 from django.test import TestCase
+import json
 from datetime import timedelta
+from io import StringIO
+from unittest import mock
 from django.conf import settings
 from django.contrib.admin.sites import AdminSite
 from django.core.exceptions import PermissionDenied
 from django.utils import timezone
-from rest_framework.test import APITestCase
+from django.utils.dateparse import parse_datetime
+from rest_framework.test import APITestCase, APITransactionTestCase
+from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework import status
 from django.urls import reverse
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext, override_settings
+from core import history
 from core.admin import IncidentAdmin, MedicationAdministrationRecordAdmin
+from core.archive import archive_history
 from core.models import (
+    ArchivedHistory,
+    CarePlan,
+    HistoryChange,
+    HistoryTextDelta,
+    IdempotencyKey,
     Resident,
+    Shift,
     Incident,
     Medication,
     MedicationAdministrationRecord,
     EditReasonCode,
     DailyLog,
+    TimelineEvent,
 )
+from core.serializers import DailyLogSerializer
 
 
 class EditReasonEnforcementTests(APITestCase):
@@ -713,3 +732,2525 @@ class DailyLogLateEntryAPITests(APITestCase):
 
         delete = self.client.delete(f"/api/daily-logs/{log_id}/")
         self.assertEqual(delete.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ResidentTimelineAPITests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff_group, _ = Group.objects.get_or_create(name="staff")
+
+        cls.staff = User.objects.create_user(username="staff_tl", password="pass12345")
+        cls.staff.groups.add(cls.staff_group)
+
+        cls.resident = Resident.objects.create(legal_name="Timeline Resident")
+        cls.other_resident = Resident.objects.create(legal_name="Other Resident")
+
+        cls.medication = Medication.objects.create(
+            resident=cls.resident, medication_name="Paracetamol"
+        )
+
+        base = timezone.now() - timedelta(days=1)
+
+        # Interleave the three sources so the merge order matters
+        for i in range(4):
+            DailyLog.objects.create(
+                resident=cls.resident,
+                author=cls.staff,
+                summary=f"Log {i}",
+                event_at=base + timedelta(minutes=30 * i),
+            )
+            Incident.objects.create(
+                resident=cls.resident,
+                reported_by=cls.staff,
+                occurred_at=base + timedelta(minutes=30 * i + 10),
+                category="OTHER",
+                severity="LOW",
+                description=f"Incident {i}",
+            )
+            MedicationAdministrationRecord.objects.create(
+                medication=cls.medication,
+                administered_by=cls.staff,
+                administered_at=base + timedelta(minutes=30 * i + 20),
+                outcome="GIVEN",
+            )
+
+        # Same timestamp across sources to exercise tie-breaking
+        cls.tie_at = base + timedelta(hours=5)
+        DailyLog.objects.create(
+            resident=cls.resident,
+            author=cls.staff,
+            summary="Tie log",
+            event_at=cls.tie_at,
+        )
+        Incident.objects.create(
+            resident=cls.resident,
+            reported_by=cls.staff,
+            occurred_at=cls.tie_at,
+            category="OTHER",
+            severity="LOW",
+            description="Tie incident",
+        )
+
+        DailyLog.objects.create(
+            resident=cls.other_resident,
+            author=cls.staff,
+            summary="Not mine",
+            event_at=base,
+        )
+
+    def _url(self, resident_id=None):
+        return f"/api/residents/{resident_id or self.resident.id}/timeline/"
+
+    def test_full_timeline_is_newest_first_across_sources(self):
+        self.client.force_authenticate(user=self.staff)
+
+        res = self.client.get(self._url())
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        events = res.data["events"]
+        self.assertEqual(len(events), 14)
+        self.assertIsNone(res.data["next_cursor"])
+
+        timestamps = [e["timestamp"] for e in events]
+        self.assertEqual(timestamps, sorted(timestamps, reverse=True))
+        self.assertEqual(
+            {e["event_type"] for e in events}, {"DAILY_LOG", "INCIDENT", "MEDICATION"}
+        )
+        self.assertNotIn("Not mine", [e.get("summary") for e in events])
+
+    def test_cursor_pages_cover_timeline_without_gaps_or_duplicates(self):
+        self.client.force_authenticate(user=self.staff)
+
+        full = self.client.get(self._url()).data["events"]
+
+        seen = []
+        cursor = None
+        pages = 0
+        while True:
+            params = {"limit": 4}
+            if cursor:
+                params["cursor"] = cursor
+            res = self.client.get(self._url(), params)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(res.data["events"]), 4)
+
+            seen.extend(res.data["events"])
+            pages += 1
+            cursor = res.data["next_cursor"]
+            if not cursor:
+                break
+
+        self.assertEqual(pages, 4)
+        self.assertEqual(
+            [(e["event_type"], e["id"]) for e in seen],
+            [(e["event_type"], e["id"]) for e in full],
+        )
+
+    def test_page_query_count_does_not_grow_with_history(self):
+        self.client.force_authenticate(user=self.staff)
+
+        # resident lookup + ETag watermark (1 per source, 1 for the events)
+        # + 1 query per source
+        with self.assertNumQueries(8):
+            res = self.client.get(self._url(), {"limit": 2})
+        self.assertEqual(len(res.data["events"]), 2)
+
+    def test_invalid_cursor_and_limit_are_rejected(self):
+        self.client.force_authenticate(user=self.staff)
+
+        res = self.client.get(self._url(), {"cursor": "not-a-cursor"})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self.client.get(self._url(), {"limit": "0"})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_union_engine_matches_merge_engine(self):
+        self.client.force_authenticate(user=self.staff)
+
+        merged = self.client.get(self._url(), {"engine": "merge"})
+        unioned = self.client.get(self._url(), {"engine": "union"})
+        self.assertEqual(unioned.status_code, status.HTTP_200_OK)
+        self.assertEqual(unioned.data["events"], merged.data["events"])
+
+        merged_page = self.client.get(self._url(), {"engine": "merge", "limit": 5})
+        union_page = self.client.get(self._url(), {"engine": "union", "limit": 5})
+        self.assertEqual(union_page.data["events"], merged_page.data["events"])
+        self.assertEqual(union_page.data["next_cursor"], merged_page.data["next_cursor"])
+
+        next_union = self.client.get(
+            self._url(),
+            {"engine": "union", "limit": 5, "cursor": union_page.data["next_cursor"]},
+        )
+        next_merge = self.client.get(
+            self._url(),
+            {"engine": "merge", "limit": 5, "cursor": merged_page.data["next_cursor"]},
+        )
+        self.assertEqual(next_union.data["events"], next_merge.data["events"])
+
+    def test_union_engine_orders_and_limits_in_one_query(self):
+        self.client.force_authenticate(user=self.staff)
+
+        # resident lookup + ETag watermark + UNION ALL + one pk lookup per source
+        with self.assertNumQueries(9):
+            res = self.client.get(self._url(), {"engine": "union", "limit": 6})
+        self.assertEqual(len(res.data["events"]), 6)
+
+    def test_unknown_engine_is_rejected(self):
+        self.client.force_authenticate(user=self.staff)
+
+        res = self.client.get(self._url(), {"engine": "nope"})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_materialized_engine_matches_merge_engine(self):
+        self.client.force_authenticate(user=self.staff)
+
+        merged = self.client.get(self._url(), {"engine": "merge", "limit": 6})
+        materialized = self.client.get(
+            self._url(), {"engine": "materialized", "limit": 6}
+        )
+        self.assertEqual(materialized.status_code, status.HTTP_200_OK)
+        self.assertEqual(materialized.data["events"], merged.data["events"])
+        self.assertEqual(
+            materialized.data["next_cursor"], merged.data["next_cursor"]
+        )
+
+        # resident lookup + ETag watermark + one range scan
+        with self.assertNumQueries(6):
+            self.client.get(
+                self._url(),
+                {
+                    "engine": "materialized",
+                    "limit": 6,
+                    "cursor": materialized.data["next_cursor"],
+                },
+            )
+
+    def test_timeline_event_follows_source_updates(self):
+        incident = Incident.objects.filter(resident=self.resident).first()
+        incident.description = "Amended"
+        incident.save()
+
+        event = TimelineEvent.objects.get(event_type="INCIDENT", source_id=incident.id)
+        self.assertEqual(event.payload["description"], "Amended")
+        self.assertEqual(event.resident_id, self.resident.id)
+
+    def test_timeline_events_follow_username_and_medication_changes(self):
+        self.client.force_authenticate(user=self.staff)
+
+        # A login only touches last_login and rewrites nothing
+        with self.assertNumQueries(1):
+            self.staff.save(update_fields=["last_login"])
+        self.staff.username = "staff_renamed"
+        self.staff.save()
+
+        self.medication.resident = self.other_resident
+        self.medication.save()
+
+        for resident in (self.resident, self.other_resident):
+            merged = self.client.get(self._url(resident.id), {"engine": "merge"})
+            materialized = self.client.get(
+                self._url(resident.id), {"engine": "materialized"}
+            )
+            self.assertEqual(materialized.data["events"], merged.data["events"])
+        self.assertEqual(
+            {e["event_type"] for e in materialized.data["events"]},
+            {"DAILY_LOG", "MEDICATION"},
+        )
+        usernames = {
+            payload[key]["username"]
+            for payload in TimelineEvent.objects.values_list("payload", flat=True)
+            for key in ("author", "reported_by", "administered_by")
+            if key in payload
+        }
+        self.assertEqual(usernames, {"staff_renamed"})
+
+    def test_rebuild_timeline_command_restores_events(self):
+        expected = TimelineEvent.objects.count()
+        TimelineEvent.objects.all().delete()
+
+        call_command("rebuild_timeline", stdout=StringIO())
+
+        self.assertEqual(TimelineEvent.objects.count(), expected)
+        self.assertEqual(
+            TimelineEvent.objects.filter(resident=self.resident).count(), 14
+        )
+
+    def test_stream_endpoint_sends_ndjson_in_timeline_order(self):
+        self.client.force_authenticate(user=self.staff)
+
+        full = self.client.get(self._url()).json()["events"]
+
+        res = self.client.get(f"{self._url()}stream/")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.streaming)
+        self.assertEqual(res["Content-Type"], "application/x-ndjson")
+
+        body = b"".join(res.streaming_content).decode()
+        lines = body.splitlines()
+        self.assertEqual([json.loads(line) for line in lines], full)
+
+    def test_stream_endpoint_unknown_resident(self):
+        self.client.force_authenticate(user=self.staff)
+
+        res = self.client.get("/api/residents/999999/timeline/stream/")
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_unchanged_timeline_returns_304_for_matching_etag(self):
+        self.client.force_authenticate(user=self.staff)
+
+        first = self.client.get(self._url())
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        etag = first["ETag"]
+        self.assertTrue(etag)
+
+        # resident lookup + one aggregate per source and one for the events,
+        # nothing serialised
+        with self.assertNumQueries(5):
+            res = self.client.get(self._url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Different page -> different representation
+        paged = self.client.get(self._url(), {"limit": 2}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(paged.status_code, status.HTTP_200_OK)
+
+    def test_edit_changes_timeline_etag(self):
+        self.client.force_authenticate(user=self.staff)
+
+        etag = self.client.get(self._url())["ETag"]
+
+        incident = Incident.objects.filter(resident=self.resident).first()
+        incident.description = "Amended"
+        incident.save()
+
+        res = self.client.get(self._url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res["ETag"], etag)
+
+    def test_moves_and_renames_change_timeline_etag(self):
+        self.client.force_authenticate(user=self.staff)
+
+        def etags():
+            return [
+                self.client.get(self._url(resident.id))["ETag"]
+                for resident in (self.resident, self.other_resident)
+            ]
+
+        before = etags()
+        incident = Incident.objects.filter(resident=self.resident).first()
+        incident.resident = self.other_resident
+        incident.save()
+        moved = etags()
+        # Both the resident it left and the one it joined
+        self.assertNotEqual(moved[0], before[0])
+        self.assertNotEqual(moved[1], before[1])
+
+        self.staff.username = "staff_renamed"
+        self.staff.save()
+        renamed = etags()
+        self.assertNotEqual(renamed[0], moved[0])
+
+        self.medication.resident = self.other_resident
+        self.medication.save()
+        reassigned = etags()
+        self.assertNotEqual(reassigned[0], renamed[0])
+        self.assertNotEqual(reassigned[1], renamed[1])
+
+        # The response carries the resident's name
+        self.resident.legal_name = "Renamed Resident"
+        self.resident.save()
+        self.assertNotEqual(etags()[0], reassigned[0])
+
+    @override_settings(TIMELINE_SINCE_OVERLAP=0)
+    def test_since_token_returns_only_new_and_amended_events(self):
+        self.client.force_authenticate(user=self.staff)
+
+        first = self.client.get(self._url())
+        token = first.data["since"]
+
+        new_incident = Incident.objects.create(
+            resident=self.resident,
+            reported_by=self.staff,
+            occurred_at=timezone.now(),
+            category="OTHER",
+            severity="HIGH",
+            description="New since token",
+        )
+        log = DailyLog.objects.filter(resident=self.resident).first()
+        log.summary = "Amended since token"
+        log.save()
+
+        res = self.client.get(self._url(), {"since": token})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(e["event_type"], e["id"]) for e in res.data["events"]],
+            [("INCIDENT", new_incident.id), ("DAILY_LOG", log.id)],
+        )
+        self.assertEqual(res.data["removed"], [])
+
+        # Polling again with the fresh token returns nothing
+        token = res.data["since"]
+        res = self.client.get(self._url(), {"since": token})
+        self.assertEqual(res.data["events"], [])
+
+        # ... unless changes fall inside the overlap window, which are repeated
+        with override_settings(TIMELINE_SINCE_OVERLAP=60):
+            res = self.client.get(self._url(), {"since": token})
+        self.assertIn(
+            ("INCIDENT", new_incident.id),
+            [(e["event_type"], e["id"]) for e in res.data["events"]],
+        )
+
+    @override_settings(TIMELINE_SINCE_OVERLAP=0)
+    def test_since_token_reports_reassigned_records(self):
+        self.client.force_authenticate(user=self.staff)
+        tokens = [
+            self.client.get(self._url(resident.id)).data["since"]
+            for resident in (self.resident, self.other_resident)
+        ]
+
+        incident = Incident.objects.filter(resident=self.resident).first()
+        incident.resident = self.other_resident
+        incident.save()
+
+        res = self.client.get(self._url(), {"since": tokens[0]})
+        self.assertEqual(res.data["events"], [])
+        self.assertEqual(
+            res.data["removed"], [{"event_type": "INCIDENT", "id": incident.id}]
+        )
+        res = self.client.get(self._url(self.other_resident.id), {"since": tokens[1]})
+        self.assertEqual(
+            [(e["event_type"], e["id"]) for e in res.data["events"]],
+            [("INCIDENT", incident.id)],
+        )
+
+    def test_since_token_rescans_overlap_for_late_commits(self):
+        self.client.force_authenticate(user=self.staff)
+        token = self.client.get(self._url()).data["since"]
+
+        # A write stamped before the token was issued but committed after
+        log = DailyLog.objects.filter(resident=self.resident).first()
+        log.summary = "Committed late"
+        log.save()
+        DailyLog.history.filter(history_id=log.history.first().history_id).update(
+            history_date=F("history_date") - timedelta(seconds=30)
+        )
+
+        res = self.client.get(self._url(), {"since": token})
+        self.assertIn(
+            ("DAILY_LOG", log.id),
+            [(e["event_type"], e["id"]) for e in res.data["events"]],
+        )
+        with override_settings(TIMELINE_SINCE_OVERLAP=0):
+            res = self.client.get(self._url(), {"since": token})
+        self.assertEqual(res.data["events"], [])
+
+    def test_invalid_since_token_is_rejected(self):
+        self.client.force_authenticate(user=self.staff)
+
+        res = self.client.get(self._url(), {"since": "garbage"})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_filters_are_applied_by_every_engine(self):
+        self.client.force_authenticate(user=self.staff)
+
+        Incident.objects.create(
+            resident=self.resident,
+            reported_by=self.staff,
+            occurred_at=self.tie_at - timedelta(minutes=5),
+            category="SAFEGUARDING",
+            severity="HIGH",
+            description="High one",
+        )
+
+        for engine in ("merge", "union", "materialized"):
+            res = self.client.get(
+                self._url(), {"engine": engine, "severity": "high"}
+            )
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(
+                [e["description"] for e in res.data["events"]], ["High one"], engine
+            )
+
+            res = self.client.get(
+                self._url(),
+                {"engine": engine, "event_type": "DAILY_LOG,MEDICATION"},
+            )
+            self.assertEqual(
+                {e["event_type"] for e in res.data["events"]},
+                {"DAILY_LOG", "MEDICATION"},
+                engine,
+            )
+            self.assertEqual(len(res.data["events"]), 9, engine)
+
+    def test_date_range_filter(self):
+        self.client.force_authenticate(user=self.staff)
+
+        res = self.client.get(
+            self._url(),
+            {
+                "from": self.tie_at.isoformat(),
+                "to": (self.tie_at + timedelta(seconds=1)).isoformat(),
+            },
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [e["event_type"] for e in res.data["events"]], ["INCIDENT", "DAILY_LOG"]
+        )
+
+    def test_filtered_sources_are_not_queried(self):
+        self.client.force_authenticate(user=self.staff)
+
+        # resident lookup + ETag watermark + only the incident source
+        with self.assertNumQueries(6):
+            self.client.get(self._url(), {"event_type": "INCIDENT", "limit": 10})
+
+    def test_invalid_filters_are_rejected(self):
+        self.client.force_authenticate(user=self.staff)
+
+        for params in ({"event_type": "NOPE"}, {"severity": "EXTREME"}, {"from": "x"}):
+            res = self.client.get(self._url(), params)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+    def test_home_feed_merges_active_residents_with_cursor_pages(self):
+        self.client.force_authenticate(user=self.staff)
+
+        discharged = Resident.objects.create(legal_name="Gone", is_active=False)
+        DailyLog.objects.create(
+            resident=discharged,
+            author=self.staff,
+            summary="Discharged",
+            event_at=timezone.now(),
+        )
+
+        seen = []
+        cursor = None
+        while True:
+            params = {"limit": 5}
+            if cursor:
+                params["cursor"] = cursor
+            res = self.client.get("/api/timeline/", params)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            seen.extend(res.data["events"])
+            cursor = res.data["next_cursor"]
+            if not cursor:
+                break
+
+        # 14 for the main resident + 1 for the other active resident
+        self.assertEqual(len(seen), 15)
+        self.assertEqual(
+            {e["resident_id"] for e in seen}, {self.resident.id, self.other_resident.id}
+        )
+        timestamps = [e["timestamp"] for e in seen]
+        self.assertEqual(timestamps, sorted(timestamps, reverse=True))
+
+        only_other = self.client.get(
+            "/api/timeline/", {"resident": str(self.other_resident.id)}
+        )
+        self.assertEqual(
+            [e["summary"] for e in only_other.data["events"]], ["Not mine"]
+        )
+
+    def test_home_feed_shift_filter(self):
+        self.client.force_authenticate(user=self.staff)
+
+        shift = Shift.objects.create(
+            shift_type="LATE",
+            starts_at=self.tie_at - timedelta(minutes=1),
+            ends_at=self.tie_at + timedelta(minutes=1),
+        )
+        tagged = DailyLog.objects.create(
+            resident=self.resident,
+            author=self.staff,
+            summary="Handover note",
+            event_at=self.tie_at - timedelta(hours=3),
+            shift=shift,
+        )
+
+        for engine in ("merge", "materialized"):
+            res = self.client.get("/api/timeline/", {"shift": shift.id, "engine": engine})
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(
+                [(e["event_type"], e["id"]) for e in res.data["events"]],
+                [
+                    ("INCIDENT", Incident.objects.get(description="Tie incident").id),
+                    ("DAILY_LOG", tagged.id),
+                ],
+                engine,
+            )
+
+    def test_home_feed_reads_one_page_per_source(self):
+        self.client.force_authenticate(user=self.staff)
+
+        # staff group check + one query per source
+        with self.assertNumQueries(4):
+            res = self.client.get("/api/timeline/", {"limit": 3})
+        self.assertEqual(len(res.data["events"]), 3)
+
+    def test_home_feed_requires_staff_group(self):
+        outsider = User.objects.create_user(username="no_group", password="pass12345")
+        self.client.force_authenticate(user=outsider)
+
+        res = self.client.get("/api/timeline/")
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_fast_path_json_is_byte_identical_to_serializers(self):
+        shift = Shift.objects.create(
+            shift_type="DAY",
+            starts_at=self.tie_at,
+            ends_at=self.tie_at + timedelta(hours=8),
+        )
+        DailyLog.objects.create(
+            resident=self.resident,
+            author=self.staff,
+            summary="With shift",
+            mood="Calm",
+            event_at=self.tie_at + timedelta(microseconds=1234),
+            shift=shift,
+        )
+        self.client.force_authenticate(user=self.staff)
+
+        for params in ({}, {"limit": 5}, {"engine": "union", "limit": 5}):
+            with override_settings(TIMELINE_FAST_SERIALIZATION=False):
+                slow = self.client.get(self._url(), params)
+            with override_settings(TIMELINE_FAST_SERIALIZATION=True):
+                fast = self.client.get(self._url(), params)
+            self.assertEqual(fast.content, slow.content, params)
+
+        streams = {}
+        for fast in (False, True):
+            with override_settings(TIMELINE_FAST_SERIALIZATION=fast):
+                res = self.client.get(f"{self._url()}stream/")
+                streams[fast] = b"".join(res.streaming_content)
+        self.assertEqual(streams[True], streams[False])
+
+    def test_benchmark_timeline_command(self):
+        out = StringIO()
+        call_command(
+            "benchmark_timeline", self.resident.id, "--repeat", "1", stdout=out
+        )
+        self.assertIn("Identical JSON", out.getvalue())
+
+
+class ResidentTimelineAsyncTests(APITransactionTestCase):
+    """
+    Worker threads use their own DB connections, so data must be committed.
+    """
+
+    def setUp(self):
+        self.staff = User.objects.create_user(
+            username="staff_async", password="pass12345"
+        )
+        self.resident = Resident.objects.create(legal_name="Async Resident")
+        medication = Medication.objects.create(
+            resident=self.resident, medication_name="Ibuprofen"
+        )
+
+        base = timezone.now() - timedelta(hours=6)
+        for i in range(3):
+            DailyLog.objects.create(
+                resident=self.resident,
+                author=self.staff,
+                summary=f"Log {i}",
+                event_at=base + timedelta(minutes=i),
+            )
+            Incident.objects.create(
+                resident=self.resident,
+                reported_by=self.staff,
+                occurred_at=base + timedelta(minutes=i, seconds=20),
+                category="OTHER",
+                severity="LOW",
+                description=f"Incident {i}",
+            )
+            MedicationAdministrationRecord.objects.create(
+                medication=medication,
+                administered_by=self.staff,
+                administered_at=base + timedelta(minutes=i, seconds=40),
+                outcome="GIVEN",
+            )
+
+        token = RefreshToken.for_user(self.staff).access_token
+        self.auth = {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+
+    def test_async_view_matches_sync_view(self):
+        url = f"/api/residents/{self.resident.id}/timeline/"
+
+        for params in ({}, {"limit": 4}, {"event_type": "INCIDENT"}):
+            sync_res = self.client.get(url, params, **self.auth)
+            async_res = self.client.get(f"{url}async/", params, **self.auth)
+            self.assertEqual(async_res.status_code, status.HTTP_200_OK)
+
+            expected = sync_res.json()
+            del expected["since"]
+            self.assertEqual(async_res.json(), expected, params)
+
+    def test_async_view_connections(self):
+        url = f"/api/residents/{self.resident.id}/timeline/async/"
+        with mock.patch("core.timeline.connections.close_all") as close_all:
+            res = self.client.get(url, **self.auth)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            # Sources share the sync thread's persistent connection
+            close_all.assert_not_called()
+
+            with override_settings(TIMELINE_ASYNC_CONCURRENT_QUERIES=True):
+                res = self.client.get(url, **self.auth)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            # One worker connection per source, closed after its read
+            self.assertEqual(close_all.call_count, 3)
+
+    def test_async_view_requires_token(self):
+        res = self.client.get(f"/api/residents/{self.resident.id}/timeline/async/")
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        res = self.client.get(
+            f"/api/residents/{self.resident.id}/timeline/async/",
+            HTTP_AUTHORIZATION="Bearer nope",
+        )
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class HistoryDiffTests(APITestCase):
+    """
+    History endpoints diff each revision against the previous one in a
+    single pass over the history.
+    """
+
+    revisions = 12
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff_group, _ = Group.objects.get_or_create(name="staff")
+        cls.manager_group, _ = Group.objects.get_or_create(name="manager")
+
+        cls.staff = User.objects.create_user(username="staff1", password="pass12345")
+        cls.staff.groups.add(cls.staff_group)
+        cls.manager = User.objects.create_user(
+            username="manager1", password="pass12345"
+        )
+        cls.manager.groups.add(cls.manager_group)
+
+        cls.resident = Resident.objects.create(
+            legal_name="Test",
+            preferred_name="Resident",
+            date_of_birth="2010-01-01",
+        )
+        cls.medication = Medication.objects.create(
+            resident=cls.resident,
+            medication_name="Paracetamol",
+            dose="500mg",
+            route="Oral",
+        )
+        cls.other_medication = Medication.objects.create(
+            resident=cls.resident,
+            medication_name="Ibuprofen",
+            dose="200mg",
+            route="Oral",
+        )
+
+        cls.incident = Incident(
+            resident=cls.resident,
+            occurred_at=timezone.now(),
+            category="OTHER",
+            severity="LOW",
+            description="Revision 0",
+            reported_by=cls.staff,
+        )
+        cls.incident._history_user = cls.staff
+        cls.incident.save()
+        for n in range(1, cls.revisions):
+            cls.incident.description = f"Revision {n}"
+            cls.incident.severity = "HIGH" if n % 2 else "LOW"
+            cls.incident._change_reason = f"Edit {n}"
+            cls.incident.save()
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.manager)
+
+    def test_every_revision_is_diffed_against_the_previous_one(self):
+        res = self.client.get(f"/api/incidents/{self.incident.id}/history/")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data), self.revisions)
+
+        # Newest first; the oldest (created) revision has nothing to diff against
+        self.assertEqual(res.data[-1]["changes"], {})
+        for position, row in enumerate(res.data[:-1]):
+            n = self.revisions - 1 - position
+            self.assertEqual(
+                row["changes"]["description"],
+                {"from": f"Revision {n - 1}", "to": f"Revision {n}"},
+            )
+            self.assertEqual(row["history_change_reason"], f"Edit {n}")
+
+        summary = self.client.get(
+            f"/api/incidents/{self.incident.id}/history-summary/"
+        )
+        self.assertEqual(summary.status_code, status.HTTP_200_OK)
+        self.assertEqual(summary.data[-1]["changes"], [])
+        self.assertIn(
+            {"field": "Description", "from": "Revision 10", "to": "Revision 11"},
+            summary.data[0]["changes"],
+        )
+
+    @override_settings(HISTORY_CHANGE_STORE=False)
+    def test_history_is_diffed_in_one_pass(self):
+        for path in ("history", "history-summary"):
+            with mock.patch.object(
+                history, "diff_pair", wraps=history.diff_pair
+            ) as diff_pair:
+                res = self.client.get(f"/api/incidents/{self.incident.id}/{path}/")
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(diff_pair.call_count, self.revisions - 1, path)
+
+    def test_mar_foreign_key_changes_are_diffed_by_id(self):
+        mar = MedicationAdministrationRecord.objects.create(
+            medication=self.medication,
+            administered_at=timezone.now(),
+            administered_by=self.staff,
+            outcome="GIVEN",
+        )
+        mar.medication = self.other_medication
+        mar.save()
+
+        res = self.client.get(f"/api/mar/{mar.id}/history/")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            res.data[0]["changes"],
+            {
+                "medication": {
+                    "from": self.medication.id,
+                    "to": self.other_medication.id,
+                }
+            },
+        )
+
+        summary = self.client.get(f"/api/mar/{mar.id}/history-summary/")
+        self.assertEqual(summary.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            summary.data[0]["changes"],
+            [
+                {
+                    "field": "Medication",
+                    "from": str(self.medication),
+                    "to": str(self.other_medication),
+                }
+            ],
+        )
+
+    def test_history_summary_query_count_does_not_grow_with_revisions(self):
+        medications = [self.medication, self.other_medication] + [
+            Medication.objects.create(
+                resident=self.resident,
+                medication_name=f"Medication {n}",
+                dose="1mg",
+                route="Oral",
+            )
+            for n in range(8)
+        ]
+
+        def mar_with_revisions(count):
+            mar = MedicationAdministrationRecord.objects.create(
+                medication=medications[0],
+                administered_at=timezone.now(),
+                administered_by=self.staff,
+                outcome="GIVEN",
+            )
+            for medication in medications[1:count]:
+                mar.medication = medication
+                mar.save()
+            return mar
+
+        short, long = mar_with_revisions(2), mar_with_revisions(len(medications))
+
+        # user groups, the MAR, its history, archived history, stored changes,
+        # one in_bulk for medications
+        with self.assertNumQueries(6):
+            self.client.get(f"/api/mar/{short.id}/history-summary/")
+        with self.assertNumQueries(6):
+            res = self.client.get(f"/api/mar/{long.id}/history-summary/")
+
+        self.assertEqual(
+            [row["changes"][0]["to"] for row in reversed(res.data[:-1])],
+            [str(medication) for medication in medications[1:]],
+        )
+
+    @override_settings(HISTORY_CHANGE_STORE=False)
+    def test_history_summary_builds_each_revision_once(self):
+        from core import serializers
+
+        res = self.client.get(f"/api/incidents/{self.incident.id}/history/")
+        changed_values = 2 * sum(len(row["changes"]) for row in res.data)
+
+        with mock.patch.object(
+            history, "diff_pair", wraps=history.diff_pair
+        ) as diff_pair, mock.patch.object(
+            serializers,
+            "_format_value_for_display",
+            wraps=serializers._format_value_for_display,
+        ) as format_value, mock.patch.object(
+            serializers,
+            "HistoryUserSerializer",
+            wraps=serializers.HistoryUserSerializer,
+        ) as user_serializer:
+            # user groups, the incident, its history (with history_user),
+            # archived history
+            with self.assertNumQueries(4):
+                res = self.client.get(
+                    f"/api/incidents/{self.incident.id}/history-summary/"
+                )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(diff_pair.call_count, self.revisions - 1)
+        self.assertEqual(format_value.call_count, changed_values)
+        self.assertEqual(user_serializer.call_count, self.revisions)
+        self.assertTrue(
+            all(row["actor"]["username"] == "staff1" for row in res.data)
+        )
+        self.assertEqual(
+            res.data[0]["summary"],
+            "staff1 updated Severity (low → high); "
+            "Description (Revision 10 → Revision 11).",
+        )
+
+    def test_history_pages_keep_diffs_across_page_boundaries(self):
+        # Share one history_date across a page boundary so history_id breaks the tie
+        tie = self.incident.history.order_by("-history_id")[3].history_date
+        self.incident.history.filter(
+            history_id__in=list(
+                self.incident.history.order_by("-history_id").values_list(
+                    "history_id", flat=True
+                )[3:7]
+            )
+        ).update(history_date=tie)
+
+        for path in ("history", "history-summary"):
+            url = f"/api/incidents/{self.incident.id}/{path}/"
+            full = self.client.get(url).data
+
+            rows, cursor, pages = [], None, 0
+            while True:
+                params = {"limit": 5}
+                if cursor:
+                    params["cursor"] = cursor
+                res = self.client.get(url, params)
+                self.assertEqual(res.status_code, status.HTTP_200_OK)
+                self.assertLessEqual(len(res.data["results"]), 5)
+                rows.extend(res.data["results"])
+                pages += 1
+                cursor = res.data["next_cursor"]
+                if not cursor:
+                    break
+
+            self.assertEqual(pages, 3, path)
+            self.assertEqual(rows, full, path)
+
+    def test_history_page_query_count_does_not_grow_with_history(self):
+        # user groups, the incident, one page (+1 boundary row) of history,
+        # archived history, its stored changes
+        with self.assertNumQueries(5):
+            res = self.client.get(
+                f"/api/incidents/{self.incident.id}/history/", {"limit": 2}
+            )
+        self.assertEqual(len(res.data["results"]), 2)
+        self.assertIn("description", res.data["results"][-1]["changes"])
+
+    def test_history_invalid_cursor_and_limit_are_rejected(self):
+        mar = MedicationAdministrationRecord.objects.create(
+            medication=self.medication,
+            administered_at=timezone.now(),
+            administered_by=self.staff,
+            outcome="GIVEN",
+        )
+        url = f"/api/mar/{mar.id}/history/"
+        for params in ({"cursor": "nope"}, {"limit": "0"}, {"limit": "x"}):
+            res = self.client.get(url, params)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+        res = self.client.get(url, {"limit": 10})
+        self.assertEqual(len(res.data["results"]), 1)
+        self.assertIsNone(res.data["next_cursor"])
+
+    def test_changes_are_stored_when_history_is_written(self):
+        self.client.force_authenticate(user=self.staff)
+        res = self.client.patch(
+            f"/api/incidents/{self.incident.id}/",
+            {
+                "severity": "MEDIUM",
+                "follow_up_required": True,
+                "edit_reason_detail": "Escalated",
+            },
+            format="json",
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        latest = self.incident.history.order_by("-history_date", "-history_id")[0]
+        stored = HistoryChange.objects.filter(
+            record_type="INCIDENT", history_id=latest.history_id
+        )
+        self.assertEqual(
+            {(c.field_name, c.old_value, c.new_value) for c in stored},
+            {
+                ("severity", "HIGH", "MEDIUM"),
+                ("follow_up_required", "False", "True"),
+            },
+        )
+
+        # "All changes to field X" across records
+        self.assertEqual(
+            HistoryChange.objects.filter(
+                record_type="INCIDENT", field_name="description"
+            ).count(),
+            self.revisions - 1,
+        )
+
+    def test_stored_diffs_match_computed_diffs(self):
+        mar = MedicationAdministrationRecord.objects.create(
+            medication=self.medication,
+            administered_at=timezone.now(),
+            administered_by=self.staff,
+            outcome="GIVEN",
+        )
+        mar.medication = self.other_medication
+        mar.administered_at = timezone.now() - timedelta(minutes=5)
+        mar.notes = "Moved"
+        mar.save()
+
+        urls = [
+            f"/api/incidents/{self.incident.id}/history/",
+            f"/api/incidents/{self.incident.id}/history-summary/",
+            f"/api/mar/{mar.id}/history/",
+            f"/api/mar/{mar.id}/history-summary/",
+        ]
+        for url in urls:
+            stored = self.client.get(url)
+            with override_settings(HISTORY_CHANGE_STORE=False):
+                computed = self.client.get(url)
+            self.assertEqual(stored.content, computed.content, url)
+
+    def test_backfill_history_changes_command(self):
+        url = f"/api/incidents/{self.incident.id}/history/"
+        before = self.client.get(url).content
+        count = HistoryChange.objects.count()
+
+        HistoryChange.objects.all().delete()
+        out = StringIO()
+        call_command("backfill_history_changes", chunk_size=5, stdout=out)
+
+        self.assertIn(f"Wrote {count} history changes.", out.getvalue())
+        self.assertEqual(HistoryChange.objects.count(), count)
+        self.assertEqual(self.client.get(url).content, before)
+
+    def _incidents_with_edits(self, count, edits=3):
+        incidents = []
+        for n in range(count):
+            incident = Incident.objects.create(
+                resident=self.resident,
+                occurred_at=timezone.now(),
+                category="OTHER",
+                severity="LOW",
+                description=f"Incident {n}",
+                reported_by=self.staff,
+            )
+            for edit in range(edits):
+                incident.description = f"Incident {n} edit {edit}"
+                incident.save()
+            incidents.append(incident)
+        return incidents
+
+    def test_bulk_history_summary_matches_single_record_summaries(self):
+        incidents = [self.incident] + self._incidents_with_edits(3)
+        ids = [i.id for i in reversed(incidents)]
+        url = "/api/incidents/bulk-history-summary/"
+
+        for store in (True, False):
+            with override_settings(HISTORY_CHANGE_STORE=store):
+                res = self.client.get(url, {"ids": ",".join(map(str, ids + [0]))})
+                self.assertEqual(res.status_code, status.HTTP_200_OK)
+                # Unknown ids are left out, order follows the request
+                self.assertEqual([r["id"] for r in res.data], ids)
+                for result in res.data:
+                    single = self.client.get(
+                        f"/api/incidents/{result['id']}/history-summary/"
+                    )
+                    self.assertEqual(result["history"], single.data)
+
+    def test_bulk_history_summary_query_count_does_not_grow_with_ids(self):
+        url = "/api/incidents/bulk-history-summary/"
+        few = self._incidents_with_edits(2)
+        many = self._incidents_with_edits(8)
+
+        # user groups, id check, all history rows, archived history, stored
+        # changes
+        for incidents in (few, many):
+            with self.assertNumQueries(5):
+                res = self.client.get(
+                    url, {"ids": ",".join(str(i.id) for i in incidents)}
+                )
+            self.assertEqual(len(res.data), len(incidents))
+
+    def test_bulk_history_summary_validation_and_permissions(self):
+        url = "/api/mar/bulk-history-summary/"
+        for params in ({}, {"ids": "1,x"}, {"ids": ",".join(map(str, range(1, 200)))}):
+            res = self.client.get(url, params)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.client.force_authenticate(user=self.staff)
+        res = self.client.get(url, {"ids": "1"})
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class AuditChangesAPITests(APITestCase):
+    """
+    /api/audit/changes/ merges every historical revision of daily logs,
+    incidents and MAR into one newest-first feed.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff_group, _ = Group.objects.get_or_create(name="staff")
+        cls.manager_group, _ = Group.objects.get_or_create(name="manager")
+
+        cls.staff = User.objects.create_user(username="staff1", password="pass12345")
+        cls.staff.groups.add(cls.staff_group)
+        cls.manager = User.objects.create_user(
+            username="manager1", password="pass12345"
+        )
+        cls.manager.groups.add(cls.manager_group)
+
+        cls.resident = Resident.objects.create(
+            legal_name="Test",
+            preferred_name="Resident",
+            date_of_birth="2010-01-01",
+        )
+        medication = Medication.objects.create(
+            resident=cls.resident,
+            medication_name="Paracetamol",
+            dose="500mg",
+            route="Oral",
+        )
+
+        def save(obj, user, reason=""):
+            obj._history_user = user
+            obj._change_reason = reason
+            obj.save()
+
+        cls.incident = Incident(
+            resident=cls.resident,
+            occurred_at=timezone.now(),
+            category="OTHER",
+            severity="LOW",
+            description="Initial",
+            reported_by=cls.staff,
+        )
+        save(cls.incident, cls.staff)
+        cls.mar = MedicationAdministrationRecord(
+            medication=medication,
+            administered_at=timezone.now(),
+            administered_by=cls.staff,
+            outcome="GIVEN",
+        )
+        save(cls.mar, cls.staff)
+        cls.log = DailyLog(
+            resident=cls.resident,
+            author=cls.staff,
+            summary="Calm day",
+            event_at=timezone.now(),
+        )
+        save(cls.log, cls.staff)
+
+        cls.incident.description = "Corrected"
+        cls.incident.edit_reason_type = "TYPO"
+        save(cls.incident, cls.manager, "Spelling")
+        cls.mar.notes = "Taken with food"
+        cls.mar.edit_reason_type = "CLARIFICATION"
+        save(cls.mar, cls.manager, "Added detail")
+        cls.log.mood = "Happy"
+        cls.log.edit_reason_type = "CLARIFICATION"
+        save(cls.log, cls.staff, "Mood noted")
+
+        # Spread revisions one day apart, oldest first, with a shared
+        # history_date on the last two days to exercise the tie-break
+        base = timezone.now() - timedelta(days=10)
+        revisions = []
+        for model in (Incident, MedicationAdministrationRecord, DailyLog):
+            revisions.extend(model.history.model.objects.all())
+        revisions.sort(key=lambda h: (h.history_type != "+", h.history_date))
+        for day, revision in enumerate(revisions):
+            type(revision).objects.filter(history_id=revision.history_id).update(
+                history_date=base + timedelta(days=min(day, 4))
+            )
+        cls.base = base
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.manager)
+
+    def _feed(self, **params):
+        res = self.client.get("/api/audit/changes/", params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK, res.data)
+        return res.data["events"]
+
+    def test_feed_is_newest_first_across_record_types(self):
+        events = self._feed()
+        self.assertEqual(len(events), 6)
+
+        keys = [(e["at"], e["record_type"], e["history_id"]) for e in events]
+        self.assertEqual(keys, sorted(keys, reverse=True))
+        self.assertEqual(
+            {e["record_type"] for e in events},
+            {"INCIDENT", "MEDICATION", "DAILY_LOG"},
+        )
+
+        incident_edit = next(
+            e
+            for e in events
+            if e["record_type"] == "INCIDENT" and e["event"] == "UPDATED"
+        )
+        self.assertEqual(incident_edit["record_id"], self.incident.id)
+        self.assertEqual(incident_edit["actor"]["username"], "manager1")
+        self.assertEqual(
+            incident_edit["reason"], {"type": "TYPO", "detail": "Spelling"}
+        )
+        self.assertIn(
+            {"field": "description", "from": "Initial", "to": "Corrected"},
+            incident_edit["changes"],
+        )
+
+    def test_cursor_pages_and_stream_cover_the_feed(self):
+        full = self._feed()
+
+        events, cursor = [], None
+        while True:
+            params = {"limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            res = self.client.get("/api/audit/changes/", params)
+            events.extend(res.data["events"])
+            cursor = res.data["next_cursor"]
+            if not cursor:
+                break
+        self.assertEqual(events, full)
+
+        res = self.client.get("/api/audit/changes/stream/")
+        self.assertEqual(res["Content-Type"], "application/x-ndjson")
+        lines = b"".join(res.streaming_content).decode().splitlines()
+        self.assertEqual(
+            [json.loads(line) for line in lines],
+            json.loads(json.dumps(full)),
+        )
+
+    def test_filters(self):
+        by_manager = self._feed(user=self.manager.id)
+        self.assertEqual(
+            {(e["record_type"], e["actor"]["username"]) for e in by_manager},
+            {("INCIDENT", "manager1"), ("MEDICATION", "manager1")},
+        )
+
+        clarifications = self._feed(reason="CLARIFICATION")
+        self.assertEqual(
+            {e["record_type"] for e in clarifications}, {"MEDICATION", "DAILY_LOG"}
+        )
+
+        # Creations sit on days 0-2, edits on days 3-4
+        recent = self._feed(**{"from": (self.base + timedelta(days=3)).isoformat()})
+        self.assertEqual({e["event"] for e in recent}, {"UPDATED"})
+        early = self._feed(to=(self.base + timedelta(days=1)).date().isoformat())
+        self.assertEqual({e["event"] for e in early}, {"CREATED"})
+
+        only_logs = self._feed(record_type="DAILY_LOG")
+        self.assertEqual({e["record_type"] for e in only_logs}, {"DAILY_LOG"})
+
+    def test_page_query_count(self):
+        # user groups, one page per historical table, stored changes per type
+        with self.assertNumQueries(7):
+            self.client.get("/api/audit/changes/", {"limit": 6})
+
+    def test_feed_without_change_store(self):
+        stored = self._feed()
+        HistoryChange.objects.all().delete()
+        with override_settings(HISTORY_CHANGE_STORE=False):
+            computed = self._feed()
+            # user groups, one page per historical table, two queries per
+            # type for the previous revisions
+            with self.assertNumQueries(10):
+                self.client.get("/api/audit/changes/", {"limit": 6})
+        self.assertEqual(computed, stored)
+
+    def test_manager_only_and_invalid_params(self):
+        for params in (
+            {"cursor": "nope"},
+            {"limit": "0"},
+            {"reason": "NOPE"},
+            {"record_type": "CARE_PLAN"},
+            {"user": "me"},
+            {"from": "yesterday"},
+        ):
+            res = self.client.get("/api/audit/changes/", params)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+        self.client.force_authenticate(user=self.staff)
+        for url in ("/api/audit/changes/", "/api/audit/changes/stream/"):
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN, url)
+
+
+class HistoryCompactionTests(APITestCase):
+    """
+    HISTORY_COMPACT_TEXT stores large history text as deltas; reads must
+    not be able to tell.
+    """
+
+    long_text = " ".join(
+        f"Sentence {n} of a long incident account." for n in range(60)
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager_group, _ = Group.objects.get_or_create(name="manager")
+        cls.manager = User.objects.create_user(
+            username="manager1", password="pass12345"
+        )
+        cls.manager.groups.add(cls.manager_group)
+        cls.resident = Resident.objects.create(
+            legal_name="Test",
+            preferred_name="Resident",
+            date_of_birth="2010-01-01",
+        )
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.manager)
+
+    def _incident_with_typo_fixes(self, edits=7):
+        incident = Incident.objects.create(
+            resident=self.resident,
+            occurred_at=timezone.now(),
+            category="OTHER",
+            severity="LOW",
+            description=self.long_text,
+            action_taken="Called the duty manager.",
+            reported_by=self.manager,
+        )
+        for n in range(edits):
+            incident.description = incident.description.replace(
+                f"Sentence {n} ", f"Sentance {n} "
+            )
+            incident.save()
+        return incident
+
+    def _responses(self, incident):
+        urls = [
+            f"/api/incidents/{incident.id}/history/",
+            f"/api/incidents/{incident.id}/history-summary/",
+            f"/api/incidents/{incident.id}/history/?limit=3",
+            "/api/incidents/bulk-history-summary/?ids=" + str(incident.id),
+        ]
+        return [self.client.get(url).content for url in urls]
+
+    @override_settings(HISTORY_COMPACT_TEXT=True, HISTORY_SNAPSHOT_INTERVAL=3)
+    def test_compacted_history_reads_like_full_history(self):
+        with override_settings(HISTORY_COMPACT_TEXT=False):
+            incident = self._incident_with_typo_fixes()
+            expected = self._responses(incident)
+        self.assertFalse(HistoryTextDelta.objects.exists())
+
+        call_command("compact_history", stdout=StringIO())
+
+        # Creation and every third revision are kept in full
+        history = Incident.history.filter(id=incident.id).order_by(
+            "history_date", "history_id"
+        )
+        self.assertEqual(
+            [bool(h.description) for h in history],
+            [True, False, False, True, False, False, True, False],
+        )
+        self.assertEqual(self._responses(incident), expected)
+
+        # A page starting in the middle of a delta chain is rebuilt too
+        url = f"/api/incidents/{incident.id}/history/"
+        cursor = self.client.get(url, {"limit": 1}).data["next_cursor"]
+        page = self.client.get(url, {"limit": 1, "cursor": cursor})
+        self.assertIn(
+            "Sentance 5 ", page.data["results"][0]["changes"]["description"]["to"]
+        )
+
+        call_command("compact_history", expand=True, stdout=StringIO())
+        self.assertFalse(HistoryTextDelta.objects.exists())
+        self.assertTrue(all(h.description for h in history.all()))
+        self.assertEqual(self._responses(incident), expected)
+
+    @override_settings(HISTORY_COMPACT_TEXT=True, HISTORY_SNAPSHOT_INTERVAL=3)
+    def test_new_revisions_are_compacted_on_save(self):
+        incident = self._incident_with_typo_fixes(edits=4)
+
+        # Revisions 2 and 3 are deltas, 4 is a snapshot, 5 starts a new chain.
+        # Unchanged text is a single copy op, so action_taken is compacted too
+        for field_name in ("description", "action_taken"):
+            deltas = HistoryTextDelta.objects.filter(
+                record_type="INCIDENT", record_id=incident.id, field_name=field_name
+            ).order_by("history_id")
+            self.assertEqual([d.chain_length for d in deltas], [1, 2, 1], field_name)
+
+        latest = self.client.get(f"/api/incidents/{incident.id}/history/").data[0]
+        self.assertEqual(latest["changes"]["description"]["to"], incident.description)
+        self.assertEqual(
+            latest["changes"]["description"]["from"],
+            incident.description.replace("Sentance 3 ", "Sentence 3 "),
+        )
+
+    @override_settings(
+        HISTORY_COMPACT_TEXT=True,
+        HISTORY_SNAPSHOT_INTERVAL=10,
+        HISTORY_CHANGE_STORE=False,
+    )
+    def test_filtered_audit_diffs_expand_text_across_skipped_revisions(self):
+        staff = User.objects.create_user(username="staff1", password="pass12345")
+        incident = Incident(
+            resident=self.resident,
+            occurred_at=timezone.now(),
+            category="OTHER",
+            severity="LOW",
+            description=self.long_text,
+            reported_by=staff,
+        )
+        texts = [self.long_text]
+        for n, user in enumerate((staff, self.manager, staff, staff, self.manager)):
+            if n:
+                incident.description = incident.description.replace(
+                    f"Sentence {n} ", f"Sentance {n} "
+                )
+                texts.append(incident.description)
+            incident._history_user = user
+            incident.save()
+
+        # The manager's revisions, and the ones before them, skip the third
+        res = self.client.get("/api/audit/changes/", {"user": self.manager.id})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [event["changes"] for event in res.data["events"]],
+            [
+                [{"field": "description", "from": texts[3], "to": texts[4]}],
+                [{"field": "description", "from": texts[0], "to": texts[1]}],
+            ],
+        )
+
+    @override_settings(HISTORY_COMPACT_TEXT=True, HISTORY_SNAPSHOT_INTERVAL=3)
+    def test_admin_history_form_shows_expanded_text(self):
+        incident = self._incident_with_typo_fixes(edits=4)
+        revision = incident.history.order_by("history_date", "history_id")[2]
+        self.assertFalse(revision.description)
+        expected = history.inflate_history([revision])[0].description
+
+        admin_user = User.objects.create_superuser(
+            username="admin1", password="pass12345"
+        )
+        self.client.force_login(admin_user)
+        res = self.client.get(
+            reverse(
+                "admin:core_incident_simple_history",
+                args=[incident.id, revision.history_id],
+            )
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        # Reverting posts back what the form was rendered with
+        initial = res.context["adminform"].form.initial
+        self.assertEqual(initial["description"], expected)
+        self.assertEqual(initial["action_taken"], "Called the duty manager.")
+
+    def test_dry_run_reports_savings_without_writing(self):
+        incident = self._incident_with_typo_fixes()
+        out = StringIO()
+        call_command("compact_history", dry_run=True, stdout=out)
+
+        self.assertIn("INCIDENT.description:", out.getvalue())
+        self.assertIn("% saved", out.getvalue())
+        self.assertFalse(HistoryTextDelta.objects.exists())
+        self.assertTrue(all(h.description for h in incident.history.all()))
+
+
+class HistoryArchiveTests(APITestCase):
+    """
+    archive_history moves old history for discharged residents out of the
+    hot tables; the history endpoints read it back transparently.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager_group, _ = Group.objects.get_or_create(name="manager")
+        cls.manager = User.objects.create_user(
+            username="manager1", password="pass12345"
+        )
+        cls.manager.groups.add(cls.manager_group)
+
+        cls.discharged = Resident.objects.create(
+            legal_name="Discharged", date_of_birth="2010-01-01", is_active=False
+        )
+        cls.current = Resident.objects.create(
+            legal_name="Current", date_of_birth="2010-01-01"
+        )
+
+        cls.incident = cls._incident(cls.discharged)
+        cls.current_incident = cls._incident(cls.current)
+        medication = Medication.objects.create(
+            resident=cls.discharged, medication_name="Paracetamol"
+        )
+        cls.mar = MedicationAdministrationRecord(
+            medication=medication,
+            administered_at=timezone.now(),
+            administered_by=cls.manager,
+            outcome="GIVEN",
+        )
+        cls.mar._history_user = cls.manager
+        cls.mar.save()
+        cls.mar.outcome = "REFUSED"
+        cls.mar.save()
+
+        # Everything happened well over a year ago
+        long_ago = timezone.now() - timedelta(days=400)
+        for model in (Incident, MedicationAdministrationRecord, DailyLog):
+            for n, row in enumerate(model.history.order_by("history_id")):
+                model.history.filter(history_id=row.history_id).update(
+                    history_date=long_ago + timedelta(minutes=n)
+                )
+
+    @classmethod
+    def _incident(cls, resident):
+        incident = Incident(
+            resident=resident,
+            occurred_at=timezone.now(),
+            category="OTHER",
+            severity="LOW",
+            description="First account",
+            reported_by=cls.manager,
+        )
+        incident._history_user = cls.manager
+        incident.save()
+        for severity in ("MEDIUM", "HIGH"):
+            incident.severity = severity
+            incident._change_reason = f"Raised to {severity}"
+            incident.save()
+        return incident
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.manager)
+
+    def _responses(self):
+        urls = [
+            f"/api/incidents/{self.incident.id}/history/",
+            f"/api/incidents/{self.incident.id}/history-summary/",
+            f"/api/incidents/{self.incident.id}/history/?limit=2",
+            f"/api/mar/{self.mar.id}/history-summary/",
+            "/api/incidents/bulk-history-summary/"
+            f"?ids={self.incident.id},{self.current_incident.id}",
+        ]
+        return [self.client.get(url).content for url in urls]
+
+    def _archive(self, **options):
+        out = StringIO()
+        options.setdefault("older_than_days", 30)
+        call_command("archive_history", stdout=out, **options)
+        return out.getvalue()
+
+    def test_archived_history_reads_like_hot_history(self):
+        expected = self._responses()
+        output = self._archive()
+
+        self.assertFalse(Incident.history.filter(id=self.incident.id).exists())
+        self.assertFalse(
+            MedicationAdministrationRecord.history.filter(id=self.mar.id).exists()
+        )
+        # Active residents keep their hot history
+        self.assertEqual(
+            Incident.history.filter(id=self.current_incident.id).count(), 3
+        )
+        self.assertEqual(
+            ArchivedHistory.objects.get(
+                record_type="INCIDENT", record_id=self.incident.id
+            ).row_count,
+            3,
+        )
+
+        self.assertIn("Archived 3 revisions of 1 INCIDENT records.", output)
+        self.assertIn("core_historicalincident: 6 rows", output)
+        self.assertIn("core_historicalincident: 3 rows", output)
+        self.assertEqual(self._responses(), expected)
+
+    def test_new_revisions_after_archiving_diff_against_archived_ones(self):
+        self._archive()
+
+        self.incident.description = "Corrected account"
+        self.incident._change_reason = "Late correction"
+        self.incident.save()
+
+        res = self.client.get(f"/api/incidents/{self.incident.id}/history/")
+        self.assertEqual(len(res.data), 4)
+        self.assertEqual(
+            res.data[0]["changes"],
+            {"description": {"from": "First account", "to": "Corrected account"}},
+        )
+        self.assertEqual(res.data[1]["history_change_reason"], "Raised to HIGH")
+
+        # Once old enough the new revision joins the archive
+        Incident.history.filter(id=self.incident.id).update(
+            history_date=timezone.now() - timedelta(days=60)
+        )
+        expected = self.client.get(f"/api/incidents/{self.incident.id}/history/")
+        self._archive()
+        archive = ArchivedHistory.objects.get(
+            record_type="INCIDENT", record_id=self.incident.id
+        )
+        self.assertEqual(archive.row_count, 4)
+        self.assertEqual(
+            self.client.get(f"/api/incidents/{self.incident.id}/history/").content,
+            expected.content,
+        )
+
+    def test_recent_or_active_history_is_not_archived(self):
+        self._archive(older_than_days=500)
+        self.assertFalse(ArchivedHistory.objects.exists())
+
+        self.discharged.is_active = True
+        self.discharged.save()
+        self._archive()
+        self.assertFalse(ArchivedHistory.objects.exists())
+
+    def test_archive_queries_do_not_grow_with_records(self):
+        for _ in range(3):
+            incident = self._incident(self.discharged)
+            Incident.history.filter(id=incident.id).update(
+                history_date=timezone.now() - timedelta(days=400)
+            )
+
+        # Per record type: candidates. Per chunk: hot rows, residents,
+        # existing archives, then a savepoint around one insert and two
+        # deletes. Daily logs have no candidates.
+        with self.assertNumQueries(19):
+            moved = archive_history(timezone.now() - timedelta(days=30))
+        self.assertEqual(moved["INCIDENT"], (4, 12))
+        self.assertEqual(
+            ArchivedHistory.objects.filter(record_type="INCIDENT").count(), 4
+        )
+
+    def test_backfill_keeps_archived_diffs(self):
+        self._archive()
+        self.incident.description = "Corrected account"
+        self.incident._change_reason = "Late correction"
+        self.incident.save()
+
+        urls = [
+            f"/api/incidents/{self.incident.id}/history/",
+            f"/api/mar/{self.mar.id}/history/",
+        ]
+        expected = [self.client.get(url).content for url in urls]
+        count = HistoryChange.objects.count()
+
+        call_command("backfill_history_changes", stdout=StringIO())
+        self.assertEqual(HistoryChange.objects.count(), count)
+        self.assertEqual([self.client.get(url).content for url in urls], expected)
+
+    def test_dry_run_only_reports(self):
+        output = self._archive(dry_run=True)
+        self.assertIn("Would archive 3 revisions of 1 INCIDENT records.", output)
+        self.assertIn("Would archive 2 revisions of 1 MEDICATION records.", output)
+        self.assertFalse(ArchivedHistory.objects.exists())
+        self.assertEqual(Incident.history.count(), 6)
+
+
+class AsOfReadTests(APITestCase):
+    """
+    ?as_of= on record reads and the timeline returns what the record said at
+    that moment, rebuilt from its history.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager_group, _ = Group.objects.get_or_create(name="manager")
+        cls.manager = User.objects.create_user(
+            username="manager1", password="pass12345"
+        )
+        cls.manager.groups.add(cls.manager_group)
+
+        cls.resident = Resident.objects.create(
+            legal_name="As Of", date_of_birth="2010-01-01"
+        )
+        medication = Medication.objects.create(
+            resident=cls.resident, medication_name="Paracetamol"
+        )
+        event_at = timezone.now() - timedelta(minutes=5)
+
+        cls.incident = Incident.objects.create(
+            resident=cls.resident,
+            reported_by=cls.manager,
+            occurred_at=event_at,
+            category="OTHER",
+            severity="LOW",
+            description="First account",
+        )
+        cls.log = DailyLog.objects.create(
+            resident=cls.resident,
+            author=cls.manager,
+            summary="Settled evening",
+            event_at=event_at,
+        )
+        cls.mar = MedicationAdministrationRecord.objects.create(
+            medication=medication,
+            administered_by=cls.manager,
+            administered_at=event_at,
+            outcome="GIVEN",
+        )
+        cls.care_plan = CarePlan.objects.create(
+            resident=cls.resident, overview="Original plan"
+        )
+
+        cls.as_of = timezone.now()
+
+        cls.incident.description = "Corrected account"
+        cls.incident.save()
+        cls.log.summary = "Unsettled evening"
+        cls.log.save()
+        cls.mar.outcome = "REFUSED"
+        cls.mar.save()
+        cls.care_plan.overview = "Revised plan"
+        cls.care_plan.save()
+        cls.later = Incident.objects.create(
+            resident=cls.resident,
+            reported_by=cls.manager,
+            occurred_at=event_at,
+            category="OTHER",
+            severity="LOW",
+            description="Reported afterwards",
+        )
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.manager)
+
+    def _get(self, url, **params):
+        params.setdefault("as_of", self.as_of.isoformat())
+        return self.client.get(url, params)
+
+    def test_retrieve_returns_the_record_as_it_stood(self):
+        cases = [
+            (f"/api/incidents/{self.incident.id}/", "description", "First account"),
+            (f"/api/daily-logs/{self.log.id}/", "summary", "Settled evening"),
+            (f"/api/mar/{self.mar.id}/", "outcome", "GIVEN"),
+            (f"/api/care-plans/{self.care_plan.id}/", "overview", "Original plan"),
+        ]
+        for url, field, expected in cases:
+            res = self._get(url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK, url)
+            self.assertEqual(res.data[field], expected, url)
+
+            # Without as_of the current value is returned as before
+            self.assertNotEqual(self.client.get(url).data[field], expected, url)
+
+    def test_list_excludes_records_created_later(self):
+        res = self._get("/api/incidents/")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [row["description"] for row in res.data], ["First account"]
+        )
+
+        res = self._get(f"/api/incidents/{self.later.id}/")
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_timeline_as_of_shows_old_content(self):
+        url = f"/api/residents/{self.resident.id}/timeline/"
+        res = self._get(url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        by_type = {event["event_type"]: event for event in res.data["events"]}
+        self.assertEqual(by_type["INCIDENT"]["description"], "First account")
+        self.assertEqual(by_type["DAILY_LOG"]["summary"], "Settled evening")
+        self.assertEqual(by_type["MEDICATION"]["outcome"], "GIVEN")
+        self.assertEqual(len(res.data["events"]), 3)
+
+        home = self._get("/api/timeline/")
+        self.assertEqual(home.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(home.data["events"]), 3)
+
+    def test_timeline_as_of_follows_reassigned_records(self):
+        other = Resident.objects.create(
+            legal_name="Other", date_of_birth="2010-01-01"
+        )
+        self.log.resident = other
+        self.log.save()
+
+        def logs(resident):
+            res = self._get(f"/api/residents/{resident.id}/timeline/")
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            return [
+                event["summary"]
+                for event in res.data["events"]
+                if event["event_type"] == "DAILY_LOG"
+            ]
+
+        # Before the move the log was still on the first resident
+        self.assertEqual(logs(self.resident), ["Settled evening"])
+        self.assertEqual(logs(other), [])
+
+        self.as_of = timezone.now()
+        self.assertEqual(logs(self.resident), [])
+        self.assertEqual(logs(other), ["Unsettled evening"])
+
+    def test_as_of_reads_archived_history(self):
+        Resident.objects.filter(pk=self.resident.pk).update(is_active=False)
+        call_command("archive_history", older_than_days=0, stdout=StringIO())
+        self.assertFalse(Incident.history.filter(id=self.incident.id).exists())
+
+        res = self._get(f"/api/incidents/{self.incident.id}/")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["description"], "First account")
+
+    def test_invalid_as_of_is_rejected(self):
+        for url in (
+            "/api/incidents/",
+            f"/api/incidents/{self.incident.id}/",
+            f"/api/residents/{self.resident.id}/timeline/",
+        ):
+            res = self._get(url, as_of="yesterday")
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST, url)
+
+    def test_as_of_cannot_be_combined_with_since(self):
+        url = f"/api/residents/{self.resident.id}/timeline/"
+        since = self.client.get(url).data["since"]
+        res = self._get(url, since=since)
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MARBulkCreateTests(APITestCase):
+    """
+    POST /api/mar/bulk/ records a whole medication round in one request.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff_group, _ = Group.objects.get_or_create(name="staff")
+        cls.staff = User.objects.create_user(username="staff1", password="pass12345")
+        cls.staff.groups.add(cls.staff_group)
+
+        cls.medications = []
+        for n in range(30):
+            resident = Resident.objects.create(
+                legal_name=f"Resident {n}", date_of_birth="2010-01-01"
+            )
+            cls.medications.append(
+                Medication.objects.create(
+                    resident=resident, medication_name="Paracetamol"
+                )
+            )
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.staff)
+
+    def _round(self, medications, **overrides):
+        at = timezone.now().isoformat()
+        return [
+            {
+                "medication": medication.id,
+                "administered_at": at,
+                "outcome": "GIVEN",
+                **overrides,
+            }
+            for medication in medications
+        ]
+
+    def test_round_is_recorded_with_history_and_timeline(self):
+        payload = self._round(self.medications)
+        payload[0].update(outcome="REFUSED", edit_reason_detail="Spat it out")
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.post("/api/mar/bulk/", payload, format="json")
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED, res.data)
+        self.assertEqual(len(res.data), 30)
+        self.assertEqual(res.data[0]["outcome"], "REFUSED")
+
+        # Records, their history and their timeline events: one insert each
+        inserts = [q for q in queries.captured_queries if q["sql"].startswith("INSERT")]
+        self.assertEqual(len(inserts), 3)
+
+        ids = [row["id"] for row in res.data]
+        records = MedicationAdministrationRecord.objects.filter(id__in=ids)
+        self.assertEqual(records.count(), 30)
+        self.assertFalse(records.exclude(administered_by=self.staff).exists())
+
+        revisions = MedicationAdministrationRecord.history.filter(id__in=ids)
+        self.assertEqual(revisions.count(), 30)
+        self.assertFalse(revisions.exclude(history_user=self.staff).exists())
+        self.assertEqual(
+            revisions.get(id=ids[0]).history_change_reason, "Spat it out"
+        )
+        self.assertEqual(
+            TimelineEvent.objects.filter(
+                event_type="MEDICATION", source_id__in=ids
+            ).count(),
+            30,
+        )
+
+        # Later edits diff against the bulk-written revision as usual
+        record = records.get(id=ids[1])
+        record.outcome = "HELD"
+        record.save()
+        self.assertTrue(
+            HistoryChange.objects.filter(
+                record_id=record.id, field_name="outcome", new_value="HELD"
+            ).exists()
+        )
+
+    def test_one_invalid_entry_saves_nothing(self):
+        payload = self._round(self.medications[:3])
+        payload[1]["outcome"] = "SWALLOWED"
+
+        res = self.client.post("/api/mar/bulk/", payload, format="json")
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data[0], {})
+        self.assertIn("outcome", res.data[1])
+        self.assertFalse(MedicationAdministrationRecord.objects.exists())
+
+    @override_settings(MAR_BULK_MAX_RECORDS=10)
+    def test_rejects_empty_and_oversized_rounds(self):
+        for payload in ([], self._round(self.medications[:11]), {"outcome": "GIVEN"}):
+            res = self.client.post("/api/mar/bulk/", payload, format="json")
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(MedicationAdministrationRecord.objects.exists())
+
+
+class DailyLogBatchTests(APITestCase):
+    """
+    POST /api/daily-logs/batch/ submits a shift's logs together, keeping the
+    valid rows when others fail.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff_group, _ = Group.objects.get_or_create(name="staff")
+        cls.staff = User.objects.create_user(username="staff1", password="pass12345")
+        cls.staff.groups.add(cls.staff_group)
+
+        cls.residents = [
+            Resident.objects.create(
+                legal_name=f"Resident {n}", date_of_birth="2010-01-01"
+            )
+            for n in range(3)
+        ]
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.staff)
+
+    def _log(self, resident, minutes_ago=5, **extra):
+        return {
+            "resident": resident.id,
+            "summary": f"Evening for {resident.legal_name}",
+            "event_at": (timezone.now() - timedelta(minutes=minutes_ago)).isoformat(),
+            **extra,
+        }
+
+    def test_valid_rows_are_saved_and_invalid_rows_reported(self):
+        payload = [
+            self._log(self.residents[0]),
+            # Late without the LATE_ENTRY reason
+            self._log(self.residents[1], minutes_ago=180),
+            self._log(
+                self.residents[2],
+                minutes_ago=180,
+                edit_reason_type=EditReasonCode.LATE_ENTRY,
+                edit_reason_detail="Written up after the hospital visit",
+            ),
+        ]
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.post("/api/daily-logs/batch/", payload, format="json")
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED, res.data)
+
+        self.assertEqual(len(res.data["created"]), 2)
+        self.assertEqual(len(res.data["errors"]), 1)
+        self.assertEqual(res.data["errors"][0]["index"], 1)
+        self.assertIn("edit_reason_type", res.data["errors"][0]["errors"])
+
+        # Logs, history and timeline events: one insert each, no reason updates
+        sql = [q["sql"] for q in queries.captured_queries]
+        self.assertEqual(len([q for q in sql if q.startswith("INSERT")]), 3)
+        self.assertFalse([q for q in sql if q.startswith("UPDATE")])
+
+        ids = [row["id"] for row in res.data["created"]]
+        logs = DailyLog.objects.filter(id__in=ids)
+        self.assertEqual(
+            {log.resident_id for log in logs},
+            {self.residents[0].id, self.residents[2].id},
+        )
+        self.assertFalse(logs.exclude(author=self.staff).exists())
+        self.assertEqual(len({log.recorded_at for log in logs}), 1)
+
+        late = DailyLog.history.get(resident=self.residents[2])
+        self.assertEqual(late.history_user, self.staff)
+        self.assertEqual(
+            late.history_change_reason, "Written up after the hospital visit"
+        )
+        self.assertEqual(
+            TimelineEvent.objects.filter(event_type="DAILY_LOG").count(), 2
+        )
+
+    def test_late_entry_is_judged_against_the_batch_now(self):
+        # On time for a batch that started three hours ago
+        row = self._log(self.residents[0], minutes_ago=185)
+        serializer = DailyLogSerializer(
+            data=row, context={"now": timezone.now() - timedelta(hours=3)}
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        self.assertFalse(DailyLogSerializer(data=row).is_valid())
+
+    def test_nothing_valid_is_a_bad_request(self):
+        res = self.client.post(
+            "/api/daily-logs/batch/",
+            [{"resident": self.residents[0].id, "summary": "No time given"}],
+            format="json",
+        )
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data["created"], [])
+        self.assertIn("event_at", res.data["errors"][0]["errors"])
+
+    @override_settings(DAILY_LOG_BATCH_MAX_RECORDS=2)
+    def test_rejects_empty_and_oversized_batches(self):
+        for payload in ([], [self._log(r) for r in self.residents], {"summary": "x"}):
+            res = self.client.post("/api/daily-logs/batch/", payload, format="json")
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(DailyLog.objects.exists())
+
+
+class ChangeReasonWriteTests(APITestCase):
+    """
+    Change reasons go in with the history row as it is inserted; nothing
+    reads or rewrites the row afterwards.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff_group, _ = Group.objects.get_or_create(name="staff")
+        cls.staff = User.objects.create_user(username="staff1", password="pass12345")
+        cls.staff.groups.add(cls.staff_group)
+
+        cls.resident = Resident.objects.create(
+            legal_name="Reasons", date_of_birth="2010-01-01"
+        )
+        cls.medication = Medication.objects.create(
+            resident=cls.resident, medication_name="Paracetamol"
+        )
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.staff)
+
+    def _history_writes(self, method, url, data, model):
+        """
+        Run the request (and any on_commit callbacks), returning its response
+        and the SQL that touched the model's history table.
+        """
+        table = model.history.model._meta.db_table
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                res = getattr(self.client, method)(url, data, format="json")
+        sql = [q["sql"] for q in queries.captured_queries if table in q["sql"]]
+        return res, sql
+
+    def _assert_single_insert(self, sql):
+        # The only other statement is the change store's previous-revision read
+        writes = [q for q in sql if not q.startswith("SELECT")]
+        self.assertEqual(len(writes), 1, sql)
+        self.assertTrue(writes[0].startswith("INSERT"), sql)
+
+    def test_incident_update_writes_its_reason_once(self):
+        incident = Incident.objects.create(
+            resident=self.resident,
+            reported_by=self.staff,
+            occurred_at=timezone.now(),
+            category="OTHER",
+            severity="LOW",
+            description="First account",
+        )
+        res, sql = self._history_writes(
+            "patch",
+            f"/api/incidents/{incident.id}/",
+            {"severity": "HIGH", "edit_reason_detail": "Escalated by nurse"},
+            Incident,
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK, res.data)
+        self._assert_single_insert(sql)
+        self.assertEqual(
+            incident.history.first().history_change_reason, "Escalated by nurse"
+        )
+
+    def test_mar_create_and_update_write_their_reason_once(self):
+        res, sql = self._history_writes(
+            "post",
+            "/api/mar/",
+            {
+                "medication": self.medication.id,
+                "administered_at": timezone.now().isoformat(),
+                "outcome": "HELD",
+                "edit_reason_detail": "Held pending GP review",
+            },
+            MedicationAdministrationRecord,
+        )
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED, res.data)
+        self._assert_single_insert(sql)
+        mar = MedicationAdministrationRecord.objects.get(id=res.data["id"])
+        created = mar.history.get()
+        self.assertEqual(created.history_change_reason, "Held pending GP review")
+        self.assertEqual(created.history_user, self.staff)
+
+        res, sql = self._history_writes(
+            "patch",
+            f"/api/mar/{mar.id}/",
+            {"outcome": "GIVEN", "edit_reason_detail": "GP approved"},
+            MedicationAdministrationRecord,
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK, res.data)
+        self._assert_single_insert(sql)
+        self.assertEqual(mar.history.first().history_change_reason, "GP approved")
+
+    def test_daily_log_late_entry_and_update_write_their_reason_once(self):
+        res, sql = self._history_writes(
+            "post",
+            "/api/daily-logs/",
+            {
+                "resident": self.resident.id,
+                "summary": "Evening",
+                "event_at": (timezone.now() - timedelta(hours=3)).isoformat(),
+                "edit_reason_type": EditReasonCode.LATE_ENTRY,
+                "edit_reason_detail": "Written after handover",
+            },
+            DailyLog,
+        )
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED, res.data)
+        self._assert_single_insert(sql)
+        log = DailyLog.objects.get(id=res.data["id"])
+        self.assertEqual(log.author, self.staff)
+        self.assertEqual(
+            log.history.get().history_change_reason, "Written after handover"
+        )
+
+        res, sql = self._history_writes(
+            "patch",
+            f"/api/daily-logs/{log.id}/",
+            {"summary": "Quiet evening", "edit_reason_detail": "Typo"},
+            DailyLog,
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK, res.data)
+        self._assert_single_insert(sql)
+        self.assertEqual(log.history.first().history_change_reason, "Typo")
+
+    def test_long_reasons_are_cut_to_fit_the_history_column(self):
+        incident = Incident.objects.create(
+            resident=self.resident,
+            reported_by=self.staff,
+            occurred_at=timezone.now(),
+            category="OTHER",
+            severity="LOW",
+            description="First account",
+        )
+        res = self.client.patch(
+            f"/api/incidents/{incident.id}/",
+            {"severity": "HIGH", "edit_reason_detail": "x" * 200},
+            format="json",
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK, res.data)
+        self.assertEqual(incident.history.first().history_change_reason, "x" * 100)
+
+    def test_incident_update_query_count(self):
+        incident = Incident.objects.create(
+            resident=self.resident,
+            reported_by=self.staff,
+            occurred_at=timezone.now(),
+            category="OTHER",
+            severity="LOW",
+            description="First account",
+        )
+        # Permission checks, the update, its history row and change store,
+        # and the timeline upsert. A post-commit reason rewrite would add two
+        with self.assertNumQueries(11):
+            with self.captureOnCommitCallbacks(execute=True):
+                res = self.client.patch(
+                    f"/api/incidents/{incident.id}/",
+                    {"severity": "HIGH", "edit_reason_detail": "Escalated"},
+                    format="json",
+                )
+        self.assertEqual(res.status_code, status.HTTP_200_OK, res.data)
+
+
+class IdempotencyKeyTests(APITestCase):
+    """
+    An Idempotency-Key header makes retried record-creating POSTs return the
+    first response instead of creating duplicates.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff_group, _ = Group.objects.get_or_create(name="staff")
+        cls.staff = User.objects.create_user(username="staff1", password="pass12345")
+        cls.staff.groups.add(cls.staff_group)
+        cls.other_staff = User.objects.create_user(
+            username="staff2", password="pass12345"
+        )
+        cls.other_staff.groups.add(cls.staff_group)
+
+        cls.resident = Resident.objects.create(
+            legal_name="Retries", date_of_birth="2010-01-01"
+        )
+        cls.medication = Medication.objects.create(
+            resident=cls.resident, medication_name="Paracetamol"
+        )
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.staff)
+        self.incident = {
+            "resident": self.resident.id,
+            "occurred_at": timezone.now().isoformat(),
+            "category": "OTHER",
+            "severity": "LOW",
+            "description": "Slipped in the hallway",
+        }
+
+    def _post(self, url, data, key="tablet-7:42"):
+        return self.client.post(url, data, format="json", HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_returns_the_stored_response_without_writing(self):
+        first = self._post("/api/incidents/", self.incident)
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED, first.data)
+        self.assertNotIn("Idempotent-Replayed", first)
+
+        with CaptureQueriesContext(connection) as queries:
+            retry = self._post("/api/incidents/", self.incident)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.json(), first.json())
+
+        self.assertEqual(Incident.objects.count(), 1)
+        self.assertEqual(Incident.history.count(), 1)
+        self.assertFalse(
+            [q for q in queries.captured_queries if not q["sql"].startswith("SELECT")]
+        )
+
+    def test_key_reused_for_a_different_request_is_rejected(self):
+        self._post("/api/incidents/", self.incident)
+
+        changed = {**self.incident, "severity": "HIGH"}
+        res = self._post("/api/incidents/", changed)
+        self.assertEqual(res.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        res = self._post(
+            "/api/daily-logs/",
+            {
+                "resident": self.resident.id,
+                "summary": "Evening",
+                "event_at": timezone.now().isoformat(),
+            },
+        )
+        self.assertEqual(res.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Incident.objects.count(), 1)
+        self.assertFalse(DailyLog.objects.exists())
+
+    def test_keys_are_scoped_to_the_user(self):
+        self._post("/api/incidents/", self.incident)
+        self.client.force_authenticate(user=self.other_staff)
+        res = self._post("/api/incidents/", self.incident)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn("Idempotent-Replayed", res)
+        self.assertEqual(Incident.objects.count(), 2)
+
+    def test_failed_requests_are_not_stored(self):
+        invalid = {**self.incident, "severity": "CATASTROPHIC"}
+        res = self._post("/api/incidents/", invalid)
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        res = self._post("/api/incidents/", self.incident)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Incident.objects.count(), 1)
+
+    def test_concurrent_retry_loses_to_the_first_commit(self):
+        first = self._post("/api/incidents/", self.incident)
+
+        # The retry misses the stored key (as if both were in flight), runs,
+        # and is rolled back when the key insert collides
+        with mock.patch("core.idempotency._stored", return_value=None):
+            retry = self._post("/api/incidents/", self.incident)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Incident.objects.count(), 1)
+        self.assertEqual(TimelineEvent.objects.count(), 1)
+
+    def test_expired_keys_run_again_and_are_purged(self):
+        self._post("/api/incidents/", self.incident)
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(hours=1))
+
+        res = self._post("/api/incidents/", self.incident)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn("Idempotent-Replayed", res)
+        self.assertEqual(Incident.objects.count(), 2)
+
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(hours=1))
+        out = StringIO()
+        call_command("purge_idempotency_keys", stdout=out)
+        self.assertIn("Deleted 1 expired keys.", out.getvalue())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_bulk_and_batch_endpoints_are_idempotent(self):
+        at = timezone.now().isoformat()
+        round_ = [
+            {
+                "medication": self.medication.id,
+                "administered_at": at,
+                "outcome": "GIVEN",
+            }
+        ]
+        logs = [{"resident": self.resident.id, "summary": "Evening", "event_at": at}]
+        for url, payload, model in (
+            ("/api/mar/bulk/", round_, MedicationAdministrationRecord),
+            ("/api/daily-logs/batch/", logs, DailyLog),
+        ):
+            first = self._post(url, payload, key=url)
+            retry = self._post(url, payload, key=url)
+            self.assertEqual(first.status_code, status.HTTP_201_CREATED, url)
+            self.assertEqual(retry.json(), first.json(), url)
+            self.assertEqual(model.objects.count(), 1, url)
+
+    def test_requests_without_a_key_are_unchanged(self):
+        for _ in range(2):
+            res = self.client.post("/api/incidents/", self.incident, format="json")
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Incident.objects.count(), 2)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        res = self._post("/api/incidents/", self.incident, key="x" * 256)
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SyncAPITests(APITestCase):
+    """
+    POST /api/sync/ applies an offline queue of creates and updates with the
+    same rules as the record endpoints, reporting a result per mutation.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff_group, _ = Group.objects.get_or_create(name="staff")
+        cls.staff = User.objects.create_user(username="staff1", password="pass12345")
+        cls.staff.groups.add(cls.staff_group)
+        cls.other_staff = User.objects.create_user(
+            username="staff2", password="pass12345"
+        )
+        cls.other_staff.groups.add(cls.staff_group)
+
+        cls.resident = Resident.objects.create(
+            legal_name="Offline", date_of_birth="2010-01-01"
+        )
+        cls.medication = Medication.objects.create(
+            resident=cls.resident, medication_name="Paracetamol"
+        )
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.staff)
+        self.mar = MedicationAdministrationRecord.objects.create(
+            medication=self.medication,
+            administered_by=self.staff,
+            administered_at=timezone.now(),
+            outcome="GIVEN",
+        )
+        self.base = self.mar.history.first().history_date.isoformat()
+
+    def _sync(self, *mutations):
+        res = self.client.post(
+            "/api/sync/", {"mutations": list(mutations)}, format="json"
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK, res.data)
+        return res.data["results"]
+
+    def _mar_update(self, data, **extra):
+        return {
+            "id": "mar-edit",
+            "op": "update",
+            "type": "MEDICATION",
+            "record_id": self.mar.id,
+            "base_history_date": self.base,
+            "data": data,
+            **extra,
+        }
+
+    def test_mixed_queue_is_applied_in_one_request(self):
+        results = self._sync(
+            {
+                "id": "incident-1",
+                "op": "create",
+                "type": "INCIDENT",
+                "data": {
+                    "resident": self.resident.id,
+                    "occurred_at": timezone.now().isoformat(),
+                    "category": "OTHER",
+                    "severity": "LOW",
+                    "description": "Fell in the garden",
+                },
+            },
+            {
+                "id": "log-1",
+                "op": "create",
+                "type": "DAILY_LOG",
+                "data": {
+                    "resident": self.resident.id,
+                    "summary": "Quiet afternoon",
+                    "event_at": timezone.now().isoformat(),
+                },
+            },
+            self._mar_update({"outcome": "REFUSED", "edit_reason_detail": "Refused"}),
+        )
+
+        self.assertEqual(
+            [(r["id"], r["status"]) for r in results],
+            [("incident-1", "created"), ("log-1", "created"), ("mar-edit", "updated")],
+        )
+        incident = Incident.objects.get(id=results[0]["record_id"])
+        self.assertEqual(incident.reported_by, self.staff)
+        self.assertEqual(DailyLog.objects.get().author, self.staff)
+
+        self.mar.refresh_from_db()
+        self.assertEqual(self.mar.outcome, "REFUSED")
+        latest = self.mar.history.first()
+        self.assertEqual(latest.history_change_reason, "Refused")
+        self.assertEqual(latest.history_user, self.staff)
+        self.assertEqual(
+            parse_datetime(results[2]["history_date"]), latest.history_date
+        )
+        self.assertEqual(results[2]["record"]["outcome"], "REFUSED")
+
+    def test_edit_reason_rules_apply_per_mutation(self):
+        results = self._sync(
+            self._mar_update({"outcome": "REFUSED"}),
+            {
+                "id": "late-log",
+                "op": "create",
+                "type": "DAILY_LOG",
+                "data": {
+                    "resident": self.resident.id,
+                    "summary": "Written up much later",
+                    "event_at": (timezone.now() - timedelta(hours=5)).isoformat(),
+                },
+            },
+            {
+                "id": "incident-2",
+                "op": "create",
+                "type": "INCIDENT",
+                "data": {
+                    "resident": self.resident.id,
+                    "occurred_at": timezone.now().isoformat(),
+                    "category": "OTHER",
+                    "severity": "LOW",
+                    "description": "Still applied",
+                },
+            },
+        )
+        self.assertEqual(
+            [r["status"] for r in results], ["invalid", "invalid", "created"]
+        )
+        self.assertIn("edit_reason_detail", results[0]["errors"])
+        self.assertIn("edit_reason_type", results[1]["errors"])
+
+        self.mar.refresh_from_db()
+        self.assertEqual(self.mar.outcome, "GIVEN")
+        self.assertFalse(DailyLog.objects.exists())
+        self.assertEqual(Incident.objects.count(), 1)
+
+    def test_edits_against_a_stale_revision_conflict(self):
+        self.mar.outcome = "HELD"
+        self.mar._change_reason = "Changed on another tablet"
+        self.mar.save()
+
+        results = self._sync(
+            self._mar_update({"notes": "Offline note", "edit_reason_detail": "Note"})
+        )
+        self.assertEqual(results[0]["status"], "conflict")
+        self.assertEqual(results[0]["record"]["outcome"], "HELD")
+        self.assertEqual(
+            parse_datetime(results[0]["history_date"]),
+            self.mar.history.first().history_date,
+        )
+        self.mar.refresh_from_db()
+        self.assertEqual(self.mar.notes, "")
+
+        # Rebasing on the returned history_date lets the edit through
+        results = self._sync(
+            self._mar_update(
+                {"notes": "Offline note", "edit_reason_detail": "Note"},
+                base_history_date=results[0]["history_date"],
+            )
+        )
+        self.assertEqual(results[0]["status"], "updated")
+
+    def test_object_permissions_and_missing_records(self):
+        log = DailyLog.objects.create(
+            resident=self.resident,
+            author=self.other_staff,
+            summary="Someone else's",
+            event_at=timezone.now(),
+        )
+        base = log.history.first().history_date.isoformat()
+        results = self._sync(
+            {
+                "id": "not-mine",
+                "op": "update",
+                "type": "DAILY_LOG",
+                "record_id": log.id,
+                "base_history_date": base,
+                "data": {"summary": "Mine now", "edit_reason_detail": "Typo"},
+            },
+            self._mar_update({"outcome": "HELD"}, record_id=10_000),
+            self._mar_update({"outcome": "HELD"}, base_history_date=None),
+            {"id": "bad-op", "op": "delete", "type": "MEDICATION", "data": {}},
+        )
+        self.assertEqual(
+            [r["status"] for r in results],
+            ["forbidden", "not_found", "invalid", "invalid"],
+        )
+        self.assertIn("base_history_date", results[2]["errors"])
+        self.assertIn("op", results[3]["errors"])
+        log.refresh_from_db()
+        self.assertEqual(log.summary, "Someone else's")
+
+    def test_large_queue_syncs_in_one_request(self):
+        mutations = []
+        for n in range(200):
+            mutations.append(
+                {
+                    "id": f"log-{n}",
+                    "op": "create",
+                    "type": "DAILY_LOG",
+                    "data": {
+                        "resident": self.resident.id,
+                        "summary": f"Check {n}",
+                        "event_at": timezone.now().isoformat(),
+                    },
+                }
+            )
+        results = self._sync(*mutations)
+        self.assertEqual({r["status"] for r in results}, {"created"})
+        self.assertEqual(
+            [r["id"] for r in results], [m["id"] for m in mutations]
+        )
+        self.assertEqual(DailyLog.objects.count(), 200)
+        self.assertEqual(DailyLog.history.count(), 200)
+
+    @override_settings(SYNC_MAX_MUTATIONS=2)
+    def test_malformed_batches_are_rejected(self):
+        update = self._mar_update({"outcome": "HELD"})
+        for body in ({}, {"mutations": []}, {"mutations": [update] * 3}):
+            res = self.client.post("/api/sync/", body, format="json")
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_retried_sync_with_idempotency_key_is_replayed(self):
+        body = {
+            "mutations": [
+                self._mar_update({"notes": "Once", "edit_reason_detail": "Note"})
+            ]
+        }
+        first = self.client.post(
+            "/api/sync/", body, format="json", HTTP_IDEMPOTENCY_KEY="sync-1"
+        )
+        retry = self.client.post(
+            "/api/sync/", body, format="json", HTTP_IDEMPOTENCY_KEY="sync-1"
+        )
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(self.mar.history.count(), 2)
@@ -0,0 +1,919 @@
+import asyncio
+import hashlib
+import heapq
+import json
+from dataclasses import dataclass
+from datetime import datetime, time, timedelta
+from datetime import timezone as dt_timezone
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.db.models import CharField, Count, F, Max, Q, Value
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework import serializers
+
+from .cursors import InvalidCursor, decode_cursor, encode_cursor
+from .history import inflate_history, revisions_as_of
+from .models import (
+    DailyLog,
+    Incident,
+    MedicationAdministrationRecord,
+    Shift,
+    TimelineEvent,
+)
+from .serializers import (
+    DailyLogTimelineSerializer,
+    IncidentTimelineSerializer,
+    MARTimelineSerializer,
+)
+
+
+# CURSORS ----------------------------------------------
+
+
+def decode_timeline_cursor(token: str):
+    """
+    Timeline cursors are (timestamp, event_type, id) of the last event
+    on the previous page.
+    """
+    parts = decode_cursor(token)
+    if len(parts) != 3:
+        raise InvalidCursor("Invalid cursor.")
+
+    timestamp = parse_datetime(parts[0]) if isinstance(parts[0], str) else None
+    if timestamp is None or not isinstance(parts[2], int):
+        raise InvalidCursor("Invalid cursor.")
+    return timestamp, str(parts[1]), parts[2]
+
+
+# SOURCES ----------------------------------------------
+
+
+# DRF's own datetime formatting, so fast-path output matches the serializers
+format_datetime = serializers.DateTimeField().to_representation
+
+
+def _render_value(value):
+    if isinstance(value, datetime):
+        return format_datetime(value)
+    return value
+
+
+@dataclass(frozen=True)
+class TimelineSource:
+    """
+    One table feeding the timeline. Rows are always read newest first,
+    ordered by (timestamp, id), which is the same order the merge uses.
+    """
+
+    event_type: str
+    model: type
+    timestamp_field: str
+    resident_lookup: str
+    serializer_class: type
+    related: tuple = ()
+    # Optional filters this source understands, filter name -> model field
+    filter_fields: tuple = ()
+    # Fast path: (output key, .values() lookup) in the serializer's field
+    # order. A (id lookup, username lookup) pair renders a nested user.
+    row_fields: tuple = ()
+
+    @property
+    def resident_path(self):
+        return self.resident_lookup.removesuffix("_id")
+
+    def queryset(self, resident_id=None, cursor=None, filters=None, as_of=None):
+        """
+        Ordered rows for one resident, or for every active resident when
+        resident_id is None (the home-wide feed).
+
+        With as_of, the rows are the historical revisions current at that
+        moment instead (same field names, so filters and ordering apply as is).
+        They are matched to the resident by the revision, not the live record,
+        so records moved since are shown where they were then.
+        """
+        if resident_id is None:
+            here = {f"{self.resident_path}__is_active": True}
+        else:
+            here = {self.resident_lookup: resident_id}
+        if as_of is None:
+            qs = self.model.objects.filter(**here)
+        else:
+            ever_here = self.model.history.filter(**here).values("id")
+            qs = revisions_as_of(
+                self.model.objects.filter(id__in=ever_here), as_of
+            ).filter(**here)
+        qs = qs.filter(**{f"{self.timestamp_field}__isnull": False}).select_related(
+            *self.related
+        )
+        if filters is not None:
+            qs = filters.apply(self, qs)
+        if cursor is not None:
+            qs = qs.filter(self._after(cursor))
+        return qs.order_by(f"-{self.timestamp_field}", "-id")
+
+    def _after(self, cursor):
+        """
+        Rows that sort strictly after the cursor. Ties on timestamp are broken
+        by event_type and then id, both descending.
+        """
+        timestamp, event_type, pk = cursor
+        field = self.timestamp_field
+        older = Q(**{f"{field}__lt": timestamp})
+
+        if self.event_type < event_type:
+            return older | Q(**{field: timestamp})
+        if self.event_type == event_type:
+            return older | Q(**{field: timestamp, "id__lt": pk})
+        return older
+
+    def union_branch(self, resident_id, cursor=None, filters=None):
+        """
+        (timestamp, event_type, id) projection of this source, shaped so the
+        three branches line up column for column in a UNION ALL.
+        """
+        return (
+            self.queryset(resident_id, cursor=cursor, filters=filters)
+            .order_by()
+            .annotate(
+                timestamp=F(self.timestamp_field),
+                event_type=Value(self.event_type, output_field=CharField()),
+            )
+            .values_list("timestamp", "event_type", "id")
+        )
+
+    def resident_id_for(self, obj):
+        value = obj
+        for attr in self.resident_lookup.split("__"):
+            value = getattr(value, attr)
+        return value
+
+    def to_event(self, obj):
+        """
+        Unsaved TimelineEvent mirroring obj.
+        """
+        return TimelineEvent(
+            resident_id=self.resident_id_for(obj),
+            timestamp=getattr(obj, self.timestamp_field),
+            event_type=self.event_type,
+            source_id=obj.pk,
+            payload=self.serialize(obj),
+        )
+
+    def sort_key(self, obj):
+        return (getattr(obj, self.timestamp_field), self.event_type, obj.pk)
+
+    # Fast path ---------------------------------------------
+
+    def values(self, qs):
+        lookups = {self.resident_lookup, self.timestamp_field, "id"}
+        for _, lookup in self.row_fields:
+            if isinstance(lookup, tuple):
+                lookups.update(lookup)
+            elif lookup:
+                lookups.add(lookup)
+        return qs.values(*sorted(lookups))
+
+    def row_sort_key(self, row):
+        return (row[self.timestamp_field], self.event_type, row["id"])
+
+    def render_row(self, row) -> dict:
+        """
+        Build the same dict the timeline serializer would, straight from a
+        .values() row, without instantiating models or serializer fields.
+        """
+        data = {}
+        for key, lookup in self.row_fields:
+            if lookup is None:
+                data[key] = self.event_type
+            elif isinstance(lookup, tuple):
+                user_id = row[lookup[0]]
+                data[key] = (
+                    None
+                    if user_id is None
+                    else {"id": user_id, "username": row[lookup[1]]}
+                )
+            else:
+                data[key] = _render_value(row[lookup])
+        data["timestamp"] = data[self.timestamp_field]
+        data["resident_id"] = row[self.resident_lookup]
+        return data
+
+    def serialize(self, obj) -> dict:
+        data = self.serializer_class(obj).data
+        return {
+            **data,
+            "timestamp": data[self.timestamp_field],
+            "resident_id": self.resident_id_for(obj),
+        }
+
+
+TIMELINE_SOURCES = (
+    TimelineSource(
+        event_type="DAILY_LOG",
+        model=DailyLog,
+        timestamp_field="event_at",
+        resident_lookup="resident_id",
+        serializer_class=DailyLogTimelineSerializer,
+        related=("author",),
+        filter_fields=(("shift", "shift_id"),),
+        row_fields=(
+            ("id", "id"),
+            ("event_type", None),
+            ("event_at", "event_at"),
+            ("summary", "summary"),
+            ("mood", "mood"),
+            ("interventions", "interventions"),
+            ("author", ("author_id", "author__username")),
+            ("shift", "shift_id"),
+        ),
+    ),
+    TimelineSource(
+        event_type="INCIDENT",
+        model=Incident,
+        timestamp_field="occurred_at",
+        resident_lookup="resident_id",
+        serializer_class=IncidentTimelineSerializer,
+        related=("reported_by",),
+        filter_fields=(("severity", "severity"),),
+        row_fields=(
+            ("id", "id"),
+            ("event_type", None),
+            ("occurred_at", "occurred_at"),
+            ("category", "category"),
+            ("severity", "severity"),
+            ("description", "description"),
+            ("action_taken", "action_taken"),
+            ("reported_by", ("reported_by_id", "reported_by__username")),
+            ("follow_up_required", "follow_up_required"),
+        ),
+    ),
+    TimelineSource(
+        event_type="MEDICATION",
+        model=MedicationAdministrationRecord,
+        timestamp_field="administered_at",
+        resident_lookup="medication__resident_id",
+        serializer_class=MARTimelineSerializer,
+        related=("administered_by", "medication"),
+        row_fields=(
+            ("id", "id"),
+            ("event_type", None),
+            ("administered_at", "administered_at"),
+            ("outcome", "outcome"),
+            ("notes", "notes"),
+            ("administered_by", ("administered_by_id", "administered_by__username")),
+            ("medication", "medication_id"),
+        ),
+    ),
+)
+
+
+# FILTERS ----------------------------------------------
+
+
+def parse_bound(raw, name, end_of_day=False):
+    """
+    Accepts an ISO datetime or a plain date. A plain date used as an upper
+    bound covers that whole day.
+    """
+    value = parse_datetime(raw)
+    if value is None:
+        day = parse_date(raw)
+        if day is None:
+            raise ValueError(f"{name} must be an ISO date or datetime.")
+        if end_of_day:
+            day += timedelta(days=1)
+        value = datetime.combine(day, time.min)
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value
+
+
+@dataclass(frozen=True)
+class TimelineFilters:
+    """
+    Server-side timeline filters. Applied to each source queryset, so rows
+    outside the filter are never read.
+
+    - event_types: only these sources
+    - date_from / date_to: timestamp >= date_from and < date_to
+    - severities: incident severities; sources without a severity are skipped
+    - resident_ids: only these residents (home-wide feed)
+    - shift: (id, starts_at, ends_at). Daily logs tagged with the shift, other
+      events recorded inside its time window
+    """
+
+    event_types: frozenset = frozenset()
+    date_from: datetime = None
+    date_to: datetime = None
+    severities: frozenset = frozenset()
+    resident_ids: frozenset = frozenset()
+    shift: tuple = None
+
+    @classmethod
+    def from_query_params(cls, params):
+        known_types = {source.event_type for source in TIMELINE_SOURCES}
+        known_severities = {code for code, _ in Incident.SEVERITY_LEVELS}
+
+        event_types = split_param(params, "event_type")
+        if event_types - known_types:
+            raise ValueError(
+                f"event_type must be one of: {', '.join(sorted(known_types))}."
+            )
+
+        severities = split_param(params, "severity")
+        if severities - known_severities:
+            raise ValueError(
+                f"severity must be one of: {', '.join(sorted(known_severities))}."
+            )
+
+        date_from = params.get("from")
+        date_to = params.get("to")
+
+        resident_ids = set()
+        for raw in split_param(params, "resident"):
+            if not raw.isdigit():
+                raise ValueError("resident must be a list of resident ids.")
+            resident_ids.add(int(raw))
+
+        shift = None
+        shift_id = params.get("shift")
+        if shift_id:
+            found = (
+                Shift.objects.filter(id=shift_id)
+                .values_list("id", "starts_at", "ends_at")
+                .first()
+                if shift_id.isdigit()
+                else None
+            )
+            if found is None:
+                raise ValueError("Shift not found.")
+            shift = tuple(found)
+
+        return cls(
+            event_types=frozenset(event_types),
+            date_from=parse_bound(date_from, "from") if date_from else None,
+            date_to=parse_bound(date_to, "to", end_of_day=True) if date_to else None,
+            severities=frozenset(severities),
+            resident_ids=frozenset(resident_ids),
+            shift=shift,
+        )
+
+    def includes(self, source) -> bool:
+        if self.event_types and source.event_type not in self.event_types:
+            return False
+        fields = dict(source.filter_fields)
+        if self.severities and "severity" not in fields:
+            return False
+        return True
+
+    def apply(self, source, qs):
+        field = source.timestamp_field
+        if self.date_from is not None:
+            qs = qs.filter(**{f"{field}__gte": self.date_from})
+        if self.date_to is not None:
+            qs = qs.filter(**{f"{field}__lt": self.date_to})
+        if self.severities:
+            severity_field = dict(source.filter_fields)["severity"]
+            qs = qs.filter(**{f"{severity_field}__in": self.severities})
+        if self.resident_ids:
+            qs = qs.filter(**{f"{source.resident_lookup}__in": self.resident_ids})
+        if self.shift is not None:
+            shift_id, starts_at, ends_at = self.shift
+            shift_field = dict(source.filter_fields).get("shift")
+            if shift_field:
+                qs = qs.filter(**{shift_field: shift_id})
+            else:
+                qs = qs.filter(
+                    **{f"{field}__gte": starts_at, f"{field}__lt": ends_at}
+                )
+        return qs
+
+
+def split_param(params, name):
+    values = set()
+    for raw in params.getlist(name):
+        values.update(v.strip().upper() for v in raw.split(",") if v.strip())
+    return values
+
+
+def active_sources(filters=None):
+    if filters is None:
+        return TIMELINE_SOURCES
+    return tuple(source for source in TIMELINE_SOURCES if filters.includes(source))
+
+
+# MERGE ----------------------------------------------
+
+
+def fast_serialization() -> bool:
+    return getattr(settings, "TIMELINE_FAST_SERIALIZATION", True)
+
+
+def _rows(source, qs, fast):
+    """
+    What the merge reads from a source: .values() rows on the fast path,
+    model instances otherwise.
+    """
+    return source.values(qs) if fast else qs
+
+
+def _stream(source, items, fast):
+    key = source.row_sort_key if fast else source.sort_key
+    for item in items:
+        yield key(item), source, item
+
+
+def _render(source, item, fast):
+    return source.render_row(item) if fast else source.serialize(item)
+
+
+def _source_stream(source, resident_id, cursor, limit, filters, fast, as_of=None):
+    qs = source.queryset(resident_id, cursor=cursor, filters=filters, as_of=as_of)
+    qs = _rows(source, qs, fast)
+    if limit is not None:
+        qs = qs[: limit + 1]
+    if as_of is not None:
+        # Historical rows may hold delta-encoded text
+        qs = inflate_history(list(qs))
+    return _stream(source, qs, fast)
+
+
+def _merge_page(streams, limit, fast):
+    merged = heapq.merge(*streams, key=lambda entry: entry[0], reverse=True)
+
+    if limit is None:
+        entries = list(merged)
+        next_cursor = None
+    else:
+        entries = list(islice(merged, limit + 1))
+        next_cursor = None
+        if len(entries) > limit:
+            entries = entries[:limit]
+            next_cursor = encode_cursor(*entries[-1][0])
+
+    events = [_render(source, item, fast) for _, source, item in entries]
+    return events, next_cursor
+
+
+def merge_timeline(resident_id=None, cursor=None, limit=None, filters=None, as_of=None):
+    """
+    K-way merge of the timeline sources, newest first. resident_id=None
+    merges across all active residents.
+
+    With a limit, each source is capped at limit + 1 rows, so the work done
+    per page is bounded no matter how long the resident's history is. The
+    extra row tells us whether there is another page.
+
+    as_of rebuilds the timeline as it read at that moment from each
+    source's history (hot tables only, archived history is not included).
+
+    Returns (events, next_cursor). next_cursor is None on the last page.
+    """
+    # .values() rows would skip inflating compacted history text
+    fast = fast_serialization() and as_of is None
+    streams = [
+        _source_stream(source, resident_id, cursor, limit, filters, fast, as_of)
+        for source in active_sources(filters)
+    ]
+    return _merge_page(streams, limit, fast)
+
+
+async def amerge_timeline(resident_id=None, cursor=None, limit=None, filters=None):
+    """
+    merge_timeline with the per-source queries run concurrently.
+
+    By default the reads share Django's single sync thread, and so its
+    persistent connection, and run one after another. With
+    TIMELINE_ASYNC_CONCURRENT_QUERIES on, each source is read in its own
+    worker thread, so the wait is roughly the slowest query rather than the
+    sum. Each of those threads connects and disconnects per request, so only
+    turn it on behind a connection pooler.
+    """
+    fast = fast_serialization()
+    concurrent = getattr(settings, "TIMELINE_ASYNC_CONCURRENT_QUERIES", False)
+
+    def read(source):
+        try:
+            stream = _source_stream(source, resident_id, cursor, limit, filters, fast)
+            return list(stream)
+        finally:
+            if concurrent:
+                # Worker threads get their own connection; don't leak it
+                connections.close_all()
+
+    pages = await asyncio.gather(
+        *(
+            sync_to_async(read, thread_sensitive=not concurrent)(source)
+            for source in active_sources(filters)
+        )
+    )
+    return _merge_page(pages, limit, fast)
+
+
+def iter_timeline(resident_id, chunk_size=500, filters=None):
+    """
+    Lazily yield every serialised event for a resident, newest first.
+
+    Each source is read with a server-side iterator, so memory use depends on
+    chunk_size rather than on how many records the resident has.
+    """
+    fast = fast_serialization()
+    streams = []
+    for source in active_sources(filters):
+        qs = _rows(source, source.queryset(resident_id, filters=filters), fast)
+        streams.append(_stream(source, qs.iterator(chunk_size=chunk_size), fast))
+    for _, source, item in heapq.merge(
+        *streams, key=lambda entry: entry[0], reverse=True
+    ):
+        yield _render(source, item, fast)
+
+
+def union_timeline(resident_id=None, cursor=None, limit=None, filters=None):
+    """
+    Same contract as merge_timeline, but the ordering and limit are pushed
+    down to the database as a single UNION ALL query. Only the rows that made
+    the page are then loaded, with one pk lookup per source.
+    """
+    branches = [
+        source.union_branch(resident_id, cursor=cursor, filters=filters)
+        for source in active_sources(filters)
+    ]
+    if not branches:
+        return [], None
+
+    combined = branches[0].union(*branches[1:], all=True).order_by(
+        "-timestamp", "-event_type", "-id"
+    )
+    if limit is not None:
+        combined = combined[: limit + 1]
+
+    keys = list(combined)
+
+    next_cursor = None
+    if limit is not None and len(keys) > limit:
+        keys = keys[:limit]
+        next_cursor = encode_cursor(*keys[-1])
+
+    fast = fast_serialization()
+    by_type = {source.event_type: source for source in TIMELINE_SOURCES}
+    loaded = {}
+    for event_type, source in by_type.items():
+        ids = [pk for _, key_type, pk in keys if key_type == event_type]
+        if ids:
+            qs = source.model.objects.select_related(*source.related).filter(
+                id__in=ids
+            )
+            loaded[event_type] = {
+                (item["id"] if fast else item.pk): item
+                for item in _rows(source, qs, fast)
+            }
+
+    events = [
+        _render(by_type[event_type], loaded[event_type][pk], fast)
+        for _, event_type, pk in keys
+    ]
+    return events, next_cursor
+
+
+def materialized_timeline(resident_id=None, cursor=None, limit=None, filters=None):
+    """
+    Same contract as merge_timeline, read from the TimelineEvent table with a
+    single range scan on (resident, timestamp, event_type, source_id).
+    """
+    if resident_id is None:
+        qs = TimelineEvent.objects.filter(resident__is_active=True)
+    else:
+        qs = TimelineEvent.objects.filter(resident_id=resident_id)
+
+    if filters is not None:
+        qs = qs.filter(
+            event_type__in=[source.event_type for source in active_sources(filters)]
+        )
+        if filters.date_from is not None:
+            qs = qs.filter(timestamp__gte=filters.date_from)
+        if filters.date_to is not None:
+            qs = qs.filter(timestamp__lt=filters.date_to)
+        if filters.severities:
+            qs = qs.filter(payload__severity__in=list(filters.severities))
+        if filters.resident_ids:
+            qs = qs.filter(resident_id__in=filters.resident_ids)
+        if filters.shift is not None:
+            shift_id, starts_at, ends_at = filters.shift
+            qs = qs.filter(
+                Q(event_type="DAILY_LOG", payload__shift=shift_id)
+                | (
+                    ~Q(event_type="DAILY_LOG")
+                    & Q(timestamp__gte=starts_at, timestamp__lt=ends_at)
+                )
+            )
+    if cursor is not None:
+        timestamp, event_type, pk = cursor
+        qs = qs.filter(
+            Q(timestamp__lt=timestamp)
+            | Q(timestamp=timestamp, event_type__lt=event_type)
+            | Q(timestamp=timestamp, event_type=event_type, source_id__lt=pk)
+        )
+    qs = qs.order_by("-timestamp", "-event_type", "-source_id").values_list(
+        "timestamp", "event_type", "source_id", "resident_id", "payload"
+    )
+    if limit is not None:
+        qs = qs[: limit + 1]
+
+    rows = list(qs)
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(*rows[-1][:3])
+
+    events = [
+        {**payload, "resident_id": resident} for *_, resident, payload in rows
+    ]
+    return events, next_cursor
+
+
+TIMELINE_ENGINES = {
+    "merge": merge_timeline,
+    "union": union_timeline,
+    "materialized": materialized_timeline,
+}
+
+
+# CHANGE DETECTION ----------------------------------------------
+
+
+def _resident_history(source, resident_id):
+    """
+    History rows of every record that has ever been on the resident's
+    timeline, including the revisions that moved it to someone else.
+    """
+    history = source.model.history
+    ever_here = history.filter(**{source.resident_lookup: resident_id}).values("id")
+    return history.filter(id__in=ever_here)
+
+
+def timeline_watermark(resident):
+    """
+    Cheap fingerprint of a resident's timeline: (row count, last history_id,
+    last history_date) of each source's history for the records ever on it,
+    plus (row count, last updated_at) of its TimelineEvents and the
+    resident's own updated_at (the response carries their name). Every
+    create, edit, delete and move writes a history row; renamed authors and
+    reassigned medications re-render the TimelineEvents (see
+    core/signals.py). So the watermark moves whenever the timeline could
+    change. One aggregate query per source and one for the events, no rows
+    are loaded.
+    """
+    resident_id = resident.pk
+    watermark = {"RESIDENT": resident.updated_at}
+    for source in TIMELINE_SOURCES:
+        agg = _resident_history(source, resident_id).aggregate(
+            count=Count("history_id"),
+            last=Max("history_id"),
+            last_date=Max("history_date"),
+        )
+        watermark[source.event_type] = (
+            agg["count"],
+            agg["last"] or 0,
+            agg["last_date"],
+        )
+
+    agg = TimelineEvent.objects.filter(resident_id=resident_id).aggregate(
+        count=Count("id"), last=Max("updated_at")
+    )
+    watermark["EVENTS"] = (agg["count"], agg["last"])
+    return watermark
+
+
+def timeline_etag(resident_id, watermark, variant=""):
+    """
+    Quoted ETag for a timeline response. variant distinguishes responses that
+    differ for the same data (paging, engine, ...).
+    """
+    raw = json.dumps(
+        [resident_id, sorted(watermark.items()), variant], cls=DjangoJSONEncoder
+    )
+    return '"%s"' % hashlib.md5(raw.encode()).hexdigest()
+
+
+# Since token of a resident with no history yet
+_NO_HISTORY = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def encode_since_token(watermark) -> str:
+    """
+    Delta token: the newest history_date seen across the sources.
+    """
+    latest = max(
+        (
+            watermark[source.event_type][2]
+            for source in TIMELINE_SOURCES
+            if watermark[source.event_type][2] is not None
+        ),
+        default=_NO_HISTORY,
+    )
+    return encode_cursor(format_datetime(latest))
+
+
+def decode_since_token(token: str) -> datetime:
+    parts = decode_cursor(token)
+    since = None
+    if len(parts) == 1 and isinstance(parts[0], str):
+        since = parse_datetime(parts[0])
+    if since is None:
+        raise InvalidCursor("Invalid since token.")
+    return since
+
+
+def _since_overlap():
+    return timedelta(seconds=int(getattr(settings, "TIMELINE_SINCE_OVERLAP", 60)))
+
+
+def timeline_changes(resident_id, since, filters=None):
+    """
+    Events created or amended after a since token, newest first, plus the
+    (event_type, id) of anything that has since dropped off the (filtered)
+    timeline, including records moved to another resident.
+
+    Changes are found from the history of the records ever on the resident,
+    so only the records that actually moved are loaded. history_date is
+    stamped before a transaction commits, so the scan starts
+    TIMELINE_SINCE_OVERLAP seconds before the token. Any write that commits
+    within that long of being made is reported by the next poll. Changes
+    near the token may be reported again, and removed may name records the
+    client never had, so clients apply both idempotently by (event_type, id).
+
+    MAR records follow their medication. Reassigning a medication writes no
+    MAR history, so it only shows up as a new ETag, not in a delta.
+    """
+    fast = fast_serialization()
+    streams = []
+    removed = []
+    for source in active_sources(filters):
+        changed_ids = set(
+            _resident_history(source, resident_id)
+            .filter(history_date__gt=since - _since_overlap())
+            .values_list("id", flat=True)
+        )
+        if not changed_ids:
+            continue
+
+        qs = source.queryset(resident_id, filters=filters).filter(id__in=changed_ids)
+        rows = list(_rows(source, qs, fast))
+        still_there = {row["id"] if fast else row.pk for row in rows}
+        removed.extend(
+            {"event_type": source.event_type, "id": pk}
+            for pk in sorted(changed_ids - still_there)
+        )
+        streams.append(_stream(source, rows, fast))
+
+    merged = heapq.merge(*streams, key=lambda entry: entry[0], reverse=True)
+    events = [_render(source, item, fast) for _, source, item in merged]
+    return events, removed
+
+
+# MATERIALISED TABLE ----------------------------------------------
+
+
+def source_for_model(model):
+    for source in TIMELINE_SOURCES:
+        if source.model is model:
+            return source
+    return None
+
+
+def sync_timeline_event(source, obj):
+    """
+    Upsert (or drop) the TimelineEvent for one source row.
+    """
+    if getattr(obj, source.timestamp_field) is None:
+        remove_timeline_event(source, obj.pk)
+        return
+
+    event = source.to_event(obj)
+    TimelineEvent.objects.update_or_create(
+        event_type=source.event_type,
+        source_id=obj.pk,
+        defaults={
+            "resident_id": event.resident_id,
+            "timestamp": event.timestamp,
+            "payload": event.payload,
+        },
+    )
+
+
+def add_timeline_events(source, objs):
+    """
+    Bulk insert the TimelineEvents for freshly bulk-created source rows,
+    which never fire the post_save signal that normally writes them.
+    """
+    events = [
+        source.to_event(obj)
+        for obj in objs
+        if getattr(obj, source.timestamp_field) is not None
+    ]
+    return TimelineEvent.objects.bulk_create(events)
+
+
+def remove_timeline_event(source, pk):
+    TimelineEvent.objects.filter(event_type=source.event_type, source_id=pk).delete()
+
+
+def resync_timeline_events(source, events):
+    """
+    Re-render the TimelineEvents in ``events``, all from ``source``, from
+    their source rows. Returns how many were rewritten.
+    """
+    objs = list(
+        source.model.objects.filter(id__in=events.values("source_id")).select_related(
+            *source.related
+        )
+    )
+    if not objs:
+        return 0
+    with transaction.atomic():
+        TimelineEvent.objects.filter(
+            event_type=source.event_type, source_id__in=[obj.pk for obj in objs]
+        ).delete()
+        add_timeline_events(source, objs)
+    return len(objs)
+
+
+def resync_user_timeline_events(user):
+    """
+    Re-render the events that still show an old username for ``user``. One
+    query per user field when nothing is stale.
+    """
+    for source in TIMELINE_SOURCES:
+        for key, lookup in source.row_fields:
+            if not isinstance(lookup, tuple):
+                continue
+            records = source.model.objects.filter(**{lookup[0]: user.pk})
+            stale = TimelineEvent.objects.filter(
+                event_type=source.event_type, source_id__in=records.values("id")
+            ).exclude(**{f"payload__{key}__username": user.username})
+            resync_timeline_events(source, stale)
+
+
+def resync_medication_timeline_events(medication):
+    """
+    Move the MAR events of ``medication`` to its resident after the
+    medication was reassigned.
+    """
+    source = source_for_model(MedicationAdministrationRecord)
+    records = MedicationAdministrationRecord.objects.filter(medication=medication)
+    stale = TimelineEvent.objects.filter(
+        event_type=source.event_type, source_id__in=records.values("id")
+    ).exclude(resident_id=medication.resident_id)
+    resync_timeline_events(source, stale)
+
+
+def rebuild_timeline_events(resident_id=None, chunk_size=1000):
+    """
+    Recreate TimelineEvent rows from the source tables. Returns the number
+    of events written.
+    """
+    existing = TimelineEvent.objects.all()
+    if resident_id is not None:
+        existing = existing.filter(resident_id=resident_id)
+    existing.delete()
+
+    written = 0
+    for source in TIMELINE_SOURCES:
+        qs = source.model.objects.filter(
+            **{f"{source.timestamp_field}__isnull": False}
+        ).select_related(*source.related)
+        if resident_id is not None:
+            qs = qs.filter(**{source.resident_lookup: resident_id})
+
+        batch = []
+        for obj in qs.iterator(chunk_size=chunk_size):
+            batch.append(source.to_event(obj))
+            if len(batch) >= chunk_size:
+                TimelineEvent.objects.bulk_create(batch)
+                written += len(batch)
+                batch = []
+        if batch:
+            TimelineEvent.objects.bulk_create(batch)
+            written += len(batch)
+
+    return written
+
+
+def get_timeline_engine(name=None):
+    """
+    Resolve a timeline engine by name, falling back to the TIMELINE_ENGINE
+    setting. Raises ValueError for unknown engines.
+    """
+    name = name or getattr(settings, "TIMELINE_ENGINE", "merge")
+    try:
+        return TIMELINE_ENGINES[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown timeline engine. Choose one of: {', '.join(TIMELINE_ENGINES)}."
+        )
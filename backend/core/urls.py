@@ -1,7 +1,15 @@
 from django.urls import path
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from rest_framework.routers import DefaultRouter
-from .api import ResidentTimelineAPIView
+from .api import (
+    AuditChangesAPIView,
+    AuditChangesStreamAPIView,
+    HomeTimelineAPIView,
+    ResidentTimelineAPIView,
+    ResidentTimelineAsyncView,
+    ResidentTimelineStreamAPIView,
+    SyncAPIView,
+)
 from .views import (
     ResidentViewSet,
     ShiftViewSet,
@@ -28,6 +36,24 @@ urlpatterns = router.urls + [
         ResidentTimelineAPIView.as_view(),
         name="resident-timeline",
     ),
+    path(
+        "residents/<int:resident_id>/timeline/stream/",
+        ResidentTimelineStreamAPIView.as_view(),
+        name="resident-timeline-stream",
+    ),
+    path(
+        "residents/<int:resident_id>/timeline/async/",
+        ResidentTimelineAsyncView.as_view(),
+        name="resident-timeline-async",
+    ),
+    path("timeline/", HomeTimelineAPIView.as_view(), name="home-timeline"),
+    path("audit/changes/", AuditChangesAPIView.as_view(), name="audit-changes"),
+    path(
+        "audit/changes/stream/",
+        AuditChangesStreamAPIView.as_view(),
+        name="audit-changes-stream",
+    ),
+    path("sync/", SyncAPIView.as_view(), name="sync"),
     path("auth/token/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
     path("auth/token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
 ]
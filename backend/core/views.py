@@ -1,4 +1,5 @@
-from rest_framework import viewsets
+from rest_framework import status, viewsets
+from django.conf import settings
 from django.db import transaction
 from rest_framework.decorators import action
 from rest_framework.response import Response
@@ -6,7 +7,9 @@ from rest_framework.exceptions import PermissionDenied
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from django.db.models import Q
-from simple_history.utils import update_change_reason
+from django.utils import timezone
+from operator import attrgetter
+from simple_history.utils import bulk_create_with_history
 from .permissions import (
     IsStaff,
     IsManager,
@@ -23,6 +26,20 @@ from .models import (
     Medication,
     MedicationAdministrationRecord,
 )
+from .archive import archived_as_of, archived_history
+from .idempotency import idempotent
+from .history import (
+    HISTORY_ORDERING,
+    change_reason,
+    decode_history_cursor,
+    history_diffs,
+    history_page,
+    inflate_history,
+    parse_as_of,
+    parse_history_limit,
+    parse_id_list,
+    revisions_as_of,
+)
 from .serializers import (
     ResidentSerializer,
     ShiftSerializer,
@@ -35,6 +52,206 @@ from .serializers import (
     HistorySummaryEventSerializer,
     ResidentLookupSerializer,
 )
+from .timeline import add_timeline_events, source_for_model
+
+
+class HistoryActionsMixin:
+    """
+    Manager-only /history/ and /history-summary/ actions for a viewset whose
+    model has simple_history enabled.
+
+    Pass ?limit= (and ?cursor= from the previous response) to page through
+    the history newest first; the response is then
+    {"results": [...], "next_cursor": ...}. Without either, every revision
+    is returned as a list.
+    """
+
+    history_actions = {"history", "history_summary", "bulk_history_summary"}
+
+    def get_permissions(self):
+        # Manager-only history endpoints
+        if getattr(self, "action", None) in self.history_actions:
+            return [IsManager()]
+        return super().get_permissions()
+
+    def _history_response(self, serializer_class):
+        obj = self.get_object()
+
+        params = self.request.query_params
+        cursor = params.get("cursor")
+        limit = params.get("limit")
+        paginate = cursor is not None or limit is not None
+        try:
+            limit = parse_history_limit(limit) if paginate else None
+            cursor = decode_history_cursor(cursor) if cursor else None
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # The list may end with one extra (boundary) revision so the last row
+        # of the page still has something to diff against
+        history_list, page_size, next_cursor = history_page(
+            obj.history.select_related("history_user"),
+            cursor=cursor,
+            limit=limit,
+            archived=archived_history(obj.history.model, [obj.pk]),
+        )
+
+        serializer = serializer_class(
+            history_list[:page_size],
+            many=True,
+            context={
+                "history_list": history_list,
+                # Diffed once for the page; each row looks its own up by history_id
+                "history_diffs": history_diffs(history_list),
+            },
+        )
+        if not paginate:
+            return Response(serializer.data)
+        return Response({"results": serializer.data, "next_cursor": next_cursor})
+
+    @action(detail=True, methods=["get"])
+    def history(self, request, pk=None):
+        return self._history_response(HistoryRecordSerializer)
+
+    @action(
+        detail=True,
+        methods=["get"],
+        url_path="history-summary",
+        url_name="history-summary",
+    )
+    def history_summary(self, request, pk=None):
+        return self._history_response(HistorySummaryEventSerializer)
+
+    @action(
+        detail=False,
+        methods=["get"],
+        url_path="bulk-history-summary",
+        url_name="bulk-history-summary",
+    )
+    def bulk_history_summary(self, request):
+        """
+        ?ids=1,2,3 -> [{"id": 1, "history": [...]}, ...] for the records that
+        exist, in the order asked for. Every record's history is loaded in
+        one query and diffed per record.
+        """
+        maximum = int(getattr(settings, "HISTORY_BULK_MAX_IDS", 100))
+        try:
+            ids = parse_id_list(request.query_params.get("ids"), maximum)
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        found = set(
+            self.get_queryset().filter(id__in=ids).values_list("id", flat=True)
+        )
+        ids = [record_id for record_id in ids if record_id in found]
+
+        # Each record's revisions contiguous and newest first
+        history_model = self.get_queryset().model.history.model
+        history_list = inflate_history(
+            list(
+                history_model.objects.filter(id__in=ids)
+                .select_related("history_user")
+                .order_by("id", *HISTORY_ORDERING)
+            )
+        )
+        archived = archived_history(history_model, ids)
+        if archived:
+            history_list = sorted(
+                history_list + archived,
+                key=lambda h: (-h.id, h.history_date, h.history_id),
+                reverse=True,
+            )
+
+        serializer = HistorySummaryEventSerializer(
+            history_list,
+            many=True,
+            context={
+                "history_list": history_list,
+                "history_diffs": history_diffs(history_list),
+            },
+        )
+
+        grouped = {record_id: [] for record_id in ids}
+        for row, data in zip(history_list, serializer.data):
+            grouped[row.id].append(data)
+        return Response(
+            [{"id": record_id, "history": grouped[record_id]} for record_id in ids]
+        )
+
+
+def _sort_like(rows, ordering):
+    """
+    Sort rows in Python the way order_by(*ordering) would, nulls last.
+    """
+    for field in reversed(ordering):
+        name = field.lstrip("-")
+        present = [row for row in rows if getattr(row, name) is not None]
+        missing = [row for row in rows if getattr(row, name) is None]
+        present.sort(key=attrgetter(name), reverse=field.startswith("-"))
+        rows = present + missing
+    return rows
+
+
+class AsOfMixin:
+    """
+    ?as_of=<ISO datetime or date> on list and retrieve returns the records
+    as they stood at that moment, read from their history (archived history
+    included) with one (id, history_date) index seek per record.
+    """
+
+    def _as_of(self):
+        raw = self.request.query_params.get("as_of")
+        return parse_as_of(raw) if raw else None
+
+    def _records_as_of(self, queryset, as_of):
+        ordering = queryset.query.order_by
+        rows = inflate_history(
+            list(revisions_as_of(queryset, as_of).order_by(*ordering))
+        )
+        archived = archived_as_of(queryset, as_of)
+        if archived:
+            rows = _sort_like(rows + archived, ordering)
+        return rows
+
+    def list(self, request, *args, **kwargs):
+        try:
+            as_of = self._as_of()
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        if as_of is None:
+            return super().list(request, *args, **kwargs)
+
+        rows = self._records_as_of(self.filter_queryset(self.get_queryset()), as_of)
+        return Response(self.get_serializer(rows, many=True).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            as_of = self._as_of()
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        if as_of is None:
+            return super().retrieve(request, *args, **kwargs)
+
+        obj = self.get_object()
+        rows = self._records_as_of(self.get_queryset().filter(pk=obj.pk), as_of)
+        if not rows:
+            return Response(
+                {"detail": "This record did not exist at as_of."},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        return Response(self.get_serializer(rows[0]).data)
+
+
+class IdempotentCreateMixin:
+    """
+    POST with an Idempotency-Key header: a retry with the same key gets the
+    first response back without validating or writing again
+    (see core.idempotency).
+    """
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
 
 
 class ResidentViewSet(viewsets.ModelViewSet):
@@ -68,7 +285,7 @@ class ShiftViewSet(viewsets.ModelViewSet):
     permission_classes = [IsStaff]
 
 
-class DailyLogViewSet(viewsets.ModelViewSet):
+class DailyLogViewSet(IdempotentCreateMixin, AsOfMixin, viewsets.ModelViewSet):
     queryset = DailyLog.objects.select_related("resident", "author").order_by(
         "-event_at"
     )
@@ -76,31 +293,84 @@ class DailyLogViewSet(viewsets.ModelViewSet):
     permission_classes = [IsStaff, IsAuthorOrManager]
 
     def perform_create(self, serializer):
-        instance = serializer.save(author=self.request.user)
-        instance._history_request = self.request
-
-        # For late entries, also mirror the reason into history_change_reason (human readable audit)
-        reason = (serializer.validated_data.get("edit_reason_detail") or "").strip()
+        # Built here rather than by serializer.save() so a late-entry reason is
+        # on the instance before its first save and goes in with the history row
+        instance = DailyLog(**serializer.validated_data, author=self.request.user)
+        reason = change_reason(
+            DailyLog, serializer.validated_data.get("edit_reason_detail")
+        )
         if reason:
-            update_change_reason(instance, reason)
+            instance._change_reason = reason
+        instance.save()
+        serializer.instance = instance
 
     def perform_update(self, serializer):
         instance = serializer.instance
         instance._history_user = self.request.user
-
-        reason = (serializer.validated_data.get("edit_reason_detail") or "").strip()
-        instance._change_reason = reason
-
-        saved = serializer.save()
-
-        if reason:
-            update_change_reason(saved, reason)
+        instance._change_reason = change_reason(
+            DailyLog, serializer.validated_data.get("edit_reason_detail")
+        )
+        serializer.save()
+
+    @action(detail=False, methods=["post"], url_path="batch")
+    @idempotent
+    def batch_create(self, request):
+        """
+        POST a list of daily logs (a shift handover) to record them together.
+        Late-entry rules are checked for every row against one "now". Valid
+        rows are saved even when others fail; the response lists what was
+        created and the errors for the rest by their index in the request.
+        """
+        rows = request.data
+        maximum = int(getattr(settings, "DAILY_LOG_BATCH_MAX_RECORDS", 100))
+        if not isinstance(rows, list) or not rows:
+            return Response(
+                {"detail": "Send a non-empty list of daily logs."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(rows) > maximum:
+            return Response(
+                {"detail": f"At most {maximum} daily logs can be sent at once."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        now = timezone.now()
+        context = {**self.get_serializer_context(), "now": now}
+
+        logs, errors = [], []
+        for index, row in enumerate(rows):
+            serializer = self.get_serializer_class()(data=row, context=context)
+            if not serializer.is_valid():
+                errors.append({"index": index, "errors": serializer.errors})
+                continue
+            log = DailyLog(
+                **serializer.validated_data, author=request.user, recorded_at=now
+            )
+            log._change_reason = change_reason(
+                DailyLog, serializer.validated_data.get("edit_reason_detail")
+            )
+            logs.append(log)
+
+        if logs:
+            # bulk_create skips post_save, so the timeline events are written here
+            with transaction.atomic():
+                logs = bulk_create_with_history(
+                    logs, DailyLog, default_user=request.user, default_date=now
+                )
+                add_timeline_events(source_for_model(DailyLog), logs)
+
+        return Response(
+            {"created": self.get_serializer(logs, many=True).data, "errors": errors},
+            status=status.HTTP_201_CREATED if logs else status.HTTP_400_BAD_REQUEST,
+        )
 
     def destroy(self, request, *args, **kwargs):
         raise PermissionDenied("Deletion is not permitted for clinical records.")
 
 
-class IncidentViewSet(viewsets.ModelViewSet):
+class IncidentViewSet(
+    IdempotentCreateMixin, AsOfMixin, HistoryActionsMixin, viewsets.ModelViewSet
+):
     queryset = Incident.objects.select_related("resident", "reported_by").order_by(
         "-occurred_at"
     )
@@ -117,67 +387,18 @@ class IncidentViewSet(viewsets.ModelViewSet):
         instance._history_user = self.request.user
         instance._history_request = self.request
 
-        reason = (
-            serializer.validated_data.get("edit_reason_detail") or ""
-        ).strip() or (
-            serializer.validated_data.get("last_edit_reason_detail") or ""
-        ).strip()
-
-        instance._change_reason = reason
-
-        saved = serializer.save()
-
-        if reason:
-            # Ensure we write to the *actual* newest history row created by this save
-            def _write_reason():
-                latest_hist = saved.history.order_by(
-                    "-history_date", "-history_id"
-                ).first()
-                if latest_hist:
-                    latest_hist.history_change_reason = reason
-                    latest_hist.save(update_fields=["history_change_reason"])
-
-            transaction.on_commit(_write_reason)
-
-    def get_permissions(self):
-        if getattr(self, "action", None) in {"history", "history_summary"}:
-            return [IsManager()]
-        return [permission() for permission in self.permission_classes]
-
-    @action(detail=True, methods=["get"])
-    def history(self, request, pk=None):
-        incident = self.get_object()
-        qs = incident.history.all().order_by("-history_date")
-
-        serializer = HistoryRecordSerializer(
-            qs,
-            many=True,
-            context={"history_list": list(qs)},  # <-- MUST match qs ordering
+        instance._change_reason = change_reason(
+            Incident,
+            serializer.validated_data.get("edit_reason_detail"),
+            serializer.validated_data.get("last_edit_reason_detail"),
         )
-        return Response(serializer.data)
-
-    @action(
-        detail=True,
-        methods=["get"],
-        url_path="history-summary",
-        url_name="history-summary",
-    )
-    def history_summary(self, request, pk=None):
-        incident = self.get_object()
-        qs = incident.history.all().order_by("-history_date")
-
-        serializer = HistorySummaryEventSerializer(
-            qs,
-            many=True,
-            context={"history_list": list(qs)},  # <-- MUST match qs ordering
-        )
-        return Response(serializer.data)
+        serializer.save()
 
     def destroy(self, request, *args, **kwargs):
         raise PermissionDenied("Deletion of incidents is not permitted.")
 
 
-class CarePlanViewSet(viewsets.ModelViewSet):
+class CarePlanViewSet(AsOfMixin, viewsets.ModelViewSet):
     queryset = CarePlan.objects.select_related("resident").order_by("-updated_at")
     serializer_class = CarePlanSerializer
     permission_classes = [IsManager]
@@ -189,7 +410,9 @@ class MedicationViewSet(viewsets.ModelViewSet):
     permission_classes = [IsStaff]
 
 
-class MedicationAdministrationRecordViewSet(viewsets.ModelViewSet):
+class MedicationAdministrationRecordViewSet(
+    IdempotentCreateMixin, AsOfMixin, HistoryActionsMixin, viewsets.ModelViewSet
+):
     queryset = MedicationAdministrationRecord.objects.select_related(
         "medication", "administered_by"
     ).order_by("-administered_at")
@@ -197,15 +420,20 @@ class MedicationAdministrationRecordViewSet(viewsets.ModelViewSet):
     permission_classes = [IsStaff, IsAdministererOrManager]
 
     def perform_create(self, serializer):
-        instance = serializer.save(administered_by=self.request.user)
-
-        # Attribute history
+        # Built here rather than by serializer.save() so the history user and
+        # any reason given on create go in with the first history row
+        instance = MedicationAdministrationRecord(
+            **serializer.validated_data, administered_by=self.request.user
+        )
         instance._history_user = self.request.user
-
-        # Optional parity: if a reason was provided on create, mirror it into history_change_reason
-        reason = (serializer.validated_data.get("edit_reason_detail") or "").strip()
+        reason = change_reason(
+            MedicationAdministrationRecord,
+            serializer.validated_data.get("edit_reason_detail"),
+        )
         if reason:
-            update_change_reason(instance, reason)
+            instance._change_reason = reason
+        instance.save()
+        serializer.instance = instance
 
     def perform_update(self, serializer):
         instance = serializer.instance
@@ -213,62 +441,61 @@ class MedicationAdministrationRecordViewSet(viewsets.ModelViewSet):
         instance._history_user = self.request.user
         instance._history_request = self.request
 
-        reason = (
-            serializer.validated_data.get("edit_reason_detail") or ""
-        ).strip() or (
-            serializer.validated_data.get("last_edit_reason_detail") or ""
-        ).strip()
-
-        instance._change_reason = reason
-
-        saved = serializer.save()
-
-        if reason:
-
-            def _write_reason():
-                latest_hist = saved.history.order_by(
-                    "-history_date", "-history_id"
-                ).first()
-                if latest_hist:
-                    latest_hist.history_change_reason = reason
-                    latest_hist.save(update_fields=["history_change_reason"])
-
-            transaction.on_commit(_write_reason)
-
-    def get_permissions(self):
-        # Manager-only history endpoints
-        if getattr(self, "action", None) in {"history", "history_summary"}:
-            return [IsManager()]
-        return [permission() for permission in self.permission_classes]
-
-    @action(detail=True, methods=["get"])
-    def history(self, request, pk=None):
-        mar = self.get_object()
-        qs = mar.history.all().order_by("-history_date")
-
-        serializer = HistoryRecordSerializer(
-            qs,
-            many=True,
-            context={"history_list": list(qs)},  # <-- MUST match qs ordering
+        instance._change_reason = change_reason(
+            MedicationAdministrationRecord,
+            serializer.validated_data.get("edit_reason_detail"),
+            serializer.validated_data.get("last_edit_reason_detail"),
         )
-        return Response(serializer.data)
-
-    @action(
-        detail=True,
-        methods=["get"],
-        url_path="history-summary",
-        url_name="history-summary",
-    )
-    def history_summary(self, request, pk=None):
-        mar = self.get_object()
-        qs = mar.history.all().order_by("-history_date")
-
-        serializer = HistorySummaryEventSerializer(
-            qs,
-            many=True,
-            context={"history_list": list(qs)},  # <-- MUST match qs ordering
+        serializer.save()
+
+    @action(detail=False, methods=["post"], url_path="bulk")
+    @idempotent
+    def bulk_create(self, request):
+        """
+        POST a list of MAR entries (one medication round) to record them all
+        in one transaction. Validation runs per entry; if any entry is
+        invalid nothing is saved and the errors come back in request order.
+        """
+        maximum = int(getattr(settings, "MAR_BULK_MAX_RECORDS", 100))
+        if isinstance(request.data, list) and len(request.data) > maximum:
+            return Response(
+                {"detail": f"At most {maximum} records can be sent at once."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        serializer = self.get_serializer(
+            data=request.data, many=True, allow_empty=False
+        )
+        serializer.is_valid(raise_exception=True)
+
+        records = []
+        for attrs in serializer.validated_data:
+            record = MedicationAdministrationRecord(
+                **attrs, administered_by=request.user
+            )
+            # Same parity as perform_create: a reason on create goes to history
+            record._change_reason = change_reason(
+                MedicationAdministrationRecord, attrs.get("edit_reason_detail")
+            )
+            records.append(record)
+
+        # bulk_create skips post_save, so the timeline events are written here.
+        # Created revisions have no field changes or text deltas to store
+        with transaction.atomic():
+            records = bulk_create_with_history(
+                records,
+                MedicationAdministrationRecord,
+                default_user=request.user,
+                default_date=timezone.now(),
+            )
+            add_timeline_events(
+                source_for_model(MedicationAdministrationRecord), records
+            )
+
+        return Response(
+            self.get_serializer(records, many=True).data,
+            status=status.HTTP_201_CREATED,
         )
-        return Response(serializer.data)
 
     def destroy(self, request, *args, **kwargs):
         raise PermissionDenied("Medication administration records cannot be deleted.")